@@ -1,4 +1,6 @@
 from typing import Union
+from kik_unofficial.datatypes.membership import GroupMembershipChange
+from kik_unofficial.datatypes.peers import Peer
 from kik_unofficial.datatypes.xmpp.account import GetMyProfileResponse, GetMutedConvosResponse
 from kik_unofficial.datatypes.xmpp import chatting
 from kik_unofficial.datatypes.xmpp.errors import LoginError, SignUpError
@@ -113,6 +115,16 @@ class KikClientCallback:
     def on_group_sysmsg_received(self, response: chatting.IncomingGroupSysmsg):
         pass
 
+    def on_group_membership_changed(self, change: GroupMembershipChange):
+        """
+        Gets called when a group status or sysmsg message changes the members of a group:
+        a member joined, left, was banned, promoted or demoted (see the subclasses of GroupMembershipChange).
+        Changes are found by applying the message to the members kept in KikClient.roster_index,
+        so the roster must be fetched first for changes to be reported for a group.
+        :param change: The change, such as a MemberJoined
+        """
+        pass
+
     def on_group_receipts_received(self, response: chatting.IncomingGroupReceiptsEvent):
         pass
 
@@ -158,6 +170,16 @@ class KikClientCallback:
     def on_roster_received(self, response: FetchRosterResponse):
         pass
 
+    def on_roster_peer(self, peer: Peer):
+        """
+        Gets called for each new or updated user or group of a roster response, as it's parsed, before on_roster_received.
+        If this is implemented, the users and groups aren't collected in FetchRosterResponse.peers (which is left empty),
+        so that huge rosters can be processed without holding a Peer object for each of their users and groups at once.
+        The stanza of each roster page is still parsed and held whole while its peers are passed on.
+        :param peer: A RosterUser or a Group
+        """
+        pass
+
     def on_connection_failed(self, response: ConnectionFailedResponse):
         pass
 
@@ -188,3 +210,14 @@ class KikClientCallback:
         When received, you will be unable to send or receive any stanzas until the current time is greater than the ban end time.
         """
         pass
+
+
+def is_overridden(callback, event: str) -> bool:
+    """
+    Returns True if a callback object implements an event (such as "on_message_read"),
+    rather than inheriting the empty implementation of KikClientCallback.
+    """
+    method = getattr(callback, event, None)
+    if method is None:
+        return False
+    return getattr(method, "__func__", method) is not getattr(KikClientCallback, event, None)
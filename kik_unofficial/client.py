@@ -6,10 +6,10 @@ import pathlib
 import ssl
 import time
 import traceback
-from threading import Thread, Event
-from typing import Union, List
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from threading import Thread, Event, Lock
+from typing import Callable, Iterable, Union, List
 from asyncio import StreamReader, StreamWriter
-from bs4 import BeautifulSoup
 
 import kik_unofficial.callbacks as callbacks
 import kik_unofficial.datatypes.xmpp.chatting as chatting
@@ -21,13 +21,28 @@ import kik_unofficial.datatypes.xmpp.sign_up as sign_up
 import kik_unofficial.xmlns_handlers as xmlns_handlers
 from kik_unofficial.datatypes.xmpp.auth_stanza import AuthStanza
 from kik_unofficial.datatypes.xmpp import account, xiphias
-from kik_unofficial.parser.parser import KikXmlParser
+from kik_unofficial.parser.parser import HeadOnlyStanza, KikXmlParser
+from kik_unofficial.parser.xml_element import XmlElement
+from kik_unofficial.roster.index import RosterIndex
+from kik_unofficial.roster.store import RosterStore
+from kik_unofficial.roster.sync import RosterSync
 from kik_unofficial.utilities import xml_utilities, jid_utilities
 from kik_unofficial.utilities.cryptographic_utilities import CryptographicUtils
+from kik_unofficial.utilities.group_admin_executor import GroupAdminExecutor
+from kik_unofficial.utilities.image_pipeline import ImagePreparationPool, PreparedImageCache
 from kik_unofficial.utilities.kik_server_clock import KikServerClock
-from kik_unofficial.utilities.threading_utils import run_in_new_thread
-from kik_unofficial.datatypes.xmpp.base_elements import XMPPElement, XMPPResponse
+from kik_unofficial.utilities.pending_iqs import PendingIqs
+from kik_unofficial.utilities.threading_utils import chain_future, resolve_future, run_in_new_thread
+from kik_unofficial.datatypes.exceptions import KikApiException
+from kik_unofficial.datatypes.peers import Peer, ProfilePic
+from kik_unofficial.datatypes.xmpp.base_elements import XMPPContentResponse, XMPPElement, XMPPOutgoingContentMessageElement, XMPPResponse
 from kik_unofficial.http_requests import profile_pictures, content
+from kik_unofficial.http_requests.content_fetcher import ContentFetcher
+from kik_unofficial.http_requests.http_client import KikHttpClient
+from kik_unofficial.http_requests.link_preview import LinkPreviewService
+from kik_unofficial.http_requests.profile_picture_cache import ProfilePictureCache
+from kik_unofficial.http_requests.tenor_client import KikTenorClient
+from kik_unofficial.http_requests.upload_executor import UploadExecutor
 from kik_unofficial.utilities.credential_utilities import random_device_id, random_android_id
 from kik_unofficial.utilities.logging_utils import set_up_basic_logging
 
@@ -51,6 +66,18 @@ class KikClient:
         enable_console_logging: bool = False,
         log_file_path: str = None,
         disable_auth_cert: bool = True,
+        image_workers: Union[int, None] = None,
+        image_mp_context=None,
+        image_cache_dir: Union[str, None] = None,
+        image_cache_max_bytes: int = 100 * 1024 * 1024,
+        content_cache_dir: Union[str, None] = None,
+        content_cache_max_bytes: int = 500 * 1024 * 1024,
+        profile_picture_cache_dir: Union[str, None] = None,
+        profile_picture_cache_max_bytes: int = 50 * 1024 * 1024,
+        raw_element_mode: str = XMPPResponse.RAW_ELEMENT_KEEP,
+        subscribed_events: Union[Iterable[str], None] = None,
+        roster_store_path: Union[str, None] = None,
+        index_roster: bool = False,
     ) -> None:
         """
         Initializes a connection to Kik servers.
@@ -70,6 +97,31 @@ class KikClient:
         :param disable_auth_cert: If true, auth certs will not be generated on every connection.
             This greatly improves startup time.
             True by default.
+        :param image_workers: The number of processes used to prepare outgoing images.
+            Defaults to 0, which prepares them on a background thread instead.
+            The processes import the __main__ module again when they start, so a script that sets this
+            must keep its top-level code under `if __name__ == "__main__":`.
+            If they fail, images are prepared on the background thread instead.
+        :param image_mp_context: The multiprocessing context used to start the image processes.
+            Defaults to "forkserver" where it's available, else "spawn", since forking the client's threads can deadlock.
+        :param image_cache_dir: If set, prepared and uploaded images are cached in this directory,
+            so sending the same image again skips re-encoding and re-uploading it.
+        :param image_cache_max_bytes: The maximum disk space used by the image cache.
+        :param content_cache_dir: If set, content downloaded with fetch_content is cached in this directory.
+        :param content_cache_max_bytes: The maximum disk space used by the content cache.
+        :param profile_picture_cache_dir: The directory in which profile pictures fetched with fetch_profile_picture are cached.
+            Required to fetch profile pictures.
+        :param profile_picture_cache_max_bytes: The maximum disk space used by the profile picture cache.
+        :param raw_element_mode: How incoming messages keep the stanza they were parsed from (their raw_element):
+            "keep" (default), "lazy" (kept as markup and parsed again on access) or "drop".
+            Bots that keep many messages in memory should use "lazy" or "drop".
+        :param subscribed_events: The names of the callback methods to call, such as {"on_chat_message_received"}.
+            Incoming stanzas for other events aren't parsed. By default, the methods overridden by the callback are called.
+        :param roster_store_path: The path of an SQLite database in which the roster is kept by sync_roster().
+            Required to sync the roster.
+        :param index_roster: If true, the roster and the members of groups are indexed in roster_index for fast lookups
+            (such as roster_index.is_admin(group_jid, jid)). The index is updated from roster responses and group status and sysmsg messages,
+            and loaded from the roster store if there's one. Always on if the callback implements on_group_membership_changed.
         """
         # turn on logging with basic configuration
         self.log = set_up_basic_logging(
@@ -84,9 +136,11 @@ class KikClient:
         self.android_id = android_id
 
         self.callback = callback
+        self.subscribed_events = self._check_events(subscribed_events) if subscribed_events is not None else None
         if self.callback:
             self.callback._on_client_init(self)
         self.authenticator = AuthStanza(self)
+        self.stanza_router = xmlns_handlers.StanzaRouter.with_default_handlers(self.callback, self)
 
         self.connected = False
         self.authenticated = False
@@ -97,10 +151,57 @@ class KikClient:
 
         self._known_users_information = set()
         self._new_user_added_event = Event()
+        self._pending_iqs = PendingIqs()
+
+        self.stanza_router.raw_element_mode = XMPPResponse.check_raw_element_mode(raw_element_mode)
 
         self.should_login_on_connection = kik_username is not None and kik_password is not None
         self.disable_auth_cert = disable_auth_cert
         self._last_ping_sent_time = 0
+        image_cache = PreparedImageCache(image_cache_dir, image_cache_max_bytes) if image_cache_dir else None
+        self.image_preparation = ImagePreparationPool(max_workers=image_workers, mp_context=image_mp_context, cache=image_cache)
+        self.http_client = KikHttpClient()
+        self.upload_executor = UploadExecutor(self.http_client)
+        self._tenor_clients = {}  # type: dict[str, KikTenorClient]
+        self._tenor_clients_lock = Lock()
+        self._send_executor = None  # type: ThreadPoolExecutor | None
+        self._send_executor_lock = Lock()
+        self._media_executor = None  # type: ThreadPoolExecutor | None
+        self._media_executor_lock = Lock()
+        self._group_update_executor = None  # type: ThreadPoolExecutor | None
+        self._group_update_executor_lock = Lock()
+        self.link_previews = LinkPreviewService(self.http_client)
+        self.group_admin = GroupAdminExecutor(self._send_iq)
+        self.content_fetcher = ContentFetcher(self.http_client, cache_dir=content_cache_dir, cache_max_bytes=content_cache_max_bytes)
+        self.roster_store = RosterStore(roster_store_path) if roster_store_path else None
+        if index_roster or self.is_subscribed("on_group_membership_changed"):
+            self.roster_index = RosterIndex(on_inconsistency=self._refresh_roster_of_group)
+        else:
+            self.roster_index = None
+        self.roster_sync = (
+            RosterSync(self.roster_store, self._send_xmpp_element, on_reset=self.roster_index.clear if self.roster_index is not None else None)
+            if self.roster_store is not None
+            else None
+        )
+        # without a roster store, out of date groups are refreshed by a sync of their own, which only keeps the page tokens.
+        # Its pages only go to the index (the callback didn't ask for them). A full fetch doesn't clear the index first,
+        # but the peers it didn't list are removed once it's done.
+        self._index_sync = (
+            RosterSync(
+                None,
+                self._send_xmpp_element,
+                on_reset=self.roster_index.begin_full_fetch,
+                on_page=self._apply_roster_page_to_index,
+                on_full_fetch_done=self.roster_index.end_full_fetch,
+            )
+            if self.roster_index is not None and self.roster_store is None
+            else None
+        )
+        if self.roster_index is not None and self.roster_store is not None:
+            self.roster_index.add_peers(self.roster_store.iter_peers())
+        self.profile_picture_cache = (
+            ProfilePictureCache(profile_picture_cache_dir, self.http_client, profile_picture_cache_max_bytes) if profile_picture_cache_dir else None
+        )
         self._connect()
 
     def _connect(self):
@@ -188,6 +289,32 @@ class KikClient:
         self.log.info("Requesting roster (list of chat partners)...")
         return self._send_xmpp_element(roster.FetchRosterRequest(is_batched=is_batched, timestamp=timestamp, mts=mts))
 
+    def sync_roster(self) -> Future:
+        """
+        Brings the roster kept in roster_store up to date.
+        Only the changes since the last sync are fetched, or the whole roster on the first sync.
+        All the pages of the roster are fetched, and on_roster_received is called for each one.
+
+        Requires roster_store_path to be set.
+
+        :return: a Future of the RosterStore, resolved once the sync is complete
+        """
+        if self.roster_sync is None:
+            raise KikApiException("Set roster_store_path to sync the roster")
+        return self.roster_sync.start()
+
+    def _refresh_roster_of_group(self, group_jid: str):
+        """
+        Fetches the roster again when the members of a group in roster_index are out of date.
+        """
+        self.log.info(f"Refreshing the roster, the members of {group_jid} are out of date")
+        # all the pages since the last sync are fetched, which include the group. Does nothing if a sync is already in progress.
+        (self.roster_sync or self._index_sync).start()
+
+    def _apply_roster_page_to_index(self, response: roster.FetchRosterResponse):
+        self.roster_index.add_peers(response.iter_peers())
+        self.roster_index.remove_peers(response.removed_users + response.removed_groups)
+
     # -------------------------------
     # Common Messaging Operations
     # -------------------------------
@@ -206,25 +333,105 @@ class KikClient:
         self.log.info(f"Sending chat message '{message}' to {'group' if chat_message.is_group else 'chat'} '{peer_jid}'...")
         return self._send_xmpp_element(chat_message)
 
-    def send_chat_image(self, peer_jid: str, file, forward: bool = True):
+    def send_chat_image(self, peer_jid: str, file, forward: bool = True, on_done: Union[Callable[[Future], None], None] = None) -> str:
         """
         Sends an image chat message to another person or a group with the given JID/username.
+        The image is prepared and uploaded in the background (see the image_workers parameter),
+        so this returns before the image is actually sent.
+
         :param peer_jid: The Jabber ID for which to send the message (looks like username_ejs@talk.kik.com)
                          If you don't know the JID of someone, you can also specify a kik username here.
         :param file: The path to the image file OR its bytes OR an IOBase object to send.
         :param forward: True to allow the client to forward the image to other chats
+        :param on_done: If given, called once the message is sent or failed, with a Future of the UUID of the message.
+                        The Future fails with KikUploadError if the upload failed, or with the error that prevented preparing the image.
+        :return: The UUID of the image message
         """
         peer_jid = self.get_jid(peer_jid)
-        image = chatting.OutgoingChatImage(peer_jid, file, forward)
+        prepared = self.image_preparation.submit(file)
+        image = chatting.OutgoingChatImage(peer_jid, prepared, forward)
         self.log.info(f"Sending chat image to {'group' if image.is_group else 'user'} '{peer_jid}'...")
+        sent = self._new_send_future(on_done)
+        prepared.add_done_callback(lambda _: self._run_media_task(self._upload_image, image, sent))
+        return image.message_id
 
-        content.upload_gallery_image(
-            image,
-            f"{self.kik_node}@talk.kik.com",
-            self.username,
-            self.password,
-        )
-        return self._send_xmpp_element(image)
+    def send_chat_video(
+        self,
+        peer_jid: str,
+        file,
+        thumbnail=None,
+        forward: bool = True,
+        auto_play: bool = False,
+        loop: bool = False,
+        muted: bool = False,
+        on_done: Union[Callable[[Future], None], None] = None,
+    ) -> str:
+        """
+        Sends a video chat message to another person or a group with the given JID/username.
+        The video is hashed and uploaded in the background, streaming it from the file,
+        so this returns before the video is actually sent.
+
+        :param peer_jid: The Jabber ID for which to send the message (looks like username_ejs@talk.kik.com)
+                         If you don't know the JID of someone, you can also specify a kik username here.
+        :param file: The path to the video file (an MP4) OR its bytes OR an IOBase object to send.
+        :param thumbnail: The image shown before the video is played (path, bytes or IOBase).
+                          If not given, it's extracted from the video with ffmpeg, when installed.
+        :param forward: True to allow the client to forward the video to other chats
+        :param auto_play: True if the video should play automatically
+        :param loop: True if the video should play in a loop
+        :param muted: True if the video should play muted
+        :param on_done: If given, called once the message is sent or failed, with a Future of the UUID of the message.
+                        The Future fails with KikUploadError if the upload failed, or with the error that prevented preparing the video.
+        :return: The UUID of the video message
+        """
+        peer_jid = self.get_jid(peer_jid)
+        video = chatting.OutgoingChatVideo(peer_jid, file, thumbnail, forward, auto_play, loop, muted)
+        self.log.info(f"Sending chat video to {'group' if video.is_group else 'user'} '{peer_jid}'...")
+        sent = self._new_send_future(on_done)
+        self._run_media_task(self._upload_video, video, sent)
+        return video.message_id
+
+    def fetch_content(self, message: XMPPContentResponse, destination: Union[str, None] = None) -> Future:
+        """
+        Downloads the file of an incoming content message (an image, a video, etc.) in the background.
+        Fetching the same content multiple times at once only downloads it once.
+
+        :param message: The content message (for example an IncomingImageMessage or an IncomingVideoMessage)
+        :param destination: If given, the file is streamed to this path instead of being loaded into memory
+        :return: A Future of the file's bytes, or of the destination path if one was given.
+                 Fails with KikDownloadError if the download failed.
+        """
+        return self.content_fetcher.fetch(message, destination=destination)
+
+    def fetch_profile_picture(self, peer: Union[Peer, ProfilePic], full_size: bool = True) -> Future:
+        """
+        Fetches the profile picture of a user or a group in the background.
+        Pictures are cached in profile_picture_cache_dir and only downloaded again when they change.
+
+        :param peer: The user or group (for example from on_peer_info_received), or its profile_pic
+        :param full_size: True for the full size picture, False for the thumbnail
+        :return: A Future of the JPEG bytes of the picture. Fails with KikDownloadError if the download failed.
+        """
+        pic = peer if isinstance(peer, ProfilePic) else peer.profile_pic
+        if pic is None:
+            raise KikApiException(f"{peer} has no profile picture")
+        return self._get_profile_picture_cache().get(pic, full_size)
+
+    def prefetch_profile_pictures(self, peers: List[Union[Peer, ProfilePic]], full_size: bool = False) -> List[Future]:
+        """
+        Fetches the profile pictures of many users or groups concurrently (for example, a whole roster),
+        so later calls to fetch_profile_picture return them from the cache.
+
+        :param peers: The users or groups, or their profile pictures. Peers without a profile picture are skipped.
+        :param full_size: True for the full size pictures, False for the thumbnails
+        :return: A Future for each picture, as returned by fetch_profile_picture
+        """
+        return self._get_profile_picture_cache().prefetch(peers, full_size)
+
+    def _get_profile_picture_cache(self) -> ProfilePictureCache:
+        if self.profile_picture_cache is None:
+            raise KikApiException("Set profile_picture_cache_dir to fetch profile pictures")
+        return self.profile_picture_cache
 
     def send_read_receipt(self, peer_jid: str, receipt_message_id: Union[str, list[str]], group_jid=None):
         """
@@ -290,17 +497,49 @@ class KikClient:
 
     # Uncomment if you want to set your api key here
     # def send_gif_image(self, peer_jid, search_term, api_key = "YOUR_API_KEY"):
-    def send_gif_image(self, peer_jid: str, search_term: str, api_key: str):
+    def send_gif_image(self, peer_jid: str, search_term: str, api_key: str, on_done: Union[Callable[[Future], None], None] = None) -> str:
         """
         Sends a GIF image to another person or a group with the given JID/username.
         The GIF is taken from tenor.com, based on search keywords.
+        The search runs in the background (and recent search terms are cached), so this returns before the GIF is sent.
         :param peer_jid: The Jabber ID for which to send the message (looks like username_ejs@talk.kik.com
         :param search_term: The search term to use when searching GIF images on tenor.com
         :param api_key: The API key for tenor (Get one from https://developers.google.com/tenor/)
+        :param on_done: If given, called once the message is sent or failed, with a Future of the UUID of the message.
+                        The Future fails with the error that prevented finding the GIF.
+        :return: The UUID of the GIF message
         """
-        gif = chatting.OutgoingGIFMessage(peer_jid, search_term, api_key)
+        search = self._get_tenor_client(api_key).search_for_gif_async(search_term)
+        gif = chatting.OutgoingGIFMessage(peer_jid, search_term, api_key, gif=search)
         self.log.info(f"Sending a GIF message to {'group' if gif.is_group else 'user'} '{peer_jid}'...")
-        return self._send_xmpp_element(gif)
+        sent = self._new_send_future(on_done)
+        search.add_done_callback(lambda _: self._send_gif_when_found(gif, search, sent))
+        return gif.message_id
+
+    def prefetch_gifs(self, search_terms: List[str], api_key: str):
+        """
+        Searches for GIFs on tenor.com in the background, so sending them later with send_gif_image doesn't wait for Tenor.
+
+        :param search_terms: The search terms that will be used with send_gif_image
+        :param api_key: The API key for tenor (Get one from https://developers.google.com/tenor/)
+        :return: A Future for each search term
+        """
+        return self._get_tenor_client(api_key).prefetch(search_terms)
+
+    def _get_tenor_client(self, api_key: str) -> KikTenorClient:
+        with self._tenor_clients_lock:
+            if api_key not in self._tenor_clients:
+                self._tenor_clients[api_key] = KikTenorClient(api_key, self.http_client)
+            return self._tenor_clients[api_key]
+
+    def _send_gif_when_found(self, gif: chatting.OutgoingGIFMessage, search: Future, sent: Future):
+        error = CancelledError() if search.cancelled() else search.exception()
+        if error:
+            self.log.error("Failed to find a GIF for '%s', not sending it: %r", gif.search_term, error)
+            resolve_future(sent, error=error)
+            return
+        # this runs on a Tenor thread, which shouldn't wait for the connection
+        chain_future(self._send_in_background(gif), sent)
 
     def request_info_of_users(self, peer_jids: Union[str, List[str]]):
         """
@@ -387,8 +626,54 @@ class KikClient:
         """
         return self._send_xmpp_element(roster.UnmuteUserRequest(peer_jid))
 
-    def send_link(self, peer_jid: str, link: str, title: str, text: str = "", app_name: str = "Webpage", preview_jpg_bytes: Union[bytes, None] = None):
-        return self._send_xmpp_element(chatting.OutgoingLinkShareEvent(peer_jid, link, title, text, app_name, preview_jpg_bytes))
+    def send_link(
+        self,
+        peer_jid: str,
+        link: str,
+        title: Union[str, None] = None,
+        text: str = "",
+        app_name: str = "Webpage",
+        preview_jpg_bytes: Union[bytes, None] = None,
+        fetch_preview: bool = False,
+        on_done: Union[Callable[[Future], None], None] = None,
+    ) -> str:
+        """
+        Sends a link, shown as a card with a title, a text and a preview image.
+
+        :param peer_jid: The Jabber ID for which to send the message (looks like username_ejs@talk.kik.com)
+        :param link: The URL to send
+        :param title: The title of the card. If None, the title of the page is fetched (as with fetch_preview).
+        :param text: The text of the card
+        :param app_name: The name shown at the top of the card
+        :param preview_jpg_bytes: The preview image of the card, as JPEG bytes
+        :param fetch_preview: If True, the title, text and preview image that weren't given are taken from the page.
+                              They're fetched in the background and cached by URL (see LinkPreviewService),
+                              so this returns before the link is sent.
+        :param on_done: If given, called once the message is sent or failed, with a Future of the UUID of the message.
+        :return: The UUID of the message
+        """
+        message = chatting.OutgoingLinkShareEvent(peer_jid, link, title, text, app_name, preview_jpg_bytes)
+        sent = self._new_send_future(on_done)
+        if title is not None and not fetch_preview:
+            resolve_future(sent, self._send_xmpp_element(message))
+            return message.message_id
+
+        fetch = self.link_previews.get(link)
+        fetch.add_done_callback(lambda _: self._send_link_with_preview(message, fetch, sent))
+        return message.message_id
+
+    def _send_link_with_preview(self, message: chatting.OutgoingLinkShareEvent, fetch: Future, sent: Future):
+        error = CancelledError() if fetch.cancelled() else fetch.exception()
+        if error:
+            self.log.warning("Failed to fetch the preview of %s, sending the link without it: %r", message.link, error)
+        else:
+            preview = fetch.result()
+            message.title = message.title or preview.title
+            message.text = message.text or preview.description or ""
+            message.preview_bytes = message.preview_bytes or preview.image
+        message.title = message.title or message.link
+        # this runs on a link preview thread, which shouldn't wait for the connection
+        chain_future(self._send_in_background(message), sent)
 
     def xiphias_get_users(self, peer_jids: Union[str, List[str]]):
         """
@@ -524,6 +809,29 @@ class KikClient:
         self.log.info(f"Adding some members to the group {group_jid}")
         return self._send_xmpp_element(group_adminship.AddMembersRequest(group_jid, peer_jids))
 
+    def remove_members_from_group(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        """
+        Removes many members from a group, pipelining the requests (see group_admin for the other actions and its limits).
+        The caller must be an admin of the group for this request to succeed.
+
+        :param group_jid: The group JID from which to remove the users
+        :param peer_jids: The JIDs of the users to remove
+        :return: a Future of the list of GroupAdminResult, one for each user
+        """
+        return self.group_admin.remove_members(group_jid, peer_jids)
+
+    def ban_members_from_group(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        """
+        Bans many members from a group (for example, the members of a raid), pipelining the requests
+        (see group_admin for the other actions and its limits).
+        The caller must be an admin of the group for this request to succeed.
+
+        :param group_jid: The group JID from which to ban the users
+        :param peer_jids: The JIDs of the users to ban
+        :return: a Future of the list of GroupAdminResult, one for each user
+        """
+        return self.group_admin.ban_members(group_jid, peer_jids)
+
     def set_dm_disabled_status(self, group_jid: str, is_dm_disabled: bool):
         """
         Enables or disables direct messaging for a public group.
@@ -586,18 +894,20 @@ class KikClient:
         Sets the profile picture of the current user
 
         :param file: The path to the file OR its bytes OR an IOBase object to set
+        :return: a Future of the UploadResult, which fails with KikUploadError if the upload failed
         """
         self.log.info(f"Changing profile picture for {self.username}")
-        profile_pictures.set_profile_picture(file, f"{self.kik_node}@talk.kik.com", self.username, self.password)
+        return profile_pictures.set_profile_picture(file, f"{self.kik_node}@talk.kik.com", self.username, self.password, self.upload_executor)
 
     def set_background_picture(self, file: Union[str, bytes, pathlib.Path, io.IOBase]):
         """
         Sets the background picture of the current user
 
         :param file: The path to the image file OR its bytes OR an IOBase object to set
+        :return: a Future of the UploadResult, which fails with KikUploadError if the upload failed
         """
         self.log.info(f"Changing background picture for {self.username}")
-        profile_pictures.set_background_picture(file, f"{self.kik_node}@talk.kik.com", self.username, self.password)
+        return profile_pictures.set_background_picture(file, f"{self.kik_node}@talk.kik.com", self.username, self.password, self.upload_executor)
 
     def set_group_picture(self, file: Union[str, bytes, pathlib.Path, io.IOBase], group_jid: str, silent: bool = False):
         """
@@ -608,9 +918,10 @@ class KikClient:
         :param file: The path to the image file OR its bytes OR an IOBase object to set
         :param group_jid: the JID of the group to change the picture for
         :param silent: If true, no status message is generated when the picture is changed
+        :return: a Future of the UploadResult, which fails with KikUploadError if the upload failed
         """
         self.log.info(f"Changing group picture for {self.username} in {group_jid} (silent={silent})")
-        profile_pictures.set_group_picture(file, f"{self.kik_node}@talk.kik.com", group_jid, self.username, self.password, silent)
+        return profile_pictures.set_group_picture(file, f"{self.kik_node}@talk.kik.com", group_jid, self.username, self.password, silent, self.upload_executor)
 
     def send_ping(self):
         """
@@ -672,6 +983,35 @@ class KikClient:
         self.log.info(f"Changing account email to '{new_email}'")
         return self._send_xmpp_element(account.ChangeEmailRequest(self.password, new_email))
 
+    def register_handler(self, handler, name: str, type: Union[str, None] = None, xmlns: Union[str, None] = None, app_id: Union[str, None] = None):
+        """
+        Handles a kind of incoming stanza with a custom handler, instead of (or in addition to) the built-in ones.
+        For example, to handle the responses of a protobuf service that isn't supported by the client:
+
+            client.register_handler(MyHandler(callback, client), "iq", xmlns="kik:iq:xiphias:bridge")
+
+        The most specific registered handler is used for each stanza (see xmlns_handlers.StanzaRouter).
+
+        :param handler: an object with a handle(element) method, such as an xmlns_handlers.XmppHandler
+        :param name: the name of the stanza element, such as "message" or "iq"
+        :param type: the type attribute of the stanza, or None for any type
+        :param xmlns: the namespace of the stanza (of its query for an iq), or None for any namespace
+        :param app_id: the app ID of the content of a message, or None for any app ID
+        :return: the handler previously registered for the same stanzas, or None.
+                 A custom handler can pass stanzas it doesn't care about to it.
+        """
+        return self.stanza_router.register(handler, name, type, xmlns, app_id)
+
+    def is_subscribed(self, event: str) -> bool:
+        """
+        Returns True if incoming stanzas for an event are parsed and passed to the callback.
+
+        :param event: the name of a callback method, such as "on_message_read"
+        """
+        if self.subscribed_events is not None:
+            return event in self.subscribed_events
+        return callbacks.is_overridden(self.callback, event)
+
     def disconnect(self, permanent: bool = True):
         """
         Closes the connection to Kik.
@@ -681,6 +1021,36 @@ class KikClient:
         :permanent: if True, the client will not reconnect and future attempts to reconnect will fail.
         """
         self.is_permanent_disconnection = True if self.is_permanent_disconnection else permanent
+        if self.is_permanent_disconnection:
+            self.image_preparation.shutdown(wait=False)
+            self.upload_executor.shutdown(wait=False)
+            self.content_fetcher.shutdown(wait=False)
+            self.link_previews.shutdown(wait=False)
+            for tenor_client in list(self._tenor_clients.values()):
+                tenor_client.shutdown(wait=False)
+            with self._send_executor_lock:
+                send_executor, self._send_executor = self._send_executor, None
+            if send_executor:
+                send_executor.shutdown(wait=False, cancel_futures=True)
+            with self._media_executor_lock:
+                media_executor, self._media_executor = self._media_executor, None
+            if media_executor:
+                media_executor.shutdown(wait=False, cancel_futures=True)
+            with self._group_update_executor_lock:
+                group_update_executor, self._group_update_executor = self._group_update_executor, None
+            if group_update_executor:
+                group_update_executor.shutdown(wait=False)
+            if self.profile_picture_cache:
+                self.profile_picture_cache.shutdown(wait=False)
+            if self.roster_sync:
+                self.roster_sync.cancel()
+            if self.roster_store is not None:
+                self.roster_store.close()
+            if self._index_sync:
+                self._index_sync.cancel()
+            self.group_admin.shutdown(wait=False)
+            self._pending_iqs.fail_all(KikApiException("disconnected"))
+            self.http_client.close()
         if self.connection:
             self.log.info("Disconnecting.")
             self.connection.close()
@@ -691,6 +1061,54 @@ class KikClient:
     # Internal methods
     # -----------------
 
+    @staticmethod
+    def _check_events(events: Iterable[str]) -> frozenset:
+        events = frozenset(events)
+        unknown = [event for event in events if not event.startswith("on_") or not hasattr(callbacks.KikClientCallback, event)]
+        if unknown:
+            raise ValueError(f"unknown events: {', '.join(sorted(unknown))}")
+        return events
+
+    def _send_iq(self, request: XMPPElement, timeout: Union[float, None] = None) -> Future:
+        """
+        Sends an iq request to kik servers
+        :param request: The iq request to send
+        :param timeout: The seconds to wait for the connection before raising TimeoutError, or None to wait until connected
+        :return: a Future of the response, failed with a KikErrorException if the response is an error
+        :raises KikApiException: if the client is disconnected permanently before the request is sent
+        """
+        future = self._pending_iqs.add(request.message_id)
+        try:
+            self._send_when_connected(request, timeout)
+        except BaseException:
+            self._pending_iqs.discard(request.message_id)
+            raise
+        return future
+
+    def _send_in_background(self, message: XMPPElement) -> Future:
+        """
+        Sends an XMPP element from the send thread, so the calling thread doesn't wait while the client is disconnected.
+        Elements are sent in the order they were given. They're dropped if the client is disconnected permanently.
+
+        :return: a Future of the UUID of the element, which fails with KikApiException if it was dropped
+        """
+        with self._send_executor_lock:
+            if self._send_executor is None:
+                self._send_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="KikSend")
+            executor = self._send_executor
+        return executor.submit(self._send_when_connected, message)
+
+    def _send_when_connected(self, message: XMPPElement, timeout: Union[float, None] = None) -> str:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.connected:
+            if self.is_permanent_disconnection:
+                self.log.warning("Not sending %s, the client was disconnected", message.message_id)
+                raise KikApiException(f"Not sending {message.message_id}, the client was disconnected")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Not sending {message.message_id}, the client didn't connect in {timeout} seconds")
+            time.sleep(0.5)
+        return self._send_xmpp_element(message)
+
     def _send_xmpp_element(self, message: XMPPElement):
         """
         Serializes and sends the given XMPP element to kik servers
@@ -710,34 +1128,147 @@ class KikClient:
 
         return message.message_id
 
+    @staticmethod
+    def _new_send_future(on_done: Union[Callable[[Future], None], None]) -> Future:
+        """
+        Returns the Future of a message sent in the background, which calls on_done once the message is sent or failed.
+        """
+        sent = Future()
+        sent.set_running_or_notify_cancel()
+        if on_done is not None:
+            sent.add_done_callback(on_done)
+        return sent
+
+    def _run_media_task(self, task, message: XMPPElement, sent: Future):
+        """
+        Runs a step of sending an image or a video on the media threads, which are shared by all sends.
+        If the step can't run or fails unexpectedly, the send fails with its error.
+        """
+        with self._media_executor_lock:
+            if self._media_executor is None:
+                self._media_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="KikMedia")
+            executor = self._media_executor
+
+        def run():
+            try:
+                task(message, sent)
+            except Exception as e:
+                self.log.error("Failed to send %s: %s", message.message_id, traceback.format_exc())
+                resolve_future(sent, error=e)
+
+        def fail_if_cancelled(done: Future):
+            # the task was dropped by disconnect()
+            if done.cancelled():
+                resolve_future(sent, error=CancelledError())
+
+        try:
+            executor.submit(run).add_done_callback(fail_if_cancelled)
+        except RuntimeError as e:
+            # the executor was shut down meanwhile
+            resolve_future(sent, error=e)
+
+    def _upload_image(self, image: chatting.OutgoingChatImage, sent: Future):
+        """
+        Runs on a media thread once an outgoing image is prepared. Starts its upload, and sends it once uploaded.
+        """
+        try:
+            parsed = image.parsed
+        except Exception as e:
+            self.log.error("Failed to prepare image %s: %r", image.message_id, e)
+            resolve_future(sent, error=e)
+            return
+
+        if "content_id" in parsed:
+            # This exact image was uploaded recently, reuse the uploaded content
+            self.log.debug("Reusing uploaded content %s for image %s", parsed["content_id"], image.message_id)
+            image.content_id = parsed["content_id"]
+            chain_future(self._send_in_background(image), sent)
+            return
+
+        upload = content.upload_gallery_image(image, f"{self.kik_node}@talk.kik.com", self.username, self.password, self.upload_executor)
+        upload.add_done_callback(lambda done: self._send_uploaded(image, done, sent))
+
+    def _upload_video(self, video: chatting.OutgoingChatVideo, sent: Future):
+        """
+        Runs on a media thread. Prepares an outgoing video (hashing it), starts its upload, and sends it once uploaded.
+        """
+        try:
+            video.parsed
+        except Exception as e:
+            self.log.error("Failed to prepare video %s: %r", video.message_id, e)
+            resolve_future(sent, error=e)
+            return
+
+        upload = content.upload_video(video, f"{self.kik_node}@talk.kik.com", self.username, self.password, self.upload_executor)
+        upload.add_done_callback(lambda done: self._send_uploaded(video, done, sent))
+
+    def _send_uploaded(self, message: XMPPOutgoingContentMessageElement, upload: Future, sent: Future):
+        # The recipient can only load the content once the upload has finished
+        error = CancelledError() if upload.cancelled() else upload.exception()
+        if error:
+            self.log.error("Failed to upload %s, not sending it: %r", message.message_id, error)
+            resolve_future(sent, error=error)
+            return
+        result = upload.result()
+        self.log.debug("Uploaded %s (%s bytes in %.0f ms)", message.message_id, result.size, result.elapsed * 1000)
+
+        if isinstance(message, chatting.OutgoingChatImage):
+            cache = self.image_preparation.cache
+            if cache and "source_key" in message.parsed:
+                # Remember the upload so the next send of this image can reuse it
+                try:
+                    cache.set_content_id(message.parsed["source_key"], message.content_id)
+                except OSError:
+                    self.log.warning("Failed to cache the upload of image %s", message.message_id, exc_info=True)
+        chain_future(self._send_in_background(message), sent)
+
+    def _on_stanza_read(self, xml_element: XmlElement):
+        """
+        Gets called, on the connection loop, for each stanza read, in the order they arrived.
+        With roster_index, group status and sysmsg messages are handled one at a time, in order, by the group update thread,
+        since they're applied to the index as changes to the previous members. Other stanzas each get a thread of their own.
+        :param xml_element: The stanza received
+        """
+        if self.roster_index is not None and xmlns_handlers.XMPPGroupChatMessageHandler.is_group_update(xml_element):
+            with self._group_update_executor_lock:
+                if self._group_update_executor is None:
+                    self._group_update_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="KikGroupUpdates")
+                executor = self._group_update_executor
+            executor.submit(self._handle_group_update, xml_element)
+        else:
+            self._on_new_stanza_received(xml_element)
+
+    def _handle_group_update(self, xml_element: XmlElement):
+        try:
+            self.stanza_router.dispatch(xml_element)
+        except Exception:
+            self.log.error("Failed to handle group update %s: %s", xml_element.get("id"), traceback.format_exc())
+
     @run_in_new_thread
-    def _on_new_stanza_received(self, xml_element: BeautifulSoup):
+    def _on_new_stanza_received(self, xml_element: XmlElement):
         """
         Gets called when the client receives a new XMPP stanza from Kik.
         :param xml_element: The stanza received (Tag)
         """
-        # choose the handler based on the XML tag name
-
         if xml_element.name == "iq":
             self._handle_received_iq_element(xml_element)
-        elif xml_element.name == "message":
-            self._handle_xmpp_message(xml_element)
-        elif xml_element.name == "stc":
-            if xml_element.stp["type"] == "ca":
-                self.callback.on_captcha_received(login.CaptchaElement(xml_element))
-            elif xml_element.stp["type"] == "bn":
-                self.callback.on_temp_ban_received(login.TempBanElement(xml_element))
+        elif not self.stanza_router.dispatch(xml_element):
+            if xml_element.name == "message":
+                self.log.warning(f"Received unknown XMPP element type: {xml_element}")
             else:
-                self.log.warning(f'Unknown stc element type: {xml_element["type"]}')
-        elif xml_element.name == "ack":
-            pass
-        elif xml_element.name == "pong":
-            latency = KikServerClock.get_system_time() - self._last_ping_sent_time
-            self.callback.on_pong(chatting.KikPongResponse(latency))
-        else:
-            self.log.warning(f"Unknown element type: {xml_element.name}")
+                self.log.warning(f"Unknown element type: {xml_element.name}")
 
-    def _handle_received_k_element(self, k_element: BeautifulSoup) -> bool:
+    def _on_head_only_stanza_received(self, stanza: HeadOnlyStanza):
+        """
+        Gets called, on the connection loop, when the parser recognizes a stanza from its start tag alone (such as an ack or a pong).
+        Stanzas that are dropped anyway don't start a thread.
+        :param stanza: The stanza received
+        """
+        stanza.received_time = KikServerClock.get_system_time()
+        if not self.stanza_router.is_skipped(stanza):
+            self._on_new_stanza_received(stanza)
+
+    def _handle_received_k_element(self, k_element: XmlElement) -> bool:
         """
         The 'k' element appears to be kik's connection-related stanza.
         It lets us know if a connection or a login was successful or not.
@@ -770,7 +1301,7 @@ class KikClient:
             self.callback.on_connection_failed(error)
         return connected
 
-    def _handle_received_iq_element(self, iq_element: BeautifulSoup):
+    def _handle_received_iq_element(self, iq_element: XmlElement):
         """
         The 'iq' (info/query) stanzas in XMPP represents the request/ response elements.
         We send an iq stanza to request for information, and we receive an iq stanza in response to this request,
@@ -779,8 +1310,16 @@ class KikClient:
 
         :param iq_element: The iq XML element we just received from kik.
         """
+        if self._pending_iqs.resolve(iq_element):
+            # the response to a request sent with _send_iq, handled by its Future
+            return
+
         result_type = iq_element["type"]
         if result_type == "error":
+            for sync in (self.roster_sync, self._index_sync):
+                if sync is not None and sync.handle_error(iq_element):
+                    # a failed page of a roster sync, which ends the sync instead of leaving it waiting
+                    return
             error = iq_element.find("error", recursive=False)
             if error:
                 if error.find("bad-request", recursive=False):
@@ -788,69 +1327,7 @@ class KikClient:
                 elif error.find("service-unavailable", recursive=False):
                     raise Exception(f'Received a service Unavailable error for stanza with ID {iq_element.attrs["id"]}')
 
-        # Some successful IQ responses don't have a query element
-        query = iq_element.find("query", recursive=False)
-        if query:
-            xml_namespace = iq_element.query["xmlns"]
-            self._handle_response(xml_namespace, iq_element)
-
-    def _handle_response(self, xmlns, iq_element):
-        """
-        Handles a response that we receive from kik after our initiated request.
-        Examples: response to a group search, response to fetching roster, etc.
-
-        :param xmlns: The XML namespace that helps us understand what type of response this is
-        :param iq_element: The actual XML element that contains the response
-        """
-        if xmlns == "kik:iq:check-unique":
-            xmlns_handlers.CheckUsernameUniqueResponseHandler(self.callback, self).handle(iq_element)
-        elif xmlns == "jabber:iq:register":
-            xmlns_handlers.RegisterOrLoginResponseHandler(self.callback, self).handle(iq_element)
-        elif xmlns == "jabber:iq:roster":
-            xmlns_handlers.RosterResponseHandler(self.callback, self).handle(iq_element)
-        elif xmlns in ["kik:iq:friend", "kik:iq:friend:batch"]:
-            xmlns_handlers.PeersInfoResponseHandler(self.callback, self).handle(iq_element)
-        elif xmlns == "kik:iq:xiphias:bridge":
-            xmlns_handlers.XiphiasHandler(self.callback, self).handle(iq_element)
-        elif xmlns == "kik:auth:cert":
-            self.authenticator.handle(iq_element)
-        elif xmlns == "kik:iq:QoS":
-            xmlns_handlers.HistoryHandler(self.callback, self).handle(iq_element)
-        elif xmlns == "kik:iq:user-profile":
-            xmlns_handlers.UserProfileHandler(self.callback, self).handle(iq_element)
-        elif xmlns == "kik:iq:convos":
-            xmlns_handlers.MutedConvosHandler(self.callback, self).handle(iq_element)
-
-    def _handle_xmpp_message(self, data: BeautifulSoup):
-        """
-        an XMPP 'message' in the case of Kik is the actual stanza we receive when someone sends us a message
-        (weather groupchat or not), starts typing, stops typing, reads our message, etc.
-        Examples: http://slixmpp.readthedocs.io/api/stanza/message.html
-
-        :param data: The XMPP 'message' element we received, or 'msg' if from QoS history
-        """
-        # The XML namespace is different for iOS and Android, handle the messages with their actual type
-        message = XMPPResponse(data)
-        message_type = message.type
-
-        if message_type == "chat":
-            xmlns_handlers.XMPPChatMessageHandler(self.callback, self).handle(data)
-        elif message_type == "groupchat":
-            xmlns_handlers.XMPPGroupChatMessageHandler(self.callback, self).handle(data)
-        elif message_type == "receipt" and data.find("receipt", recursive=False):
-            receipt_type = data.find("receipt", recursive=False)["type"]
-            if message.is_group:
-                self.callback.on_group_receipts_received(chatting.IncomingGroupReceiptsEvent(data))
-            elif receipt_type == "delivered":
-                self.callback.on_message_delivered(chatting.IncomingMessageDeliveredEvent(data))
-            elif receipt_type == "read":
-                self.callback.on_message_read(chatting.IncomingMessageReadEvent(data))
-        elif message_type == "is-typing":
-            self.callback.on_is_typing_event_received(chatting.IncomingIsTypingEvent(data))
-        elif message_type == "error":
-            self.callback.on_error_message_received(chatting.IncomingErrorMessage(data))
-        else:
-            self.log.warning(f"Received unknown XMPP element type: {data}")
+        self.stanza_router.dispatch(iq_element)
 
     def _kik_connection_thread_function(self):
         """
@@ -873,6 +1350,12 @@ class KikClient:
 
         self.loop.run_until_complete(task)
         self.log.debug("Main loop ended.")
+        # the responses to a sync in progress are lost with the connection
+        if self.roster_sync:
+            self.roster_sync.cancel()
+        if self._index_sync:
+            self._index_sync.cancel()
+        self._pending_iqs.fail_all(KikApiException("connection lost before the response arrived"))
         self.callback.on_disconnected()
         self._connect()
 
@@ -898,6 +1381,9 @@ class KikClient:
         return self.get_jid_from_cache(username)
 
     def get_jid_from_cache(self, username):
+        if self.roster_index is not None:
+            return self.roster_index.get_jid(username)
+
         for user in self._known_users_information:
             if user.username.lower() == username.lower():
                 return user.jid
@@ -921,7 +1407,7 @@ class KikConnection:
     async def read_loop(self):
         try:
             self.reader, self.writer = await asyncio.open_connection(host=HOST, port=PORT, ssl=ssl.create_default_context())
-            parser = KikXmlParser(self.reader, self.log)
+            parser = KikXmlParser(self.reader, self.log, skip_receipt=self.api.stanza_router.is_skipped)
 
             self.log.info("Connected.")
             self.api._on_connection_made()
@@ -936,7 +1422,10 @@ class KikConnection:
             while not self.is_closed:
                 stanza = await parser.read_next_stanza()
                 self.log.debug("Received: %s", stanza)
-                self.api.loop.call_soon_threadsafe(self.api._on_new_stanza_received, stanza)
+                if isinstance(stanza, HeadOnlyStanza):
+                    self.api._on_head_only_stanza_received(stanza)
+                else:
+                    self.api.loop.call_soon_threadsafe(self.api._on_stanza_read, stanza)
         except Exception:
             self.log.warning("Received error in main loop: %s", traceback.format_exc())
         finally:
@@ -46,3 +46,17 @@ class KikUploadError(Exception):
         if self.reason is None:
             return self.status_code
         return f"[{self.status_code}] {self.reason}"
+
+
+class KikDownloadError(Exception):
+    def __init__(self, status_code, reason=None):
+        self.status_code = status_code
+        self.reason = reason
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        if self.reason is None:
+            return str(self.status_code)
+        return f"[{self.status_code}] {self.reason}"
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import Union
+
+from kik_unofficial.datatypes.peers import GroupMember
+
+
+class GroupMembershipChange:
+    """
+    A change to the members of a group, found by comparing the group listing of a status or sysmsg message with the known members.
+    See the subclasses for the kinds of changes.
+    """
+
+    __slots__ = ("group_jid", "member_jid", "member")
+
+    def __init__(self, group_jid: str, member_jid: str, member: Union[GroupMember, None] = None):
+        self.group_jid = group_jid
+        self.member_jid = member_jid
+        self.member = member  # the member with its roles, if listed
+
+    def __repr__(self):
+        return f"{type(self).__name__}(group_jid={self.group_jid}, member_jid={self.member_jid})"
+
+
+class MemberJoined(GroupMembershipChange):
+    """
+    A user joined the group or was added to it.
+    """
+
+    __slots__ = ()
+
+
+class MemberLeft(GroupMembershipChange):
+    """
+    A member left the group or was removed from it.
+    """
+
+    __slots__ = ()
+
+
+class MemberBanned(GroupMembershipChange):
+    """
+    A user was banned from the group (and removed from it if they were a member).
+    """
+
+    __slots__ = ()
+
+
+class MemberPromoted(GroupMembershipChange):
+    """
+    A member became an admin (or the owner) of the group.
+    """
+
+    __slots__ = ()
+
+
+class MemberDemoted(GroupMembershipChange):
+    """
+    A member stopped being an admin of the group.
+    """
+
+    __slots__ = ()
@@ -14,11 +14,15 @@ class Peer:
     a base class for representing a kik entity that has a JID (such as a user or a group)
     """
 
+    __slots__ = ("jid",)
+
     def __init__(self, jid: str):
         self.jid = jid
 
 
 class ProfilePic:
+    __slots__ = ("url", "thumb_url", "last_modified", "is_background")
+
     def __init__(self, url: str, thumb_url: str, last_modified: int, is_background: bool):
         self.url = url
         self.thumb_url = thumb_url
@@ -69,6 +73,17 @@ class User(Peer):
     Every user has a username, display name, etc.
     """
 
+    __slots__ = (
+        "username",
+        "display_name",
+        "verified",
+        "profile_pic",
+        "pic",
+        "user_type",
+        "_entity",
+        "_entity_fields",
+    )
+
     def __init__(self, data: BeautifulSoup):
         if "jid" not in data.attrs:
             raise KikApiException(f"No jid in user xml {data}")
@@ -76,8 +91,11 @@ class User(Peer):
         self.username = get_text_of_tag(data, "username")
         self.display_name = get_text_of_tag(data, "display-name")
         self.verified = is_tag_present(data, "verified")
-        if data.entity:
-            self._parse_entity(data.entity.text)
+
+        # The entity protobuf is only decoded when one of its fields is accessed (see _get_entity_field)
+        entity = data.find("entity", recursive=False)
+        self._entity = entity.text if entity else None  # type: Union[str, None]
+        self._entity_fields = None  # type: Union[dict, None]
 
         self.profile_pic = ProfilePic.parse(data)
 
@@ -89,18 +107,50 @@ class User(Peer):
         # Normal users will have a type of None
         self.user_type = get_text_of_tag(data, "user-type")
 
-    def _parse_entity(self, entity):
+    @property
+    def creation_date_seconds(self) -> Union[int, None]:
+        return self._get_entity_field("creation_date_seconds")
+
+    @property
+    def background_pic_full_sized(self) -> Union[str, None]:
+        return self._get_entity_field("background_pic_full_sized")
+
+    @property
+    def background_pic_thumbnail(self) -> Union[str, None]:
+        return self._get_entity_field("background_pic_thumbnail")
+
+    @property
+    def background_pic_updated_seconds(self) -> Union[int, None]:
+        return self._get_entity_field("background_pic_updated_seconds")
+
+    @property
+    def interests(self) -> Union[list[str], None]:
+        return self._get_entity_field("interests")
+
+    def _get_entity_field(self, name: str):
+        """
+        Returns a field of the user's entity (None if the user has none), decoding the entity on first access.
+        """
+        if self._entity_fields is None:
+            self._entity_fields = self._parse_entity(self._entity) if self._entity else {}
+        return self._entity_fields.get(name)
+
+    @staticmethod
+    def _parse_entity(entity: str) -> dict:
         decoded_entity = base64.urlsafe_b64decode(ParsingUtilities.fix_base64_padding(entity))
         user = EntityUser()
         user.ParseFromString(decoded_entity)
+        fields = {}
         if user.registration_element:
-            self.creation_date_seconds = user.registration_element.creation_date.seconds
+            fields["creation_date_seconds"] = user.registration_element.creation_date.seconds
         if user.background_profile_pic_extension:
-            self.background_pic_full_sized = user.background_profile_pic_extension.extension_detail.pic.full_sized_url
-            self.background_pic_thumbnail = user.background_profile_pic_extension.extension_detail.pic.thumbnail_url
-            self.background_pic_updated_seconds = user.background_profile_pic_extension.extension_detail.pic.last_updated_timestamp.seconds
+            pic = user.background_profile_pic_extension.extension_detail.pic
+            fields["background_pic_full_sized"] = pic.full_sized_url
+            fields["background_pic_thumbnail"] = pic.thumbnail_url
+            fields["background_pic_updated_seconds"] = pic.last_updated_timestamp.seconds
         if user.interests_element:
-            self.interests = [element.localized_verbiage for element in user.interests_element.interests_element]
+            fields["interests"] = [element.localized_verbiage for element in user.interests_element.interests_element]
+        return fields
 
     def __str__(self):
         return f"{self.display_name} ({self.username})"
@@ -114,6 +164,8 @@ class RosterUser(User):
     Represents a user roster entry.
     """
 
+    __slots__ = ("is_blocked",)
+
     def __init__(self, data: BeautifulSoup):
         """
         Represents a user (person) in Kik, as received from the roster.
@@ -135,6 +187,8 @@ class Group(Peer):
     Each group has its members, public code (such as #Music), name, etc.
     """
 
+    __slots__ = ("members", "banned_members", "removed_members", "code", "name", "is_public", "profile_pic", "pic")
+
     def __init__(self, data: BeautifulSoup):
         if "jid" not in data.attrs:
             raise KikApiException("No jid in group xml")
@@ -164,6 +218,8 @@ class GroupMember(Peer):
     Members may also admin or own the group
     """
 
+    __slots__ = ("is_creator", "is_admin", "is_owner", "is_dm_disabled")
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data.text)
         # This is only true when sent as part of a server message when a user creates a group
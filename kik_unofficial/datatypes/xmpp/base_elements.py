@@ -1,17 +1,27 @@
 import base64
 import binascii
 import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Union, final
 
 from bs4 import BeautifulSoup
 from lxml import etree
 from lxml.etree import Element
 
+from kik_unofficial.parser.xml_element import XmlElement, parse_xml
 from kik_unofficial.utilities import jid_utilities
 from kik_unofficial.utilities.cryptographic_utilities import CryptographicUtils
 from kik_unofficial.utilities.kik_server_clock import KikServerClock
 from kik_unofficial.utilities.parsing_utilities import get_optional_attribute, get_text_of_tag
 
+# the raw element mode of the client whose stanza is being handled (see XMPPResponse.use_raw_element_mode)
+_raw_element_mode = ContextVar("raw_element_mode", default=None)  # type: ContextVar[str | None]
+
+
+def _get_raw_element_mode() -> str:
+    return _raw_element_mode.get() or XMPPResponse.raw_element_mode
+
 
 class XMPPElement:
     """
@@ -299,11 +309,43 @@ class XMPPResponse:
     This is an incoming stanza from Kik.
 
     When a message stanza is encountered, this will parse the basic attributes of the message.
+
+    The stanza itself is available as raw_element, depending on the raw element mode of the client that received it
+    (or raw_element_mode, set with set_raw_element_mode, for stanzas parsed outside of a client):
+    RAW_ELEMENT_KEEP keeps the parsed tree (the default),
+    RAW_ELEMENT_LAZY keeps only its markup and parses it again whenever raw_element is accessed,
+    and RAW_ELEMENT_DROP doesn't keep it at all (raw_element is None).
+    Bots that keep many messages in memory should use one of the latter.
     """
 
+    __slots__ = (
+        "message_id",
+        "_raw_element",
+        "type",
+        "from_jid",
+        "xmlns",
+        "to_jid",
+        "group_jid",
+        "is_group",
+        "metadata",
+        "request_delivered_receipt",
+        "request_read_receipt",
+    )
+
+    RAW_ELEMENT_KEEP = "keep"
+    RAW_ELEMENT_LAZY = "lazy"
+    RAW_ELEMENT_DROP = "drop"
+    raw_element_mode = RAW_ELEMENT_KEEP
+
     def __init__(self, data: BeautifulSoup):
         self.message_id = data["id"]
-        self.raw_element = data
+        mode = _get_raw_element_mode()
+        if mode == XMPPResponse.RAW_ELEMENT_KEEP:
+            self._raw_element = data
+        elif mode == XMPPResponse.RAW_ELEMENT_LAZY:
+            self._raw_element = str(data)
+        else:
+            self._raw_element = None
 
         if data.name in ("message", "msg"):
             self.type = data["type"]
@@ -326,8 +368,51 @@ class XMPPResponse:
                 self.request_delivered_receipt = False
                 self.request_read_receipt = False
 
+    @property
+    def raw_element(self) -> Union[XmlElement, None]:
+        """
+        The stanza this was parsed from (see raw_element_mode).
+        """
+        if isinstance(self._raw_element, str):
+            # parsed again on every access, so the tree isn't kept alive
+            return parse_xml(self._raw_element)
+        return self._raw_element
+
+    @staticmethod
+    def set_raw_element_mode(mode: str) -> None:
+        """
+        Sets how the raw_element of incoming stanzas is kept, for the stanzas parsed from now on outside of a client
+        (each client uses its own raw_element_mode).
+
+        :param mode: RAW_ELEMENT_KEEP, RAW_ELEMENT_LAZY or RAW_ELEMENT_DROP
+        """
+        XMPPResponse.raw_element_mode = XMPPResponse.check_raw_element_mode(mode)
+
+    @staticmethod
+    def check_raw_element_mode(mode: str) -> str:
+        if mode not in (XMPPResponse.RAW_ELEMENT_KEEP, XMPPResponse.RAW_ELEMENT_LAZY, XMPPResponse.RAW_ELEMENT_DROP):
+            raise ValueError(f"invalid raw element mode {mode}, must be keep, lazy or drop")
+        return mode
+
+    @staticmethod
+    @contextmanager
+    def use_raw_element_mode(mode: Union[str, None]):
+        """
+        Sets how the raw_element of the stanzas parsed in this context (thread) is kept, until the end of the with block.
+        Used by the clients to handle stanzas with their own mode.
+
+        :param mode: RAW_ELEMENT_KEEP, RAW_ELEMENT_LAZY or RAW_ELEMENT_DROP, or None for raw_element_mode
+        """
+        token = _raw_element_mode.set(mode)
+        try:
+            yield
+        finally:
+            _raw_element_mode.reset(token)
+
 
 class XMPPResponseMetadata:
+    __slots__ = ("timestamp", "qos", "push", "app", "hop")
+
     def __init__(self, kik: BeautifulSoup):
         """
         The timestamp of the message, in unix millis.
@@ -366,72 +451,135 @@ class XMPPResponseMetadata:
 class XMPPContentResponse(XMPPResponse):
     """
     This is an incoming content message from another user.
+
+    The strings, images, extras, hashes and uris of the content are only parsed (and images base64-decoded)
+    the first time they're accessed, so content messages that are ignored cost little to receive.
+    Unless the raw element mode is RAW_ELEMENT_KEEP, the content element is kept as markup and parsed again when needed,
+    so the message doesn't keep the tree of its stanza alive.
     """
 
+    __slots__ = (
+        "_content",
+        "content_id",
+        "app_id",
+        "content_version",
+        "server_sig",
+        "file_url",
+        "_strings",
+        "_images",
+        "_extras",
+        "_hashes",
+        "_uris",
+        "_is_supported_version",
+    )
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data)
-        self.content = data.find("content", recursive=False)
-        self.content_id = self.content["id"]  # type: str
-        self.app_id = self.content["app-id"]  # type: str
-        self.content_version = self.content["v"]  # type: str
-        self.server_sig = get_optional_attribute(self.content, "server-sig")  # type: str | None
-
-        self.strings = {}  # type: dict[str, str]
-        self.images = {}  # type: dict[str, bytes]
-        self.extras = {}  # type: dict[str, str]
-        self.hashes = {}  # type: dict[str, str]
-        self.uris = []  # type: list[XMPPContentResponse.ContentUri]
-
-        if self.content_version != "2":
-            # content version must be 2.
-            # Version 2 has been required since ~2012.
-            return
-
-        strings_element = self.content.find("strings", recursive=False)
-        if strings_element:
-            for string in strings_element.find_all(recursive=False):
-                if string.text:
-                    self.strings[string.name] = string.text
-
-        images_element = self.content.find("images", recursive=False)
-        if images_element:
-            for image in images_element.find_all(recursive=False):
-                image_name = image.name
-                if image_name == "icon" or image_name == "preview" or image_name == "png-preview":
-                    image_text = image.text
-                    if len(image_text) > 0:
-                        try:
-                            self.images[image_name] = base64.urlsafe_b64decode(image_text)
-                        except binascii.Error:
-                            # Guard against invalid base-64 image data (server doesn't validate this data for us)
-                            pass
-
-        extras_element = self.content.find("extras", recursive=False)
-        if extras_element:
-            for extra in extras_element.find_all(recursive=False):
-                extra_key = get_text_of_tag(extra, "key", default="")
-                extra_val = get_text_of_tag(extra, "val", default="")
-                if extra_key and extra_val:
-                    self.extras[extra_key] = extra_val
-
-        hashes_element = self.content.find("hashes", recursive=False)
-        if hashes_element:
-            for hash_element in hashes_element.find_all(recursive=False):
-                if hash_element.text:
-                    hash_name = hash_element.name
-                    if hash_name == "sha1-original" or hash_name == "sha1-scaled" or hash_name == "blockhash-scaled":
-                        self.hashes[hash_name] = hash_element.text
-
-        uris = self.content.find("uris", recursive=False)
-        for uri in uris.find_all("uri", recursive=False, limit=50):
-            if uri.text:
-                self.uris.append(self.ContentUri(uri))
-
-        self.file_url = get_text_of_tag(strings_element, "file-url")
+        content = data.find("content", recursive=False)
+        self.content_id = content["id"]  # type: str
+        self.app_id = content["app-id"]  # type: str
+        self.content_version = content["v"]  # type: str
+        self.server_sig = get_optional_attribute(content, "server-sig")  # type: str | None
+        # the content element holds on to the tree of the whole stanza, so it's only kept along with the stanza
+        self._content = content if _get_raw_element_mode() == XMPPResponse.RAW_ELEMENT_KEEP else str(content)  # type: XmlElement | str
+
+        self._strings = None  # type: dict[str, str] | None
+        self._images = None  # type: dict[str, bytes] | None
+        self._extras = None  # type: dict[str, str] | None
+        self._hashes = None  # type: dict[str, str] | None
+        self._uris = None  # type: list[XMPPContentResponse.ContentUri] | None
+
+        # content version must be 2.
+        # Version 2 has been required since ~2012.
+        self._is_supported_version = self.content_version == "2"
+
+        # file-url is validated upfront, so a message with an unexpected file-url is never delivered
+        strings = content.find("strings", recursive=False) if self._is_supported_version else None
+        self.file_url = get_text_of_tag(strings, "file-url")  # type: str | None
         if self.file_url is not None:
             if not self.file_url.startswith("https://platform.kik.com"):
                 raise ValueError(f"invalid file-url (expected https://platform.kik.com, received {self.file_url})")
 
+    @property
+    def content(self) -> XmlElement:
+        """
+        The content element of the message (parsed again on every access unless the raw element mode is RAW_ELEMENT_KEEP).
+        """
+        if isinstance(self._content, str):
+            return parse_xml(self._content)
+        return self._content
+
+    @property
+    def strings(self) -> dict[str, str]:
+        if self._strings is None:
+            self._strings = {}
+            strings_element = self._find_content_child("strings")
+            if strings_element:
+                for string in strings_element.find_all(recursive=False):
+                    if string.text:
+                        self._strings[string.name] = string.text
+        return self._strings
+
+    @property
+    def images(self) -> dict[str, bytes]:
+        if self._images is None:
+            self._images = {}
+            images_element = self._find_content_child("images")
+            if images_element:
+                for image in images_element.find_all(recursive=False):
+                    image_name = image.name
+                    if image_name == "icon" or image_name == "preview" or image_name == "png-preview":
+                        image_text = image.text
+                        if len(image_text) > 0:
+                            try:
+                                self._images[image_name] = base64.urlsafe_b64decode(image_text)
+                            except binascii.Error:
+                                # Guard against invalid base-64 image data (server doesn't validate this data for us)
+                                pass
+        return self._images
+
+    @property
+    def extras(self) -> dict[str, str]:
+        if self._extras is None:
+            self._extras = {}
+            extras_element = self._find_content_child("extras")
+            if extras_element:
+                for extra in extras_element.find_all(recursive=False):
+                    extra_key = get_text_of_tag(extra, "key", default="")
+                    extra_val = get_text_of_tag(extra, "val", default="")
+                    if extra_key and extra_val:
+                        self._extras[extra_key] = extra_val
+        return self._extras
+
+    @property
+    def hashes(self) -> dict[str, str]:
+        if self._hashes is None:
+            self._hashes = {}
+            hashes_element = self._find_content_child("hashes")
+            if hashes_element:
+                for hash_element in hashes_element.find_all(recursive=False):
+                    if hash_element.text:
+                        hash_name = hash_element.name
+                        if hash_name == "sha1-original" or hash_name == "sha1-scaled" or hash_name == "blockhash-scaled":
+                            self._hashes[hash_name] = hash_element.text
+        return self._hashes
+
+    @property
+    def uris(self) -> "list[XMPPContentResponse.ContentUri]":
+        if self._uris is None:
+            self._uris = []
+            uris = self._find_content_child("uris")
+            if uris:
+                for uri in uris.find_all("uri", recursive=False, limit=50):
+                    if uri.text:
+                        self._uris.append(self.ContentUri(uri))
+        return self._uris
+
+    def _find_content_child(self, name: str) -> Union[BeautifulSoup, None]:
+        if not self._is_supported_version:
+            return None
+        return self.content.find(name, recursive=False)
+
     class ContentUri:
         """
         A content URI.
@@ -5,6 +5,7 @@ Defines classes for dealing with generic chatting (text messaging, read receipts
 from __future__ import annotations
 
 import time
+from concurrent.futures import Future
 from typing import Union
 
 from bs4 import BeautifulSoup
@@ -14,6 +15,7 @@ from lxml.etree import Element
 from kik_unofficial.datatypes.peers import Group
 from kik_unofficial.datatypes.xmpp.base_elements import XMPPResponse, XMPPContentResponse, XMPPReceiptResponse, XMPPOutgoingContentMessageElement
 from kik_unofficial.datatypes.xmpp import base_elements
+from kik_unofficial.http_requests.http_client import KikHttpClient
 from kik_unofficial.http_requests.tenor_client import KikTenorClient
 from kik_unofficial.utilities.parsing_utilities import ParsingUtilities, get_text_of_tag, get_optional_attribute
 
@@ -38,12 +40,28 @@ class OutgoingChatMessage(base_elements.XMPPOutgoingMessageElement):
 class OutgoingChatImage(XMPPOutgoingContentMessageElement):
     """
     Represents an outgoing image chat message to another kik entity (member or group)
+
+    :param file_location: the image to send, or a Future of an image that is already being prepared
+                          (see ImagePreparationPool)
     """
 
     def __init__(self, peer_jid: str, file_location, forward: bool = True):
         super().__init__(peer_jid, app_id="com.kik.ext.gallery")
         self.allow_forward = forward
-        self.parsed = ParsingUtilities.parse_image(file_location)
+        if isinstance(file_location, Future):
+            self._parsed = file_location
+        else:
+            self._parsed = ParsingUtilities.parse_image(file_location)
+
+    @property
+    def parsed(self) -> dict:
+        """
+        The prepared image (see ParsingUtilities.parse_image).
+        If the image is still being prepared, this blocks until it's ready.
+        """
+        if isinstance(self._parsed, Future):
+            self._parsed = self._parsed.result()
+        return self._parsed
 
     def serialize_content(self) -> None:
         self.add_string("app-name", "Gallery")
@@ -59,11 +77,57 @@ class OutgoingChatImage(XMPPOutgoingContentMessageElement):
         self.add_image("preview", self.parsed["image_bytes"])
 
 
+class OutgoingChatVideo(XMPPOutgoingContentMessageElement):
+    """
+    Represents an outgoing video chat message to another kik entity (member or group)
+
+    :param file_location: the video to send (an MP4)
+    :param thumbnail: an optional image shown before the video is played. If not given, it's extracted from the video when possible.
+    """
+
+    def __init__(self, peer_jid: str, file_location, thumbnail=None, forward: bool = True, auto_play: bool = False, loop: bool = False, muted: bool = False):
+        super().__init__(peer_jid, app_id="com.kik.ext.video-gallery")
+        self.file_location = file_location
+        self.thumbnail = thumbnail
+        self.allow_forward = forward
+        self.auto_play = auto_play
+        self.loop = loop
+        self.muted = muted
+        self._parsed = None
+
+    @property
+    def parsed(self) -> dict:
+        """
+        The prepared video (see ParsingUtilities.parse_video).
+        The video is prepared on first access, which hashes the whole file, so this shouldn't be accessed on a latency-sensitive thread.
+        """
+        if self._parsed is None:
+            self._parsed = ParsingUtilities.parse_video(self.file_location, self.thumbnail)
+        return self._parsed
+
+    def serialize_content(self) -> None:
+        self.add_string("app-name", "Gallery")
+        self.add_string("file-size", str(self.parsed["size"]))
+        self.set_allow_forward(self.allow_forward)
+        self.add_string("file-content-type", "video/mp4")
+        self.add_string("file-name", f"{self.content_id}.mp4")
+        if self.parsed["duration"] is not None:
+            self.add_string("duration", str(self.parsed["duration"]))
+        self.set_video_autoplay(self.auto_play)
+        self.set_video_loop(self.loop)
+        self.set_video_muted(self.muted)
+
+        if self.parsed["image_bytes"]:
+            self.add_image("preview", self.parsed["image_bytes"])
+
+
 class IncomingChatMessage(XMPPResponse):
     """
     Represents an incoming text chat message from another user
     """
 
+    __slots__ = ("preview", "body")
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data)
         self.preview = get_text_of_tag(data, "preview")
@@ -75,6 +139,8 @@ class IncomingGroupChatMessage(IncomingChatMessage):
     Represents an incoming text chat message from a group
     """
 
+    __slots__ = ("alias_sender",)
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data)
         # Messages from public groups include an alias user which can be resolved with client.xiphias_get_users_by_alias
@@ -230,19 +296,35 @@ class IncomingFriendAttribution(XMPPResponse):
 
 
 class IncomingImageMessage(XMPPContentResponse):
+    __slots__ = ("image_url",)
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data)
         self.image_url = self.file_url
 
 
 class IncomingGroupSticker(XMPPContentResponse):
-    def __init__(self, data: BeautifulSoup):
-        super().__init__(data)
-        self.sticker_pack_id = self.extras.get("sticker_pack_id")  # type: str | None
-        self.sticker_url = self.extras.get("sticker_url")  # type: str | None
-        self.sticker_id = self.extras.get("sticker_id")  # type: str | None
-        self.sticker_source = self.extras.get("sticker_source")  # type: str | None
-        self.png_preview = self.images.get("png-preview")  # type: bytes | None
+    __slots__ = ()
+
+    @property
+    def sticker_pack_id(self) -> Union[str, None]:
+        return self.extras.get("sticker_pack_id")
+
+    @property
+    def sticker_url(self) -> Union[str, None]:
+        return self.extras.get("sticker_url")
+
+    @property
+    def sticker_id(self) -> Union[str, None]:
+        return self.extras.get("sticker_id")
+
+    @property
+    def sticker_source(self) -> Union[str, None]:
+        return self.extras.get("sticker_source")
+
+    @property
+    def png_preview(self) -> Union[bytes, None]:
+        return self.images.get("png-preview")
 
 
 class IncomingGifMessage(XMPPContentResponse):
@@ -252,6 +334,8 @@ class IncomingGifMessage(XMPPContentResponse):
     See self.uris for the list of GIF URLs.
     """
 
+    __slots__ = ()
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data)
 
@@ -259,12 +343,35 @@ class IncomingGifMessage(XMPPContentResponse):
 class OutgoingGIFMessage(XMPPOutgoingContentMessageElement):
     """
     Represents an outgoing GIF message to another kik entity (member or group)
+
+    :param gif: the search result to send (see KikTenorClient.search_for_gif), or a Future of it.
+                If not given, the search term is searched for in the constructor.
     """
 
-    def __init__(self, peer_jid: str, search_term: str, api_key: str):
+    def __init__(self, peer_jid: str, search_term: str, api_key: str, http_client: KikHttpClient = None, gif: Union[tuple, Future, None] = None):
         super().__init__(peer_jid, app_id="com.kik.ext.gif")
         self.allow_forward = True
-        self.gif_preview, self.gif_data = KikTenorClient(api_key).search_for_gif(search_term)
+        self.search_term = search_term
+        self._gif = gif if gif is not None else KikTenorClient(api_key, http_client).search_for_gif(search_term)
+
+    @property
+    def gif_preview(self) -> bytes:
+        """
+        The thumbnail of the GIF. If the GIF is still being searched for, this blocks until it's found.
+        """
+        return self._resolve_gif()[0]
+
+    @property
+    def gif_data(self) -> dict:
+        """
+        The media formats of the GIF. If the GIF is still being searched for, this blocks until it's found.
+        """
+        return self._resolve_gif()[1]
+
+    def _resolve_gif(self) -> tuple:
+        if isinstance(self._gif, Future):
+            self._gif = self._gif.result()
+        return self._gif
 
     def serialize_content(self) -> None:
         self.add_string("app-name", "GIF")
@@ -287,25 +394,59 @@ class OutgoingGIFMessage(XMPPOutgoingContentMessageElement):
 
 
 class IncomingVideoMessage(XMPPContentResponse):
+    __slots__ = ("video_url",)
+
     def __init__(self, data: BeautifulSoup):
         super().__init__(data)
         self.video_url = self.file_url  # type: str | None
-        self.file_content_type = self.strings.get("file-content-type")  # type: str | None
-        self.duration_milliseconds = self.strings.get("duration")  # type: str | None
-        self.file_size = self.strings.get("file-size")  # type: str | None
+
+    @property
+    def file_content_type(self) -> Union[str, None]:
+        return self.strings.get("file-content-type")
+
+    @property
+    def duration_milliseconds(self) -> Union[str, None]:
+        return self.strings.get("duration")
+
+    @property
+    def file_size(self) -> Union[str, None]:
+        return self.strings.get("file-size")
 
 
 class IncomingCardMessage(XMPPContentResponse):
-    def __init__(self, data: BeautifulSoup):
-        super().__init__(data)
-        self.app_name = self.strings.get("app-name")  # type: str | None
-        self.card_icon = self.strings.get("card-icon")  # type: str | None
-        self.layout = self.strings.get("layout")  # type: str | None
-        self.title = self.strings.get("title")  # type: str | None
-        self.text = self.strings.get("text")  # type: str | None
-        self.allow_forward = self.strings.get("allow-forward") == "true"  # type: bool
-        self.icon = self.images.get("icon")  # type: bytes | None
-        self.uri = self.uris[0] if len(self.uris) > 0 else None
+    __slots__ = ()
+
+    @property
+    def app_name(self) -> Union[str, None]:
+        return self.strings.get("app-name")
+
+    @property
+    def card_icon(self) -> Union[str, None]:
+        return self.strings.get("card-icon")
+
+    @property
+    def layout(self) -> Union[str, None]:
+        return self.strings.get("layout")
+
+    @property
+    def title(self) -> Union[str, None]:
+        return self.strings.get("title")
+
+    @property
+    def text(self) -> Union[str, None]:
+        return self.strings.get("text")
+
+    @property
+    def allow_forward(self) -> bool:
+        return self.strings.get("allow-forward") == "true"
+
+    @property
+    def icon(self) -> Union[bytes, None]:
+        return self.images.get("icon")
+
+    @property
+    def uri(self) -> Union[XMPPContentResponse.ContentUri, None]:
+        return self.uris[0] if len(self.uris) > 0 else None
 
 
 class KikPingRequest(base_elements.XMPPElement):
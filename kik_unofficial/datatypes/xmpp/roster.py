@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import base64
-from typing import List, Union
+from typing import Iterator, List, Union
 from lxml import etree
 
 from bs4 import BeautifulSoup
@@ -59,9 +59,12 @@ class FetchRosterRequest(XMPPElement):
 class FetchRosterResponse(XMPPResponse):
     """
     Represents the response to a 'get roster' request which contains the peers list
+
+    :param stream: if True, the users and groups aren't parsed up front: peers is left empty,
+        and iter_peers() parses them one at a time as they're iterated over (for huge rosters)
     """
 
-    def __init__(self, data: BeautifulSoup):
+    def __init__(self, data: BeautifulSoup, stream: bool = False):
         super().__init__(data)
         self.peers: list[Peer] = []
         self.removed_users: list[str] = []
@@ -70,10 +73,29 @@ class FetchRosterResponse(XMPPResponse):
         self.timestamp = data.query.get("ts")
         self.mts = data.query.get("mts")
         self.is_roster_full = False
+        self.is_streamed = stream
+        self._query = data.query if stream else None
 
-        for element in iter(data.query):
+        for element in data.query.children:
+            if stream and element.name in ("item", "g"):
+                continue
             self.parse_peer(element)
 
+    def iter_peers(self) -> Iterator[Peer]:
+        """
+        Yields the new or updated users and groups of the response.
+        If the response is streamed, each Peer is built as it's yielded and isn't kept by the response.
+        The parsed stanza the peers are read from is kept whole until the response is dropped.
+        """
+        if self._query is None:
+            yield from self.peers
+            return
+        for element in self._query.children:
+            if element.name == "item":
+                yield RosterUser(element)
+            elif element.name == "g":
+                yield Group(element)
+
     def parse_peer(self, element):
         name = element.name
 
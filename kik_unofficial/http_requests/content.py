@@ -1,55 +1,115 @@
 import hashlib
 import logging
-import requests
-from threading import Thread
+from concurrent.futures import Future
+from typing import Union
 
-from kik_unofficial.datatypes.exceptions import KikUploadError
-from kik_unofficial.datatypes.xmpp.chatting import OutgoingChatImage
+from kik_unofficial.datatypes.xmpp.chatting import OutgoingChatImage, OutgoingChatVideo
+from kik_unofficial.http_requests.upload_executor import UploadExecutor, default_upload_executor
+from kik_unofficial.http_requests.upload_source import UploadSource
 from kik_unofficial.utilities.cryptographic_utilities import CryptographicUtils
 from kik_unofficial.device_configuration import kik_version_info
 
-
 log = logging.getLogger("kik_unofficial")
 SALT = "YA=57aSA!ztajE5"
 
+# Content larger than this is uploaded in multiple chunks, which are sent concurrently
+CHUNK_SIZE = 1024 * 1024
+
+
+def upload_gallery_image(
+    outgoing_chat_image: OutgoingChatImage, jid, username, password, upload_executor: UploadExecutor = None, chunk_size: int = CHUNK_SIZE
+) -> Future:
+    """
+    Uploads the image of an outgoing image message.
+    The message should only be sent once the upload has finished.
 
-def upload_gallery_image(outgoing_chat_image: OutgoingChatImage, jid, username, password):
+    :return: a Future of the UploadResult, which fails with KikUploadError if the upload failed
+    """
     url = f"https://platform.kik.com/content/files/{outgoing_chat_image.content_id}"
-    send(url, outgoing_chat_image, jid, username, password)
+    return send(url, outgoing_chat_image, jid, username, password, upload_executor, chunk_size)
+
+
+def upload_video(outgoing_chat_video: OutgoingChatVideo, jid, username, password, upload_executor: UploadExecutor = None) -> Future:
+    """
+    Uploads the video of an outgoing video message, streaming it from its file.
+    The message should only be sent once the upload has finished.
+
+    :return: a Future of the UploadResult, which fails with KikUploadError if the upload failed
+    """
+    url = f"https://platform.kik.com/content/files/{outgoing_chat_video.content_id}"
+    parsed = outgoing_chat_video.parsed
+    headers = content_headers(outgoing_chat_video.content_id, outgoing_chat_video.app_id, jid, username, password, parsed["size"], parsed["MD5"])
+    headers["Content-Type"] = "video/mp4"
+    headers["x-kik-content-extension"] = ".mp4"
+    log.debug("Uploading Video")
+    # parse_video already hashed the video
+    source = UploadSource(parsed["file"], parsed["chunk_size"], md5=parsed["MD5"], chunk_md5s=parsed["chunk_md5s"])
+    try:
+        return upload_chunks(url, source, headers, upload_executor, close_source=True)
+    except BaseException:
+        source.close()
+        raise
 
 
-def send(url, image, jid, username, password):
+def send(url, image, jid, username, password, upload_executor: UploadExecutor = None, chunk_size: int = CHUNK_SIZE) -> Future:
+    headers = content_headers(image.content_id, image.app_id, jid, username, password, image.parsed["size"], image.parsed["MD5"])
+    headers["x-kik-sha1-original"] = image.parsed["SHA1"].upper()
+    headers["x-kik-sha1-scaled"] = image.parsed["SHA1Scaled"].upper()
+    headers["x-kik-blockhash-scaled"] = image.parsed["blockhash"].upper()
+    headers["Content-Type"] = "image/jpeg"
+    headers["x-kik-content-extension"] = ".jpg"
+    log.debug("Uploading Image")
+    # parse_image already hashed the image, only its chunks are hashed here
+    source = UploadSource(image.parsed["original"], chunk_size, md5=image.parsed["MD5"], sha1=image.parsed["SHA1"])
+    return upload_chunks(url, source, headers, upload_executor, close_source=True)
+
+
+def content_headers(content_id: str, app_id: str, jid, username, password, size: int, md5: str) -> dict:
+    """
+    Returns the headers shared by all content uploads.
+    """
     username_passkey = CryptographicUtils.key_from_password(username, password)
-    app_id = "com.kik.ext.gallery"
-    v = SALT + image.content_id + app_id
+    v = SALT + content_id + app_id
 
     verification = hashlib.sha1(v.encode("UTF-8")).hexdigest()
-    headers = {
+    return {
         "Host": "platform.kik.com",
         "Connection": "Keep-Alive",
-        "Content-Length": str(image.parsed["size"]),
         "User-Agent": f'Kik/{kik_version_info["kik_version"]} (Android 7.1.2) Content',
         "x-kik-jid": jid,
         "x-kik-password": username_passkey,
         "x-kik-verification": verification,
         "x-kik-app-id": app_id,
-        "x-kik-content-chunks": "1",
-        "x-kik-content-size": str(image.parsed["size"]),
-        "x-kik-content-md5": image.parsed["MD5"],
-        "x-kik-chunk-number": "0",
-        "x-kik-chunk-md5": image.parsed["MD5"],
-        "x-kik-sha1-original": image.parsed["SHA1"].upper(),
-        "x-kik-sha1-scaled": image.parsed["SHA1Scaled"].upper(),
-        "x-kik-blockhash-scaled": image.parsed["blockhash"].upper(),
-        "Content-Type": "image/jpeg",
-        "x-kik-content-extension": ".jpg",
+        "x-kik-content-size": str(size),
+        "x-kik-content-md5": md5,
     }
-    # Sometimes Kik's servers throw 5xx when they're having issues, the new thread won't handle the exception
-    Thread(target=content_upload_thread, args=(url, image.parsed["original"], headers), name="KikContent").start()
 
 
-def content_upload_thread(url, image, headers):
-    log.debug("Uploading Image")
-    r = requests.put(url, data=image, headers=headers)
-    if r.status_code != 200:
-        raise KikUploadError(r.status_code, r.reason)
+def upload_chunks(
+    url, data: Union[bytes, UploadSource], headers, upload_executor: UploadExecutor = None, chunk_size: int = CHUNK_SIZE, close_source: bool = False
+) -> Future:
+    """
+    Uploads content split into chunks of chunk_size bytes, each with its own number and MD5.
+    The chunks are sent concurrently, and a failed chunk is retried on its own.
+    Each chunk is streamed from the source, so only a few blocks of it are in memory at once.
+
+    :param data: the content, as bytes or an UploadSource (whose chunk size is used instead of chunk_size).
+                 An UploadSource created here is closed once the upload is done.
+    :param close_source: if True, the given UploadSource is closed once the upload is done too
+    :param headers: the headers shared by all the chunks (the x-kik-content-* headers)
+    :return: a Future of the UploadResult of the whole content
+    """
+    source = data if isinstance(data, UploadSource) else UploadSource(data, chunk_size)
+    chunks = []
+    for chunk_number in range(source.chunk_count):
+        chunk_headers = dict(headers)
+        chunk_headers["Content-Length"] = str(len(source.chunk_reader(chunk_number)))
+        chunk_headers["x-kik-content-chunks"] = str(source.chunk_count)
+        chunk_headers["x-kik-chunk-number"] = str(chunk_number)
+        chunk_headers["x-kik-chunk-md5"] = source.chunk_md5s[chunk_number]
+        # a new reader for every attempt, so a retried chunk is read from its start
+        chunks.append((lambda n=chunk_number: source.chunk_reader(n), chunk_headers))
+
+    # Sometimes Kik's servers throw 5xx when they're having issues, these are retried by the executor
+    callback = (lambda _: source.close()) if source is not data or close_source else None
+    return (upload_executor or default_upload_executor()).submit_chunks("PUT", url, chunks, callback)
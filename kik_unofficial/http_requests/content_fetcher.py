@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Union
+
+import requests
+
+from kik_unofficial.datatypes.exceptions import KikDownloadError
+from kik_unofficial.datatypes.xmpp.base_elements import XMPPContentResponse
+from kik_unofficial.device_configuration import kik_version_info
+from kik_unofficial.http_requests.http_client import KikHttpClient, default_http_client
+from kik_unofficial.utilities.disk_cache import LRUDiskCache
+from kik_unofficial.utilities.threading_utils import chain_future
+
+log = logging.getLogger("kik_unofficial")
+
+_SAFE_CONTENT_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+
+class ContentFetcher:
+    """
+    Downloads the content of incoming content messages (images, videos, etc.) on a pool of threads.
+
+    Concurrent fetches of the same content share a single download.
+    If a cache directory is given, downloaded content is kept on disk by content ID and isn't downloaded again.
+
+    :param http_client: the HTTP client used for the downloads
+    :param max_workers: the maximum number of downloads running at once
+    :param max_size: the maximum size of a single download, in bytes. Larger content fails with KikDownloadError.
+    :param cache_dir: an optional directory in which downloaded content is cached
+    :param cache_max_bytes: the maximum disk space used by the cache. The least recently used content is evicted first.
+    """
+
+    def __init__(
+        self,
+        http_client: KikHttpClient = None,
+        max_workers: int = 4,
+        max_size: int = 50 * 1024 * 1024,
+        cache_dir: Union[str, None] = None,
+        cache_max_bytes: int = 500 * 1024 * 1024,
+    ):
+        self.http_client = http_client or default_http_client()
+        self.max_workers = max_workers
+        self.max_size = max_size
+        self.cache = LRUDiskCache(cache_dir, cache_max_bytes, "content") if cache_dir else None
+
+        self._in_flight = {}  # type: dict[tuple, Future]
+        self._executor = None  # type: ThreadPoolExecutor | None
+        self._lock = Lock()
+
+    def fetch(self, content: Union[XMPPContentResponse, str], url: Union[str, None] = None, destination: Union[str, None] = None) -> Future:
+        """
+        Schedules the download of a message's content.
+
+        :param content: the content message, or the content ID if a URL is given
+        :param url: the URL to download. Defaults to the message's file_url.
+        :param destination: if given, the content is streamed to this file path instead of being loaded into memory
+        :return: a Future of the content bytes, or of the destination path if one was given.
+                 Fails with KikDownloadError if the download failed or the content is larger than max_size.
+        """
+        if isinstance(content, XMPPContentResponse):
+            content_id = content.content_id
+            url = url or content.file_url
+        else:
+            content_id = content
+        if not url:
+            raise ValueError(f"content {content_id} has no file URL to fetch")
+
+        return self._fetch(content_id, url, destination, retry_evicted=True)
+
+    def _fetch(self, content_id: str, url: str, destination: Union[str, None], retry_evicted: bool) -> Future:
+        cache_key = self._cache_key(content_id)
+        # When cached, everyone waits for the same download into the cache, then reads or copies it from there.
+        # Otherwise each destination (or memory) gets its own download, still shared between identical fetches.
+        key = (content_id,) if self.cache is not None else (content_id, destination)
+        with self._lock:
+            download = self._in_flight.get(key)
+            # looked up under the lock, since a download is only forgotten once it's in the cache
+            cache_path = self.cache.get_path(cache_key) if self.cache is not None and download is None else None
+            started = download is None and not cache_path
+            if started:
+                download = self._get_executor().submit(self._download, url, cache_key, destination)
+                self._in_flight[key] = download
+
+        if cache_path:
+            future = Future()
+            try:
+                future.set_result(self._deliver(cache_path, destination))
+            except FileNotFoundError as e:
+                if not retry_evicted:
+                    future.set_exception(e)
+                    return future
+                # evicted meanwhile
+                return self._fetch(content_id, url, destination, retry_evicted=False)
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if started:
+            download.add_done_callback(lambda _: self._forget(key))
+
+        if self.cache is None:
+            return download
+        future = Future()
+        download.add_done_callback(lambda d: self._deliver_cached(d, content_id, url, destination, future, retry_evicted))
+        return future
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the download threads. Fetches submitted afterwards start new threads.
+
+        :param wait: if True, blocks until all pending downloads are done
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _download(self, url: str, cache_key: str, destination: Union[str, None]) -> Union[bytes, str]:
+        """
+        Runs a download. Returns the cache path if cached, else the destination path, else the content bytes.
+        Content too large for the cache isn't cached.
+        """
+        headers = {"User-Agent": f'Kik/{kik_version_info["kik_version"]} (Android 7.1.2) Content'}
+        try:
+            r = self.http_client.get(url, headers=headers, stream=True)
+        except requests.RequestException as e:
+            raise KikDownloadError(None, str(e))
+        try:
+            if r.status_code != 200:
+                raise KikDownloadError(r.status_code, r.reason)
+            content_length = r.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_size:
+                raise KikDownloadError(r.status_code, f"content of {content_length} bytes is larger than max_size ({self.max_size} bytes)")
+
+            if self.cache is None and destination is None:
+                data = bytearray()
+                for block in self._iter_content(r):
+                    data += block
+                    self._check_size(len(data))
+                return bytes(data)
+
+            if self.cache is not None:
+                temp_path = self.cache.new_temp_file()
+            else:
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(destination)), prefix=".tmp-")
+                os.close(fd)
+            try:
+                size = 0
+                with open(temp_path, "wb") as f:
+                    for block in self._iter_content(r):
+                        size += len(block)
+                        self._check_size(size)
+                        f.write(block)
+                if self.cache is not None and size <= self.cache.max_bytes:
+                    path = self.cache.put_file(cache_key, temp_path)
+                elif destination is not None:
+                    # the temporary file of the cache may be on another file system
+                    shutil.move(temp_path, destination)
+                    path = destination
+                else:
+                    with open(temp_path, "rb") as f:
+                        path = f.read()
+                    os.remove(temp_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            log.debug("Downloaded %s bytes from %s%s", size, url, "" if self.cache is None or size <= self.cache.max_bytes else " (too large to cache)")
+            return path
+        finally:
+            r.close()
+
+    @staticmethod
+    def _iter_content(r: requests.Response):
+        try:
+            yield from r.iter_content(DOWNLOAD_BLOCK_SIZE)
+        except requests.RequestException as e:
+            raise KikDownloadError(r.status_code, str(e))
+
+    def _check_size(self, size: int):
+        if size > self.max_size:
+            raise KikDownloadError(200, f"content is larger than max_size ({self.max_size} bytes)")
+
+    def _deliver_cached(self, download: Future, content_id: str, url: str, destination: Union[str, None], future: Future, retry_evicted: bool):
+        if download.exception():
+            future.set_exception(download.exception())
+            return
+        try:
+            future.set_result(self._deliver(download.result(), destination))
+        except FileNotFoundError as e:
+            if not retry_evicted:
+                future.set_exception(e)
+                return
+            # the content was evicted from the cache before it was delivered, so it's fetched again (once)
+            log.debug("Content %s was evicted from the cache before it was delivered, fetching it again", content_id)
+            chain_future(self._fetch(content_id, url, destination, retry_evicted=False), future)
+        except Exception as e:
+            future.set_exception(e)
+
+    @staticmethod
+    def _deliver(source: Union[str, bytes], destination: Union[str, None]) -> Union[bytes, str]:
+        """
+        Gives a fetch its content from where the download put it: a file (in the cache, or the destination of another fetch of the same content)
+        or, for content too large for the cache that no fetch gave a destination for, memory.
+        """
+        if isinstance(source, bytes):
+            if destination:
+                with open(destination, "wb") as f:
+                    f.write(source)
+                return destination
+            return source
+        if destination:
+            if os.path.abspath(source) != os.path.abspath(destination):
+                shutil.copyfile(source, destination)
+            return destination
+        with open(source, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _cache_key(content_id: str) -> str:
+        if _SAFE_CONTENT_ID.match(content_id):
+            return content_id
+        return hashlib.sha1(content_id.encode()).hexdigest()
+
+    def _forget(self, key: tuple):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # called with self._lock held
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="KikDownload")
+        return self._executor
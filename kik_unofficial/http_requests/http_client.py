@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from threading import BoundedSemaphore, Lock
+from typing import Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class KikHttpClient:
+    """
+    The HTTP layer shared by all the uploads and downloads of a client
+    (content on platform.kik.com, profile pictures, Tenor, etc.)
+
+    Connections are kept alive and pooled per host, so only the first request to a host pays for the TCP and TLS handshakes.
+
+    :param max_connections_per_host: the maximum number of connections kept open to a single host.
+                                     Requests beyond this wait for a free connection.
+    :param max_concurrent_requests: the maximum number of requests in flight at once, across all hosts
+    :param timeout: the default (connect, read) timeout of a request, in seconds
+    """
+
+    def __init__(self, max_connections_per_host: int = 8, max_concurrent_requests: int = 16, timeout: Union[float, Tuple[float, float]] = (10, 60)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_connections_per_host, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._semaphore = BoundedSemaphore(max_concurrent_requests)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request through the pooled session. Accepts the same arguments as requests.request().
+
+        When stream=True, the response body is read after this returns,
+        so the request no longer counts towards max_concurrent_requests while it's being read.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        with self._semaphore:
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_default_http_client = None  # type: KikHttpClient | None
+_default_http_client_lock = Lock()
+
+
+def default_http_client() -> KikHttpClient:
+    """
+    Returns a process-wide KikHttpClient, for callers that don't pass their own.
+    """
+    global _default_http_client
+    with _default_http_client_lock:
+        if _default_http_client is None:
+            _default_http_client = KikHttpClient()
+        return _default_http_client
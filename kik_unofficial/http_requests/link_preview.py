@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import io
+import ipaddress
+import logging
+import socket
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable, List, Union
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from PIL import Image
+
+from kik_unofficial.datatypes.exceptions import KikDownloadError
+from kik_unofficial.http_requests.http_client import KikHttpClient, default_http_client
+
+log = logging.getLogger("kik_unofficial")
+
+PREVIEW_SIZE = (400, 400)
+MAX_REDIRECTS = 5
+
+
+class LinkPreview:
+    """
+    The preview of a web page, shown in the card of a shared link.
+
+    :param url: the URL of the page
+    :param title: the title of the page, if found
+    :param description: the description of the page, if found
+    :param image: the preview image of the page as JPEG bytes (at most 400x400), if found
+    """
+
+    def __init__(self, url: str, title: Union[str, None], description: Union[str, None], image: Union[bytes, None]):
+        self.url = url
+        self.title = title
+        self.description = description
+        self.image = image
+
+    def __repr__(self):
+        return f"LinkPreview(url={self.url}, title={self.title}, image={len(self.image) if self.image else None} bytes)"
+
+
+class LinkPreviewService:
+    """
+    Fetches the title, description and image of web pages (from their Open Graph tags) in the background.
+    The image is downscaled into a small JPEG on the fetching thread.
+
+    Previews are cached in memory by URL for ttl seconds, so sharing the same link again doesn't fetch anything.
+
+    Since the links may come from other users, pages and images on hosts that resolve to loopback, private, link-local
+    or other non-public addresses aren't fetched (checked again after each redirect), unless allow_private_hosts is set.
+
+    :param http_client: the HTTP client used to fetch the pages and images
+    :param ttl: for how many seconds a preview is reused
+    :param max_entries: the maximum number of cached previews. The least recently used are dropped first.
+    :param max_workers: the maximum number of previews fetched at once
+    :param max_page_bytes: only the beginning of a page, up to this size, is read to find its tags
+    :param max_image_bytes: images larger than this are skipped
+    :param allow_private_hosts: if True, hosts with non-public addresses are fetched too
+    """
+
+    def __init__(
+        self,
+        http_client: KikHttpClient = None,
+        ttl: float = 3600,
+        max_entries: int = 512,
+        max_workers: int = 4,
+        max_page_bytes: int = 512 * 1024,
+        max_image_bytes: int = 5 * 1024 * 1024,
+        allow_private_hosts: bool = False,
+    ):
+        self.http_client = http_client or default_http_client()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self.max_page_bytes = max_page_bytes
+        self.max_image_bytes = max_image_bytes
+        self.allow_private_hosts = allow_private_hosts
+
+        self._cache = OrderedDict()  # type: OrderedDict[str, tuple[float, LinkPreview]]  # url -> (expiry, preview)
+        self._in_flight = {}  # type: dict[str, Future]
+        self._executor = None  # type: ThreadPoolExecutor | None
+        self._lock = Lock()
+
+    def get(self, url: str) -> Future:
+        """
+        Returns the preview of a web page. Cached previews resolve immediately.
+        Concurrent requests for the same URL share a single fetch.
+
+        :return: a Future of the LinkPreview. Fails with KikDownloadError if the page couldn't be fetched.
+        """
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                expiry, preview = entry
+                if time.monotonic() <= expiry:
+                    self._cache.move_to_end(url)
+                    future = Future()
+                    future.set_result(preview)
+                    return future
+                del self._cache[url]
+
+            future = self._in_flight.get(url)
+            started = future is None
+            if started:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="KikLinkPreview")
+                future = self._executor.submit(self._fetch, url)
+                self._in_flight[url] = future
+        if started:
+            future.add_done_callback(lambda _: self._forget(url))
+        return future
+
+    def prefetch(self, urls: Iterable[str]) -> List[Future]:
+        """
+        Fetches the previews of many web pages in the background, so sharing them later doesn't wait.
+
+        :return: a Future for each URL, as returned by get()
+        """
+        return [self.get(url) for url in urls]
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the fetching threads. Previews requested afterwards start new threads.
+
+        :param wait: if True, blocks until all pending fetches are done
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _fetch(self, url: str) -> LinkPreview:
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ValueError(f"can't fetch a preview of {url}, only http and https links are supported")
+
+        page = self._read(url, self.max_page_bytes, truncate=True)
+        soup = BeautifulSoup(page, "html.parser")
+        title = self._meta(soup, "og:title", "twitter:title") or (soup.title.string.strip() if soup.title and soup.title.string else None)
+        description = self._meta(soup, "og:description", "twitter:description", "description")
+
+        image = None
+        image_url = self._meta(soup, "og:image", "og:image:url", "twitter:image")
+        if image_url:
+            image_url = urljoin(url, image_url)
+            try:
+                image = self._scale_image(self._read(image_url, self.max_image_bytes, truncate=False))
+            except Exception as e:
+                log.debug("Failed to fetch the preview image %s of %s: %r", image_url, url, e)
+
+        preview = LinkPreview(url, title, description, image)
+        with self._lock:
+            self._cache[url] = (time.monotonic() + self.ttl, preview)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return preview
+
+    def _read(self, url: str, max_bytes: int, truncate: bool) -> bytes:
+        """
+        Reads a response body of at most max_bytes. Longer bodies are either truncated or rejected.
+        Redirects are followed one at a time, so that the host of each one is checked before it's fetched.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            self._check_url(url)
+            try:
+                r = self.http_client.get(url, stream=True, allow_redirects=False)
+            except requests.RequestException as e:
+                raise KikDownloadError(None, str(e))
+            if not r.is_redirect:
+                break
+            r.close()
+            url = urljoin(url, r.headers["location"])
+        else:
+            raise KikDownloadError(None, f"too many redirects for {url}")
+        try:
+            if r.status_code != 200:
+                raise KikDownloadError(r.status_code, r.reason)
+            data = bytearray()
+            for block in r.iter_content(64 * 1024):
+                data += block
+                if len(data) > max_bytes:
+                    if truncate:
+                        return bytes(data[:max_bytes])
+                    raise KikDownloadError(r.status_code, f"{url} is larger than {max_bytes} bytes")
+            return bytes(data)
+        except requests.RequestException as e:
+            raise KikDownloadError(r.status_code, str(e))
+        finally:
+            r.close()
+
+    def _check_url(self, url: str):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"unsupported URL {url}")
+        if self.allow_private_hosts:
+            return
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or 80, proto=socket.IPPROTO_TCP)}
+        except (OSError, UnicodeError) as e:
+            raise KikDownloadError(None, f"can't resolve {parsed.hostname}: {e}")
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split("%", 1)[0])
+            if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                raise KikDownloadError(None, f"not fetching {url}, {parsed.hostname} has the non-public address {ip}")
+
+    @staticmethod
+    def _scale_image(data: bytes) -> bytes:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("RGB", PREVIEW_SIZE)
+            image = img.convert("RGB")
+        image.thumbnail(PREVIEW_SIZE)
+        out = io.BytesIO()
+        image.save(out, format="JPEG")
+        image.close()
+        return out.getvalue()
+
+    @staticmethod
+    def _meta(soup: BeautifulSoup, *names: str) -> Union[str, None]:
+        for name in names:
+            tag = soup.find("meta", attrs={"property": name}) or soup.find("meta", attrs={"name": name})
+            if tag and tag.get("content", "").strip():
+                return tag["content"].strip()
+        return None
+
+    def _forget(self, url: str):
+        with self._lock:
+            self._in_flight.pop(url, None)
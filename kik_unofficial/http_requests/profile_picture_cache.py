@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable, List, Union
+
+import requests
+
+from kik_unofficial.datatypes.exceptions import KikDownloadError
+from kik_unofficial.datatypes.peers import Peer, ProfilePic
+from kik_unofficial.device_configuration import kik_version_info
+from kik_unofficial.http_requests.http_client import KikHttpClient, default_http_client
+from kik_unofficial.utilities.disk_cache import LRUDiskCache
+
+log = logging.getLogger("kik_unofficial")
+
+_SAFE_PIC_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class ProfilePictureCache:
+    """
+    Downloads profile pictures and keeps them on disk, by picture ID and size (full size or thumbnail).
+
+    A cached picture is served without any request for as long as its ProfilePic.last_modified doesn't change.
+    Once it changes, the picture is requested again conditionally (If-None-Match / If-Modified-Since),
+    so it's only downloaded if the server has a different picture.
+
+    :param directory: the directory in which the pictures are stored
+    :param http_client: the HTTP client used for the downloads
+    :param max_bytes: the maximum disk space used by the cache. The least recently used pictures are evicted first.
+    :param max_workers: the maximum number of downloads running at once
+    """
+
+    def __init__(self, directory: str, http_client: KikHttpClient = None, max_bytes: int = 50 * 1024 * 1024, max_workers: int = 8):
+        self.files = LRUDiskCache(directory, max_bytes, "profile-pictures")
+        self.http_client = http_client or default_http_client()
+        self.max_workers = max_workers
+
+        self._in_flight = {}  # type: dict[tuple, Future]
+        self._executor = None  # type: ThreadPoolExecutor | None
+        self._lock = Lock()
+
+    def get(self, pic: ProfilePic, full_size: bool = True) -> Future:
+        """
+        Returns a profile picture, downloading it if it isn't cached or has changed.
+
+        :param pic: the profile picture (see User.profile_pic and Group.profile_pic)
+        :param full_size: True for the full size picture, False for the thumbnail
+        :return: a Future of the JPEG bytes of the picture. Fails with KikDownloadError if the download failed.
+        """
+        key = self._key(pic, full_size)
+        metadata = self._get_metadata(key)
+        if metadata and metadata.get("last_modified") == pic.last_modified:
+            data = self.files.get(f"{key}.jpg")
+            if data is not None:
+                future = Future()
+                future.set_result(data)
+                return future
+
+        in_flight_key = (key, pic.last_modified)
+        with self._lock:
+            future = self._in_flight.get(in_flight_key)
+            started = future is None
+            if started:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="KikProfilePic")
+                future = self._executor.submit(self._download, pic, full_size, key, metadata)
+                self._in_flight[in_flight_key] = future
+        if started:
+            future.add_done_callback(lambda _: self._forget(in_flight_key))
+        return future
+
+    def prefetch(self, peers: Iterable[Union[Peer, ProfilePic]], full_size: bool = False) -> List[Future]:
+        """
+        Downloads the profile pictures of many peers concurrently (for example, a whole roster),
+        so they're served from the cache afterwards. Peers without a profile picture are skipped.
+
+        :param peers: the peers (users or groups), or their profile pictures
+        :param full_size: True for the full size pictures, False for the thumbnails
+        :return: a Future for each picture, as returned by get()
+        """
+        futures = []
+        for peer in peers:
+            pic = peer if isinstance(peer, ProfilePic) else getattr(peer, "profile_pic", None)
+            if pic is not None:
+                futures.append(self.get(pic, full_size))
+        return futures
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the download threads. Pictures requested afterwards start new threads.
+
+        :param wait: if True, blocks until all pending downloads are done
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _download(self, pic: ProfilePic, full_size: bool, key: str, metadata: Union[dict, None]) -> bytes:
+        headers = {"User-Agent": f'Kik/{kik_version_info["kik_version"]} (Android 7.1.2) Dalvik/2.1.0 (Linux; U; Android 7.1.2; Nexus 7 Build/NJH47F)'}
+        cached = self.files.get(f"{key}.jpg") if metadata else None
+        if cached is not None:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("http_last_modified"):
+                headers["If-Modified-Since"] = metadata["http_last_modified"]
+
+        try:
+            r = self.http_client.get(pic.cache_bust_url(full_size), headers=headers)
+        except requests.RequestException as e:
+            raise KikDownloadError(None, str(e))
+
+        if r.status_code == 304 and cached is not None:
+            log.debug("Profile picture %s didn't change", key)
+            data = cached
+        elif r.status_code == 200:
+            data = r.content
+            self.files.put(f"{key}.jpg", data)
+            metadata = {"etag": r.headers.get("ETag"), "http_last_modified": r.headers.get("Last-Modified")}
+        else:
+            raise KikDownloadError(r.status_code, r.reason)
+
+        metadata["last_modified"] = pic.last_modified
+        self.files.put(f"{key}.json", json.dumps(metadata).encode())
+        return data
+
+    def _get_metadata(self, key: str) -> Union[dict, None]:
+        metadata = self.files.get(f"{key}.json")
+        if metadata is None:
+            return None
+        try:
+            return json.loads(metadata)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _key(pic: ProfilePic, full_size: bool) -> str:
+        pic_id = pic.get_pic_id()
+        if not _SAFE_PIC_ID.match(pic_id):
+            pic_id = hashlib.sha1(pic_id.encode()).hexdigest()
+        return f"{pic_id}.{'orig' if full_size else 'thumb'}"
+
+    def _forget(self, key: tuple):
+        with self._lock:
+            self._in_flight.pop(key, None)
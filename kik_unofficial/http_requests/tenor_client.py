@@ -1,23 +1,135 @@
 from __future__ import annotations
 
-import requests
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable, List, Union
+
+from kik_unofficial.http_requests.http_client import KikHttpClient, default_http_client
 
 
 class KikTenorClient:
-    def __init__(self, api_key: str):
+    """
+    Searches GIFs on tenor.com.
+
+    Search results (the media formats and the thumbnail bytes) are cached in memory for cache_ttl seconds,
+    so popular search terms don't hit Tenor again.
+
+    :param api_key: the API key for tenor (Get one from https://developers.google.com/tenor/)
+    :param http_client: the HTTP client used for the requests
+    :param cache_ttl: for how many seconds a search result is reused
+    :param max_cache_entries: the maximum number of cached search results. The least recently used are dropped first.
+    :param max_workers: the maximum number of searches running at once (for search_for_gif_async)
+    """
+
+    def __init__(self, api_key: str, http_client: KikHttpClient = None, cache_ttl: float = 600, max_cache_entries: int = 256, max_workers: int = 4):
         if not api_key:
             raise Exception("A tenor.com API key is required to search for GIFs")
         self.headers = {"X-Goog-Api-Key": api_key}
+        self.http_client = http_client or default_http_client()
+        self.cache_ttl = cache_ttl
+        self.max_cache_entries = max_cache_entries
+        self.max_workers = max_workers
+
+        self._cache = OrderedDict()  # type: OrderedDict[str, tuple[float, tuple[bytes, dict]]]  # term -> (expiry, result)
+        self._in_flight = {}  # type: dict[str, Future]
+        self._executor = None  # type: ThreadPoolExecutor | None
+        self._lock = Lock()
 
     def search_for_gif(self, search_term: str) -> tuple[bytes, dict]:
-        params = {"q": search_term, "limit": "1"}
-        r = requests.get("https://tenor.googleapis.com/v2/search", params=params, headers=self.headers)
+        """
+        Searches for a GIF, in the calling thread.
+
+        :return: the bytes of the GIF's thumbnail and its media formats
+        """
+        term = self._normalize(search_term)
+        result = self._get_cached(term)
+        if result is None:
+            result = self._search(term)
+        return result
+
+    def search_for_gif_async(self, search_term: str) -> Future:
+        """
+        Searches for a GIF in the background. Cached search terms resolve immediately.
+        Concurrent searches for the same term share a single request.
+
+        :return: a Future of the bytes of the GIF's thumbnail and its media formats
+        """
+        term = self._normalize(search_term)
+        result = self._get_cached(term)
+        if result is not None:
+            future = Future()
+            future.set_result(result)
+            return future
+
+        with self._lock:
+            future = self._in_flight.get(term)
+            started = future is None
+            if started:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="KikTenor")
+                future = self._executor.submit(self._search, term)
+                self._in_flight[term] = future
+        if started:
+            future.add_done_callback(lambda _: self._forget(term))
+        return future
+
+    def prefetch(self, search_terms: Iterable[str]) -> List[Future]:
+        """
+        Searches for GIFs in the background, so sending them later doesn't wait for Tenor.
+
+        :return: a Future for each search term, as returned by search_for_gif_async()
+        """
+        return [self.search_for_gif_async(term) for term in search_terms]
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the search threads. Searches submitted afterwards start new threads.
+
+        :param wait: if True, blocks until all pending searches are done
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _search(self, term: str) -> tuple[bytes, dict]:
+        params = {"q": term, "limit": "1"}
+        r = self.http_client.get("https://tenor.googleapis.com/v2/search", params=params, headers=self.headers)
         r.raise_for_status()
 
         gif = r.json()["results"][0]
         media_formats = gif["media_formats"]
 
         thumbnail_url = media_formats["nanogifpreview"]["url"]
-        thumbnail_bytes = requests.get(thumbnail_url).content
+        thumbnail = self.http_client.get(thumbnail_url)
+        thumbnail.raise_for_status()
+
+        result = thumbnail.content, media_formats
+        with self._lock:
+            self._cache[term] = (time.monotonic() + self.cache_ttl, result)
+            self._cache.move_to_end(term)
+            while len(self._cache) > self.max_cache_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    def _get_cached(self, term: str) -> Union[tuple[bytes, dict], None]:
+        with self._lock:
+            entry = self._cache.get(term)
+            if entry is None:
+                return None
+            expiry, result = entry
+            if time.monotonic() > expiry:
+                del self._cache[term]
+                return None
+            self._cache.move_to_end(term)
+            return result
+
+    def _forget(self, term: str):
+        with self._lock:
+            self._in_flight.pop(term, None)
 
-        return thumbnail_bytes, media_formats
+    @staticmethod
+    def _normalize(search_term: str) -> str:
+        return " ".join(search_term.lower().split())
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import io
+import logging
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, List, Mapping, Tuple, Union
+
+import requests
+
+from kik_unofficial.datatypes.exceptions import KikUploadError
+from kik_unofficial.http_requests.http_client import KikHttpClient, default_http_client
+
+log = logging.getLogger("kik_unofficial")
+
+
+class UploadResult:
+    """
+    The result of a successful upload.
+
+    :param url: the URL the data was uploaded to
+    :param status_code: the HTTP status code of the final response
+    :param size: the number of bytes uploaded
+    :param elapsed: the time the upload took, in seconds (including retries)
+    :param attempts: the number of requests it took for the upload to succeed
+    """
+
+    def __init__(self, url: str, status_code: int, size: int, elapsed: float, attempts: int):
+        self.url = url
+        self.status_code = status_code
+        self.size = size
+        self.elapsed = elapsed
+        self.attempts = attempts
+
+    @property
+    def throughput(self) -> float:
+        """
+        The upload throughput, in bytes per second
+        """
+        return self.size / self.elapsed if self.elapsed > 0 else float("inf")
+
+    def __repr__(self):
+        return f"UploadResult(url={self.url}, status_code={self.status_code}, size={self.size}, elapsed={self.elapsed:.3f}, attempts={self.attempts})"
+
+
+class UploadExecutor:
+    """
+    Runs uploads on a bounded pool of threads and returns a Future for each one.
+
+    Uploads that fail with a 5xx status, a connection error or a timeout are retried with exponential backoff.
+    Other failures resolve the Future with a KikUploadError.
+
+    :param http_client: the HTTP client used to send the uploads
+    :param max_workers: the maximum number of uploads running at once
+    :param max_retries: the maximum number of retries of a single upload
+    :param backoff: the delay before the first retry, in seconds. Doubles with each retry.
+    :param max_backoff: the maximum delay between retries, in seconds
+    """
+
+    def __init__(self, http_client: KikHttpClient = None, max_workers: int = 4, max_retries: int = 3, backoff: float = 1.0, max_backoff: float = 30.0):
+        self.http_client = http_client or default_http_client()
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        # totals of all the successful uploads
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self.completed_uploads = 0
+
+        self._executor = None  # type: ThreadPoolExecutor | None
+        self._lock = Lock()
+
+    @property
+    def average_throughput(self) -> float:
+        """
+        The average throughput of all the successful uploads so far, in bytes per second
+        """
+        return self.uploaded_bytes / self.upload_seconds if self.upload_seconds > 0 else 0.0
+
+    def submit(
+        self,
+        method: str,
+        url: str,
+        data: Union[bytes, Callable[[], Union[bytes, io.RawIOBase]]],
+        headers: Mapping[str, str],
+        callback: Callable[[Future], None] = None,
+    ) -> Future:
+        """
+        Schedules an upload.
+
+        :param method: the HTTP method of the upload ('PUT', 'POST')
+        :param url: the URL to upload to
+        :param data: the body to upload, or a function that returns it as bytes or a file object to stream (called on every attempt)
+        :param headers: the headers of the request
+        :param callback: an optional function called with the Future once the upload finished (successfully or not)
+        :return: a Future of the UploadResult
+        """
+        future = self._get_executor().submit(self.upload, method, url, data, headers)
+        if callback:
+            future.add_done_callback(callback)
+        return future
+
+    def submit_chunks(
+        self,
+        method: str,
+        url: str,
+        chunks: List[Tuple[Union[bytes, Callable[[], Union[bytes, io.RawIOBase]]], Mapping[str, str]]],
+        callback: Callable[[Future], None] = None,
+    ) -> Future:
+        """
+        Schedules an upload that is split into chunks.
+        The chunks are sent concurrently, and each one is retried on its own like the uploads of submit().
+
+        :param method: the HTTP method of the chunk requests ('PUT', 'POST')
+        :param url: the URL to upload the chunks to
+        :param chunks: a (data, headers) pair for every chunk, with the same meaning as in submit()
+        :param callback: an optional function called with the Future once the whole upload finished (successfully or not)
+        :return: a Future of the UploadResult of the whole upload.
+                 If a chunk fails, this fails with its error and the chunks that didn't start yet are cancelled.
+                 It's only resolved once no chunk is running anymore, so the data of the chunks can be released then.
+        """
+        upload_future = Future()
+        upload_future.set_running_or_notify_cancel()
+        if callback:
+            upload_future.add_done_callback(callback)
+
+        start_time = time.monotonic()
+        executor = self._get_executor()
+        chunk_futures = [executor.submit(self._send, method, url, data, headers) for data, headers in chunks]
+        state = {"finished": 0, "size": 0, "attempts": 0, "status_code": None, "error": None}
+        state_lock = Lock()
+
+        def on_chunk_done(chunk_future: Future):
+            error = CancelledError() if chunk_future.cancelled() else chunk_future.exception()
+            with state_lock:
+                state["finished"] += 1
+                first_error = error is not None and state["error"] is None
+                if error is None:
+                    state["status_code"], size, attempts = chunk_future.result()
+                    state["size"] += size
+                    state["attempts"] += attempts
+                elif first_error:
+                    state["error"] = error
+                all_finished = state["finished"] == len(chunk_futures)
+
+            if first_error:
+                # the cancelled chunks finish right away, the running ones are waited for
+                for other in chunk_futures:
+                    other.cancel()
+            if not all_finished:
+                return
+            if state["error"] is not None:
+                upload_future.set_exception(state["error"])
+            else:
+                upload_future.set_result(self._on_uploaded(url, state["status_code"], state["size"], start_time, state["attempts"]))
+
+        for chunk_future in chunk_futures:
+            chunk_future.add_done_callback(on_chunk_done)
+        return upload_future
+
+    def upload(self, method: str, url: str, data: Union[bytes, Callable[[], Union[bytes, io.RawIOBase]]], headers: Mapping[str, str]) -> UploadResult:
+        """
+        Runs an upload in the calling thread, with the same retries as submit().
+
+        :return: the UploadResult
+        :raises KikUploadError: if the upload failed
+        """
+        start_time = time.monotonic()
+        status_code, size, attempts = self._send(method, url, data, headers)
+        return self._on_uploaded(url, status_code, size, start_time, attempts)
+
+    def _send(self, method: str, url: str, data: Union[bytes, Callable[[], Union[bytes, io.RawIOBase]]], headers: Mapping[str, str]) -> Tuple[int, int, int]:
+        """
+        Sends one request, retrying it if needed.
+
+        :return: the final status code, the size of the body and the number of attempts
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            body = data() if callable(data) else data
+            try:
+                r = self.http_client.request(method, url, data=body, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                status_code, reason = None, str(e)
+            else:
+                status_code, reason = r.status_code, r.reason
+                if 200 <= status_code < 300:
+                    return status_code, self._body_size(body, headers), attempt
+                if status_code < 500:
+                    raise KikUploadError(status_code, reason)
+
+            if attempt > self.max_retries:
+                raise KikUploadError(status_code, reason)
+
+            delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+            log.warning("Upload to %s failed with %s, retrying in %.1fs (%s/%s)", url, status_code or reason, delay, attempt, self.max_retries)
+            time.sleep(delay)
+
+    @staticmethod
+    def _body_size(body: Union[bytes, io.RawIOBase], headers: Mapping[str, str]) -> int:
+        """
+        Returns the size of a body that was sent. A plain file object has no length,
+        so its size is taken from the Content-Length header, or from how far it was read.
+        """
+        if hasattr(body, "__len__"):
+            return len(body)
+        content_length = next((value for key, value in headers.items() if key.lower() == "content-length"), None)
+        if content_length is not None and str(content_length).isdigit():
+            return int(content_length)
+        try:
+            return body.tell()
+        except (AttributeError, OSError):
+            return 0
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the upload threads. Uploads submitted afterwards start new threads.
+
+        :param wait: if True, blocks until all pending uploads are done
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _on_uploaded(self, url: str, status_code: int, size: int, start_time: float, attempts: int) -> UploadResult:
+        result = UploadResult(url, status_code, size, time.monotonic() - start_time, attempts)
+        with self._lock:
+            self.uploaded_bytes += result.size
+            self.upload_seconds += result.elapsed
+            self.completed_uploads += 1
+        log.debug("Uploaded %s bytes to %s in %.0f ms (%.1f KB/s)", result.size, url, result.elapsed * 1000, result.throughput / 1024)
+        return result
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="KikUpload")
+            return self._executor
+
+
+_default_upload_executor = None  # type: UploadExecutor | None
+_default_upload_executor_lock = Lock()
+
+
+def default_upload_executor() -> UploadExecutor:
+    """
+    Returns a process-wide UploadExecutor, for callers that don't pass their own.
+    """
+    global _default_upload_executor
+    with _default_upload_executor_lock:
+        if _default_upload_executor is None:
+            _default_upload_executor = UploadExecutor()
+        return _default_upload_executor
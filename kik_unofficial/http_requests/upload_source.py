@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import mmap
+import os
+import pathlib
+from typing import Union
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadSource:
+    """
+    The data of an upload, backed by a memory-mapped file, a file object or bytes.
+
+    The size, the MD5 and SHA1 of the whole data and the MD5 of every chunk are computed in a single pass when the source is created.
+    The data is then streamed to the server through readers (see reader() and chunk_reader()),
+    so an upload never needs more than a few blocks of the file in memory at once.
+
+    :param file: the path to the file OR its bytes OR a file object
+    :param chunk_size: the size of the chunks whose MD5s are computed
+    :param digests: if False, nothing is hashed, and md5, sha1 and chunk_md5s are None (for uploads that don't send them)
+    :param md5: the MD5 of the whole data, if it's already known. The whole data is then not hashed again,
+        and only the MD5s of the chunks are computed (none if there's a single chunk, since its MD5 is the given one).
+    :param sha1: the SHA1 of the whole data, if it's already known (used with md5)
+    :param chunk_md5s: the MD5s of the chunks, if they're already known (used with md5). Nothing is hashed then.
+    """
+
+    def __init__(
+        self,
+        file: Union[str, bytes, pathlib.Path, io.IOBase],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        digests: bool = True,
+        md5: Union[str, None] = None,
+        sha1: Union[str, None] = None,
+        chunk_md5s: Union[list[str], None] = None,
+    ):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        self.chunk_size = chunk_size
+        self._file = None
+        self._buffer = self._open(file)  # type: Union[bytes, mmap.mmap, memoryview]
+        self.size = len(self._buffer)
+        self.md5 = md5  # type: Union[str, None]
+        self.sha1 = sha1  # type: Union[str, None]
+        self.chunk_md5s = chunk_md5s  # type: Union[list[str], None]
+        if not digests or md5 is not None and chunk_md5s is not None:
+            return
+        if md5 is not None and self.chunk_count == 1:
+            self.chunk_md5s = [md5]
+            return
+
+        whole_md5 = hashlib.md5() if md5 is None else None
+        whole_sha1 = hashlib.sha1() if md5 is None else None
+        self.chunk_md5s = []
+        for chunk_number in range(self.chunk_count):
+            start = chunk_number * self.chunk_size
+            with memoryview(self._buffer)[start : start + self.chunk_size] as chunk:  # noqa: E203
+                if whole_md5:
+                    whole_md5.update(chunk)
+                    whole_sha1.update(chunk)
+                self.chunk_md5s.append(hashlib.md5(chunk).hexdigest())
+            self.release(start, self.chunk_size)
+        if whole_md5:
+            self.md5 = whole_md5.hexdigest()
+            self.sha1 = whole_sha1.hexdigest()
+
+    @property
+    def chunk_count(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    def reader(self, offset: int = 0, length: Union[int, None] = None) -> UploadReader:
+        """
+        Returns a new file-like object that streams a range of the data (by default, all of it).
+        """
+        end = self.size if length is None else min(self.size, offset + length)
+        return UploadReader(self, offset, end)
+
+    def chunk_reader(self, chunk_number: int) -> UploadReader:
+        """
+        Returns a new file-like object that streams one chunk of the data.
+        """
+        return self.reader(chunk_number * self.chunk_size, self.chunk_size)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return bytes(self._buffer[offset : offset + length])  # noqa: E203
+
+    def release(self, offset: int, length: int):
+        """
+        Lets the OS drop the pages of a range of a memory-mapped file that was read,
+        so they don't stay resident for the rest of the upload.
+        """
+        if isinstance(self._buffer, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+            start = offset - offset % mmap.PAGESIZE
+            end = min(self.size, offset + length)
+            if end > start:
+                self._buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        elif isinstance(self._buffer, memoryview):
+            self._buffer.release()
+        if self._file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self, file) -> Union[bytes, mmap.mmap, memoryview]:
+        if isinstance(file, bytes):
+            return file
+        if isinstance(file, (str, pathlib.Path)):
+            if not os.path.isfile(file):
+                raise FileNotFoundError(f"The file path {file} does not exist")
+            self._file = open(file, "rb")
+            return self._map(self._file)
+        if hasattr(file, "getbuffer"):
+            # BytesIO, shares its buffer without copying it
+            return file.getbuffer()
+        if hasattr(file, "fileno"):
+            try:
+                return self._map(file)
+            except (OSError, io.UnsupportedOperation):
+                pass
+        if hasattr(file, "read"):
+            return file.read()
+        raise ValueError(f"File cannot be a type of {type(file)}")
+
+    @staticmethod
+    def _map(file) -> Union[bytes, mmap.mmap]:
+        if os.fstat(file.fileno()).st_size == 0:
+            # empty files can't be memory-mapped
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class UploadReader(io.RawIOBase):
+    """
+    A file-like view of a range of an UploadSource, read block by block when the request body is sent.
+    The pages of a memory-mapped file are released once the whole range was read.
+    """
+
+    def __init__(self, source: UploadSource, start: int, end: int):
+        super().__init__()
+        self._source = source
+        self._start = start
+        self._end = end
+        self._position = start
+
+    def __len__(self):
+        return self._end - self._start
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position - self._start
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += len(self)
+        self._position = self._start + min(max(offset, 0), len(self))
+        return self.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._end - self._position
+        size = min(size, self._end - self._position)
+        if size <= 0:
+            return b""
+        data = self._source.read(self._position, size)
+        self._position += size
+        if self._position == self._end:
+            self._source.release(self._start, len(self))
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
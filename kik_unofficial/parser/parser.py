@@ -1,9 +1,45 @@
+import re
 from asyncio import StreamReader
-from xml.sax import ContentHandler, ErrorHandler, SAXException
+from typing import Callable, Union
+from xml.sax import SAXException
 
-import defusedxml.sax
-from bs4 import BeautifulSoup
-from defusedxml.expatreader import DefusedExpatParser
+from lxml import etree
+
+from kik_unofficial.parser.xml_element import SAFE_PARSER_OPTIONS, XmlElement, check_no_doctype, parse_xml
+
+# Stanzas that carry nothing but their start tag, returned as a HeadOnlyStanza instead of a tree
+HEAD_ONLY_STANZAS = ("ack", "pong")
+
+_START_TAG = re.compile(rb"^\s*<([\w:.-]+)((?:\s+[\w:.-]+\s*=\s*(?:\"[^\"<]*\"|'[^'<]*'))*)\s*(/?)>$")
+_ATTRIBUTE = re.compile(rb"([\w:.-]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+# the references XML knows without a DTD: the five predefined entities and character references
+_REFERENCE = re.compile(r"&(?:(lt|gt|amp|quot|apos)|#([0-9]+)|#x([0-9a-fA-F]+));")
+_PREDEFINED_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "apos": "'"}
+_ATTRIBUTE_WHITESPACE = str.maketrans("\t\n\r", "   ")
+
+
+class HeadOnlyStanza:
+    """
+    A stanza recognized from its start tag alone, without parsing it into a tree.
+    Supports the parts of the BeautifulSoup API used to route stanzas (name, attrs, get and []).
+    """
+
+    __slots__ = ("name", "attrs", "markup", "received_time")
+
+    def __init__(self, name: str, attrs: dict, markup: bytes):
+        self.name = name
+        self.attrs = attrs
+        self.markup = markup
+        self.received_time = None  # type: Union[int, None]  # set by the client, in milliseconds
+
+    def get(self, key: str, default=None):
+        return self.attrs.get(key, default)
+
+    def __getitem__(self, key: str) -> str:
+        return self.attrs[key]
+
+    def __str__(self):
+        return self.markup.decode("utf-8", errors="replace")
 
 
 class KikXmlParser:
@@ -11,85 +47,116 @@ class KikXmlParser:
     Parses and validates incoming stanzas from the XMPP stream.
     """
 
-    def __init__(self, reader: StreamReader, log):
+    def __init__(self, reader: StreamReader, log, skip_receipt: Callable[[HeadOnlyStanza], bool] = None):
+        """
+        :param reader: the stream to read stanzas from
+        :param log: the logger used for parsing errors
+        :param skip_receipt: if given, called with the start tag of each receipt message.
+                             If it returns True, the receipt is skipped without being parsed.
+        """
         self.reader = reader
-        self.handler = StanzaHandler(log)
+        self.log = log
+        self.skip_receipt = skip_receipt
 
-    async def read_initial_k(self) -> BeautifulSoup:
+    async def read_initial_k(self) -> XmlElement:
         response = await self.reader.readuntil(separator=b">")
         if not response.startswith(b"<k "):
             raise ValueError("unexpected init stream response tag: " + response.decode("utf-8"))
         if b' ok="1"' in response or b"</k>" in response:
-            return self._parse_from_bytes(response)
+            # the stream stays open after a successful k, so only its start tag is sent
+            return parse_xml(response if response.endswith(b"/>") else response + b"</k>")
         else:
             response += await self.reader.readuntil(separator=b"</k>")
-            return self._parse_from_bytes(response)
-
-    async def read_next_stanza(self) -> BeautifulSoup:
-        xml = b""
-        parser = self._make_parser()
+            return parse_xml(response)
 
+    async def read_next_stanza(self) -> Union[XmlElement, HeadOnlyStanza]:
+        """
+        Reads the next stanza. Acks and pongs are returned as a HeadOnlyStanza, other stanzas are parsed into a tree.
+        """
         while True:
             packet = await self.reader.readuntil(separator=b">")
-            if xml == b"":
-                if packet == b"</k>" or packet == b"</stream:stream>":
-                    raise SAXException(f"stream closed: {packet.decode('utf-8')}")
-
-            xml += packet
-
-            try:
+            if packet == b"</k>" or packet == b"</stream:stream>":
+                raise SAXException(f"stream closed: {packet.decode('utf-8')}")
+
+            head = self._parse_head(packet)
+            if head is None:
+                return await self._read_tree(packet)
+            stanza, self_closing = head
+
+            if stanza.name in HEAD_ONLY_STANZAS:
+                if self_closing:
+                    return stanza
+                end = await self.reader.readuntil(separator=b">")
+                if end.strip() == f"</{stanza.name}>".encode():
+                    stanza.markup += end
+                    return stanza
+                return await self._read_tree(packet + end)
+
+            if stanza.name == "message" and not self_closing and stanza.get("type") == "receipt" and self.skip_receipt and self.skip_receipt(stanza):
+                # receipts never contain another message, so this is the end of the stanza
+                await self.reader.readuntil(separator=b"</message>")
+                continue
+
+            return await self._read_tree(packet)
+
+    async def _read_tree(self, xml: bytes) -> XmlElement:
+        """
+        Reads the rest of a stanza that starts with xml, building its tree as it's read.
+        """
+        parser = etree.XMLPullParser(events=("end",), **SAFE_PARSER_OPTIONS)
+        packet = xml
+        try:
+            while True:
                 parser.feed(packet)
-            except StopIteration:
-                return self._parse_from_bytes(xml)
-
-    def _make_parser(self) -> DefusedExpatParser:
-        parser = defusedxml.sax.make_parser()  # type: DefusedExpatParser
-        parser.setContentHandler(self.handler)
-        parser.setErrorHandler(self.handler)
-        parser.forbid_dtd = True
-        parser.forbid_entities = True
-        parser.forbid_external = True
-        return parser
+                for _, element in parser.read_events():
+                    if element.getparent() is None:
+                        # the stanza is complete
+                        root = parser.close()
+                        check_no_doctype(root)
+                        return XmlElement(root)
+                packet = await self.reader.readuntil(separator=b">")
+        except etree.XMLSyntaxError as e:
+            self.log.error(e)
+            raise
 
     @staticmethod
-    def _parse_from_bytes(xml: bytes) -> BeautifulSoup:
-        element = BeautifulSoup(xml, features="xml", from_encoding="utf-8")
-        return next(iter(element)) if len(element) > 0 else element
-
+    def _parse_head(packet: bytes) -> Union[tuple[HeadOnlyStanza, bool], None]:
+        """
+        Parses the start tag of a stanza, returning it with whether it's self-closing. Returns None if it isn't a plain start tag.
+        """
+        match = _START_TAG.match(packet)
+        if match is None:
+            return None
+        try:
+            name = match.group(1).decode("utf-8")
+            attrs = {
+                m.group(1).decode("utf-8"): KikXmlParser._unescape_attribute((m.group(2) if m.group(2) is not None else m.group(3)).decode("utf-8"))
+                for m in _ATTRIBUTE.finditer(match.group(2))
+            }
+        except (UnicodeDecodeError, ValueError):
+            # left to lxml, which rejects it
+            return None
+        return HeadOnlyStanza(name, attrs, packet.strip()), match.group(3) == b"/"
 
-class StanzaHandler(ContentHandler, ErrorHandler):
-    """
-    This validates that a chunk of data is a complete stanza (all start tags are properly closed)
-
-    This also handles a case where Kik sends multiple stanzas back in the same chunk of data from the socket.
-    """
+    @staticmethod
+    def _unescape_attribute(value: str) -> str:
+        """
+        Decodes an attribute value as an XML parser does: line breaks and tabs become spaces, and references are replaced in a single pass.
+        Raises ValueError for a reference XML doesn't define (such as the HTML-only &nbsp; or &copy).
+        """
+        value = value.replace("\r\n", " ").translate(_ATTRIBUTE_WHITESPACE)
+        if "&" not in value:
+            return value
+        unescaped = _REFERENCE.sub(KikXmlParser._replace_reference, value)
+        if value.count("&") != len(_REFERENCE.findall(value)):
+            raise ValueError(f"undefined entity in attribute value {value}")
+        return unescaped
 
-    def __init__(self, log):
-        super().__init__()
-        self.log = log
-        self.depth = 0
-        self.expected_name = None
-
-    def startElement(self, name, attrs) -> None:
-        self.depth += 1
-        if self.expected_name is None:
-            self.expected_name = name
-
-    def endElement(self, name) -> None:
-        self.depth -= 1
-        if self.depth == 0:
-            if self.expected_name != name:
-                raise SAXException(f"end tag closed with wrong name (expected {self.expected_name}, received {name})")
-            else:
-                self.expected_name = None
-                raise StopIteration
-
-    def error(self, exception):
-        self.log.error(exception)
-
-    def fatalError(self, exception):
-        self.log.error(exception)
-        raise exception
-
-    def warning(self, exception):
-        self.log.warn(exception)
+    @staticmethod
+    def _replace_reference(m: re.Match) -> str:
+        if m.group(1):
+            return _PREDEFINED_ENTITIES[m.group(1)]
+        code_point = int(m.group(2)) if m.group(2) else int(m.group(3), 16)
+        if code_point in (0x9, 0xA, 0xD) or 0x20 <= code_point <= 0xD7FF or 0xE000 <= code_point <= 0xFFFD or 0x10000 <= code_point <= 0x10FFFF:
+            return chr(code_point)
+        raise ValueError(f"invalid character reference {m.group(0)}")
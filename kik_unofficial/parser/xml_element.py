@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+from typing import Iterator, Union
+
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+from lxml import etree
+
+# Entities are never expanded, and nothing is loaded from the network or from a DTD
+SAFE_PARSER_OPTIONS = dict(resolve_entities=False, no_network=True, load_dtd=False, huge_tree=False, remove_comments=True, remove_pis=True)
+
+_XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+# BeautifulSoup Tag API that XmlElement doesn't implement. These names aren't looked up as child elements.
+_SOUP_ONLY_NAMES = frozenset(name for name in dir(Tag) if not name.startswith("_"))
+
+
+def parse_xml(xml: Union[bytes, str]) -> XmlElement:
+    """
+    Parses a stanza into an XmlElement. Documents with a DOCTYPE are rejected.
+    """
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    root = etree.fromstring(xml, etree.XMLParser(**SAFE_PARSER_OPTIONS))
+    check_no_doctype(root)
+    return XmlElement(root)
+
+
+def check_no_doctype(root: etree._Element):
+    if root.getroottree().docinfo.doctype:
+        raise ValueError("XML with a DOCTYPE is not allowed")
+
+
+class XmlString(str):
+    """
+    The text between elements, as found in XmlElement.contents. Like a BeautifulSoup NavigableString, its name is None.
+    """
+
+    __slots__ = ()
+    name = None
+
+
+class XmlElement:
+    """
+    A lightweight, read-only XML element backed by lxml, used for incoming stanzas.
+
+    It supports the subset of the BeautifulSoup Tag API used to read stanzas:
+    name, attrs, get(), [], has_attr(), find(), find_all(), text, get_text(), string, strings, stripped_strings,
+    contents, children, descendants, parent, find_parent(), find_parents(), next_sibling, previous_sibling,
+    find_next_sibling(), find_previous_sibling() (and their plural forms),
+    and looking up the first descendant with a given name as an attribute (element.query).
+    Names don't include namespaces, and the xmlns attributes are listed in attrs where they're declared, like in BeautifulSoup.
+
+    Code that needs the rest of the BeautifulSoup API can convert an element with to_soup().
+    """
+
+    __slots__ = ("lxml_element", "_name", "_attrs")
+
+    def __init__(self, element: etree._Element):
+        self.lxml_element = element
+        self._name = None  # type: Union[str, None]
+        self._attrs = None  # type: Union[dict, None]
+
+    @property
+    def name(self) -> str:
+        if self._name is None:
+            self._name = _name_of(self.lxml_element)
+        return self._name
+
+    @property
+    def attrs(self) -> dict:
+        if self._attrs is None:
+            self._attrs = _attributes_of(self.lxml_element)
+        return self._attrs
+
+    def get(self, key: str, default=None):
+        return self.attrs.get(key, default)
+
+    def has_attr(self, key: str) -> bool:
+        return key in self.attrs
+
+    def __getitem__(self, key: str) -> str:
+        return self.attrs[key]
+
+    def find(self, name=None, attrs: dict = None, recursive: bool = True, **kwargs) -> Union[XmlElement, None]:
+        """
+        Returns the first child (or descendant, if recursive) matching a name and attributes, or None.
+
+        :param name: a name, a list of names, or None for any name
+        :param attrs: attribute values to match. A value of True matches any value.
+        :param recursive: if False, only direct children are looked at
+        """
+        for element in self._iter_matching(name, attrs, kwargs, recursive):
+            return XmlElement(element)
+        return None
+
+    def find_all(self, name=None, attrs: dict = None, recursive: bool = True, limit: Union[int, None] = None, **kwargs) -> list[XmlElement]:
+        """
+        Returns the children (or descendants, if recursive) matching a name and attributes. See find().
+
+        :param limit: the maximum number of elements to return
+        """
+        found = []
+        for element in self._iter_matching(name, attrs, kwargs, recursive):
+            if limit is not None and len(found) >= limit:
+                break
+            found.append(XmlElement(element))
+        return found
+
+    findAll = find_all
+
+    @property
+    def text(self) -> str:
+        return "".join(self.lxml_element.itertext())
+
+    def get_text(self, separator: str = "", strip: bool = False) -> str:
+        texts = self.lxml_element.itertext()
+        if strip:
+            texts = (text.strip() for text in texts)
+            texts = (text for text in texts if text)
+        return separator.join(texts)
+
+    @property
+    def string(self) -> Union[str, None]:
+        element = self.lxml_element
+        children = [child for child in element if isinstance(child.tag, str)]
+        if not children:
+            return element.text
+        if len(children) == 1 and not element.text and not children[0].tail:
+            return XmlElement(children[0]).string
+        return None
+
+    @property
+    def contents(self) -> list[Union[XmlElement, XmlString]]:
+        """
+        The child elements and the text between them.
+        """
+        return list(self.children)
+
+    @property
+    def children(self) -> Iterator[Union[XmlElement, XmlString]]:
+        """
+        Like contents, but each child is wrapped as it's iterated over.
+        """
+        element = self.lxml_element
+        if element.text:
+            yield XmlString(element.text)
+        for child in element:
+            if isinstance(child.tag, str):
+                yield XmlElement(child)
+            if child.tail:
+                yield XmlString(child.tail)
+
+    @property
+    def descendants(self) -> Iterator[Union[XmlElement, XmlString]]:
+        """
+        The child elements and texts of this element and of all its descendants, in document order.
+        """
+        for child in self.children:
+            yield child
+            if isinstance(child, XmlElement):
+                yield from child.descendants
+
+    @property
+    def strings(self) -> Iterator[XmlString]:
+        for text in self.lxml_element.itertext():
+            yield XmlString(text)
+
+    @property
+    def stripped_strings(self) -> Iterator[XmlString]:
+        for text in self.lxml_element.itertext():
+            text = text.strip()
+            if text:
+                yield XmlString(text)
+
+    @property
+    def parent(self) -> Union[XmlElement, None]:
+        parent = self.lxml_element.getparent()
+        return XmlElement(parent) if parent is not None else None
+
+    def find_parent(self, name=None, attrs: dict = None, **kwargs) -> Union[XmlElement, None]:
+        """
+        Returns the closest ancestor matching a name and attributes (see find()), or None.
+        """
+        for element in self.find_parents(name, attrs, limit=1, **kwargs):
+            return element
+        return None
+
+    def find_parents(self, name=None, attrs: dict = None, limit: Union[int, None] = None, **kwargs) -> list[XmlElement]:
+        return _matching(self.lxml_element.iterancestors(), name, attrs, kwargs, limit)
+
+    @property
+    def next_sibling(self) -> Union[XmlElement, XmlString, None]:
+        """
+        The text or element right after this element, like in BeautifulSoup.
+        """
+        element = self.lxml_element
+        if element.tail:
+            return XmlString(element.tail)
+        sibling = _next_element(element)
+        return XmlElement(sibling) if sibling is not None else None
+
+    @property
+    def previous_sibling(self) -> Union[XmlElement, XmlString, None]:
+        """
+        The text or element right before this element, like in BeautifulSoup.
+        """
+        sibling = _previous_element(self.lxml_element)
+        if sibling is not None:
+            return XmlString(sibling.tail) if sibling.tail else XmlElement(sibling)
+        parent = self.lxml_element.getparent()
+        if parent is not None and parent.text:
+            return XmlString(parent.text)
+        return None
+
+    def find_next_sibling(self, name=None, attrs: dict = None, **kwargs) -> Union[XmlElement, None]:
+        for element in self.find_next_siblings(name, attrs, limit=1, **kwargs):
+            return element
+        return None
+
+    def find_next_siblings(self, name=None, attrs: dict = None, limit: Union[int, None] = None, **kwargs) -> list[XmlElement]:
+        return _matching(self.lxml_element.itersiblings(), name, attrs, kwargs, limit)
+
+    def find_previous_sibling(self, name=None, attrs: dict = None, **kwargs) -> Union[XmlElement, None]:
+        for element in self.find_previous_siblings(name, attrs, limit=1, **kwargs):
+            return element
+        return None
+
+    def find_previous_siblings(self, name=None, attrs: dict = None, limit: Union[int, None] = None, **kwargs) -> list[XmlElement]:
+        return _matching(self.lxml_element.itersiblings(preceding=True), name, attrs, kwargs, limit)
+
+    def prettify(self) -> str:
+        return etree.tostring(self.lxml_element, encoding="unicode", pretty_print=True, with_tail=False)
+
+    def to_soup(self) -> BeautifulSoup:
+        """
+        Returns this element as a BeautifulSoup Tag, for code that needs the full BeautifulSoup API.
+        """
+        return BeautifulSoup(str(self), features="xml").contents[0]
+
+    def __getattr__(self, name: str) -> Union[XmlElement, None]:
+        # like BeautifulSoup, element.query is element.find("query")
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in _SOUP_ONLY_NAMES:
+            raise AttributeError(f"XmlElement doesn't implement BeautifulSoup's {name}. Use to_soup().{name} instead")
+        return self.find(name)
+
+    def __iter__(self):
+        return self.children
+
+    def __len__(self):
+        return len(self.contents)
+
+    def __bool__(self):
+        # an element is truthy even if it's empty, like a BeautifulSoup Tag
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, XmlElement) and other.lxml_element is self.lxml_element
+
+    def __hash__(self):
+        return hash(self.lxml_element)
+
+    def __str__(self):
+        return etree.tostring(self.lxml_element, encoding="unicode", with_tail=False)
+
+    def __repr__(self):
+        return str(self)
+
+    def _iter_matching(self, name, attrs: Union[dict, None], kwargs: dict, recursive: bool) -> Iterator[etree._Element]:
+        if kwargs:
+            attrs = {**(attrs or {}), **kwargs}
+        element = self.lxml_element
+        if isinstance(name, str) and ":" not in name:
+            # lxml filters by local name in any namespace on its own
+            candidates = element.iterdescendants("{*}" + name) if recursive else element.iterchildren("{*}" + name)
+            names = None
+        else:
+            candidates = element.iterdescendants(etree.Element) if recursive else element.iterchildren(etree.Element)
+            names = None if name is None or name is True else {name} if isinstance(name, str) else set(name)
+
+        for candidate in candidates:
+            if names is not None and _name_of(candidate) not in names:
+                continue
+            if attrs and not _matches_attributes(candidate, attrs):
+                continue
+            yield candidate
+
+
+def _matching(candidates: Iterator[etree._Element], name, attrs: Union[dict, None], kwargs: dict, limit: Union[int, None]) -> list[XmlElement]:
+    if kwargs:
+        attrs = {**(attrs or {}), **kwargs}
+    names = None if name is None or name is True else {name} if isinstance(name, str) else set(name)
+    found = []
+    for candidate in candidates:
+        if limit is not None and len(found) >= limit:
+            break
+        if not isinstance(candidate.tag, str):
+            continue
+        if names is not None and _name_of(candidate) not in names:
+            continue
+        if attrs and not _matches_attributes(candidate, attrs):
+            continue
+        found.append(XmlElement(candidate))
+    return found
+
+
+def _next_element(element: etree._Element) -> Union[etree._Element, None]:
+    return next((sibling for sibling in element.itersiblings() if isinstance(sibling.tag, str)), None)
+
+
+def _previous_element(element: etree._Element) -> Union[etree._Element, None]:
+    return next((sibling for sibling in element.itersiblings(preceding=True) if isinstance(sibling.tag, str)), None)
+
+
+def _name_of(element: etree._Element) -> str:
+    tag = element.tag
+    if tag[0] != "{":
+        return tag
+    local = tag[tag.index("}") + 1 :]  # noqa: E203
+    return f"{element.prefix}:{local}" if element.prefix else local
+
+
+def _attributes_of(element: etree._Element) -> dict:
+    attrs = {}
+    parent = element.getparent()
+    parent_namespaces = parent.nsmap if parent is not None else {}
+    for prefix, uri in element.nsmap.items():
+        if parent_namespaces.get(prefix) != uri:
+            attrs["xmlns" if prefix is None else f"xmlns:{prefix}"] = uri
+
+    for key, value in element.attrib.items():
+        if key[0] == "{":
+            uri, local = key[1:].split("}", 1)
+            prefix = "xml" if uri == _XML_NAMESPACE else next((p for p, u in element.nsmap.items() if u == uri and p), None)
+            key = f"{prefix}:{local}" if prefix else local
+        attrs[key] = value
+    return attrs
+
+
+def _matches_attributes(element: etree._Element, attrs: dict) -> bool:
+    element_attrs = _attributes_of(element)
+    for key, expected in attrs.items():
+        value = element_attrs.get(key)
+        if expected is True:
+            if value is None:
+                return False
+        elif value != expected:
+            return False
+    return True
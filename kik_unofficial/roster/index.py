@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import copy
+import logging
+from threading import Lock
+from typing import Callable, Iterable, Union
+
+from kik_unofficial.datatypes.membership import GroupMembershipChange, MemberBanned, MemberDemoted, MemberJoined, MemberLeft, MemberPromoted
+from kik_unofficial.datatypes.peers import Group, GroupMember, Peer, User
+from kik_unofficial.datatypes.xmpp.roster import FetchRosterResponse
+
+log = logging.getLogger("kik_unofficial")
+
+
+class RosterIndex:
+    """
+    An in-memory index of the roster and of the members of groups, for constant time lookups on hot paths
+    (such as checking whether the sender of a message is an admin).
+
+    It indexes group JID -> members (with their roles), member JID -> groups and username -> JID.
+    It's kept up to date from roster responses, from the group listings in group status and sysmsg messages,
+    and from peer info responses.
+
+    Group status and sysmsg messages are applied as deltas to the known members of the group (see apply_group_update).
+    If one can't be applied, because the group or the members it refers to aren't known, the group's members can't be trusted
+    anymore and on_inconsistency is called, so that the roster can be fetched again.
+
+    Lookups are safe from any thread.
+
+    :param on_inconsistency: called with the JID of a group whose members are out of date.
+        Called once until the group is listed again by a roster response.
+    """
+
+    def __init__(self, on_inconsistency: Union[Callable[[str], None], None] = None):
+        self.on_inconsistency = on_inconsistency
+        self._members = {}  # type: dict[str, dict[str, GroupMember]]  # group JID -> member JID -> member
+        self._banned = {}  # type: dict[str, set[str]]  # group JID -> banned JIDs
+        self._groups_of = {}  # type: dict[str, set[str]]  # member JID -> group JIDs
+        self._groups = {}  # type: dict[str, Group]
+        self._users = {}  # type: dict[str, User]
+        self._jids_by_username = {}  # type: dict[str, str]  # lowercase username -> JID
+        self._stale_groups = set()  # type: set[str]  # groups whose members are out of date
+        self._unlisted = None  # type: Union[set[str], None]  # during a full fetch, the peers it hasn't listed yet
+        self._lock = Lock()
+
+    # ----- lookups -----
+
+    def groups_of(self, jid: str) -> frozenset:
+        """
+        Returns the JIDs of the known groups a user is a member of.
+        """
+        with self._lock:
+            return frozenset(self._groups_of.get(jid, ()))
+
+    def members_of(self, group_jid: str) -> frozenset:
+        """
+        Returns the JIDs of the members of a group.
+        """
+        with self._lock:
+            return frozenset(self._members.get(group_jid, ()))
+
+    def get_member(self, group_jid: str, jid: str) -> Union[GroupMember, None]:
+        """
+        Returns a member of a group, with its roles, or None if the user isn't a known member.
+        """
+        return self._members.get(group_jid, {}).get(jid)
+
+    def is_member(self, group_jid: str, jid: str) -> bool:
+        return jid in self._members.get(group_jid, ())
+
+    def is_admin(self, group_jid: str, jid: str) -> bool:
+        member = self.get_member(group_jid, jid)
+        return member is not None and member.is_admin
+
+    def is_owner(self, group_jid: str, jid: str) -> bool:
+        member = self.get_member(group_jid, jid)
+        return member is not None and member.is_owner
+
+    def is_banned(self, group_jid: str, jid: str) -> bool:
+        return jid in self._banned.get(group_jid, ())
+
+    def get_group(self, group_jid: str) -> Union[Group, None]:
+        return self._groups.get(group_jid)
+
+    def get_user(self, jid: str) -> Union[User, None]:
+        return self._users.get(jid)
+
+    def get_jid(self, username: str) -> Union[str, None]:
+        """
+        Returns the JID of a user by username (case insensitive), or None if the user isn't known.
+        """
+        return self._jids_by_username.get(username.lower())
+
+    def __len__(self):
+        return len(self._users) + len(self._groups)
+
+    # ----- updates -----
+
+    def add_peers(self, peers: Iterable[Peer]):
+        """
+        Adds or replaces users and groups (a group's members are replaced by the listed ones).
+        """
+        with self._lock:
+            for peer in peers:
+                if isinstance(peer, Group):
+                    self._set_group(peer)
+                elif isinstance(peer, User):
+                    self._set_user(peer)
+
+    def remove_peers(self, jids: Iterable[str]):
+        """
+        Removes users and groups from the roster. Groups are forgotten along with their members.
+        """
+        with self._lock:
+            for jid in jids:
+                self._users.pop(jid, None)
+                if jid in self._groups or jid in self._members:
+                    self._remove_group(jid)
+
+    def apply_roster(self, response: FetchRosterResponse):
+        """
+        Applies a page of a roster response (new, updated and removed peers).
+        """
+        self.add_peers(response.peers)
+        self.remove_peers(response.removed_users + response.removed_groups)
+
+    def apply_group_update(self, group: Group) -> list[GroupMembershipChange]:
+        """
+        Applies the group listing of a group status or sysmsg message, which lists only the members that changed:
+        listed members are added or have their roles updated, members that left are removed and banned members are banned.
+        The members and banned members of the group returned by get_group are updated too.
+
+        :return: the changes to the members of the group. A group that isn't known from a roster response can't be applied,
+            since its other members aren't known: it's marked out of date instead, and no changes are returned.
+        """
+        changes = []
+        with self._lock:
+            consistent = group.jid in self._groups
+            if consistent:
+                members = self._members.setdefault(group.jid, {})
+                banned = self._banned.setdefault(group.jid, set())
+
+                for member in group.members:
+                    previous = members.get(member.jid)
+                    self._add_member(group.jid, members, member)
+                    banned.discard(member.jid)
+                    if previous is None:
+                        changes.append(MemberJoined(group.jid, member.jid, member))
+                    elif member.is_admin and not previous.is_admin or member.is_owner and not previous.is_owner:
+                        changes.append(MemberPromoted(group.jid, member.jid, member))
+                    elif previous.is_admin and not member.is_admin:
+                        changes.append(MemberDemoted(group.jid, member.jid, member))
+
+                for member in group.removed_members:
+                    if self._remove_member(group.jid, members, member.jid):
+                        changes.append(MemberLeft(group.jid, member.jid, member))
+                    else:
+                        consistent = False
+
+                newly_banned = []
+                for member in group.banned_members:
+                    self._remove_member(group.jid, members, member.jid)
+                    if member.jid not in banned:
+                        banned.add(member.jid)
+                        newly_banned.append(member)
+                        changes.append(MemberBanned(group.jid, member.jid, member))
+
+                # the cached group is replaced rather than changed, since it may have been handed out already
+                if group.members or group.removed_members or group.banned_members:
+                    cached = copy.copy(self._groups[group.jid])
+                    cached.members = list(members.values())
+                    cached.banned_members = [member for member in cached.banned_members if member.jid in banned] + newly_banned
+                    self._groups[group.jid] = cached
+
+            report = not consistent and group.jid not in self._stale_groups
+            if report:
+                self._stale_groups.add(group.jid)
+
+        if report:
+            log.info("The members of group %s are out of date", group.jid)
+            if self.on_inconsistency:
+                self.on_inconsistency(group.jid)
+        return changes
+
+    def is_stale(self, group_jid: str) -> bool:
+        """
+        Returns True if the members of a group are out of date, until the group is listed again by a roster response.
+        """
+        return group_jid in self._stale_groups
+
+    def add_users(self, users: Iterable[User]):
+        """
+        Adds users that aren't necessarily in the roster (such as the results of peer info requests), for username lookups.
+        """
+        with self._lock:
+            for user in users:
+                if user.username:
+                    self._jids_by_username[user.username.lower()] = user.jid
+
+    def begin_full_fetch(self):
+        """
+        Called when the whole roster is about to be listed again (for example, on a full refresh requested by the server).
+        The users and groups that aren't listed by the time end_full_fetch() is called are removed then.
+        """
+        with self._lock:
+            self._unlisted = set(self._users) | set(self._groups) | set(self._members)
+
+    def end_full_fetch(self):
+        """
+        Removes the users and groups that weren't listed since begin_full_fetch(),
+        since a full fetch only lists the current peers and doesn't send removals.
+        """
+        with self._lock:
+            unlisted, self._unlisted = self._unlisted, None
+        if unlisted:
+            log.debug("Removing %s peers that are no longer in the roster from the index", len(unlisted))
+            self.remove_peers(unlisted)
+
+    def clear(self):
+        with self._lock:
+            self._members.clear()
+            self._banned.clear()
+            self._groups_of.clear()
+            self._groups.clear()
+            self._users.clear()
+            self._jids_by_username.clear()
+            self._stale_groups.clear()
+            self._unlisted = None
+
+    # called with self._lock held:
+
+    def _set_user(self, user: User):
+        self._users[user.jid] = user
+        if self._unlisted is not None:
+            self._unlisted.discard(user.jid)
+        if user.username:
+            self._jids_by_username[user.username.lower()] = user.jid
+
+    def _set_group(self, group: Group):
+        old_members = self._members.get(group.jid, {})
+        members = {}
+        for member in group.members:
+            self._add_member(group.jid, members, member)
+        for jid in old_members.keys() - members.keys():
+            self._discard_group_of(jid, group.jid)
+        self._members[group.jid] = members
+        self._banned[group.jid] = {member.jid for member in group.banned_members}
+        self._groups[group.jid] = group
+        self._stale_groups.discard(group.jid)
+        if self._unlisted is not None:
+            self._unlisted.discard(group.jid)
+
+    def _remove_group(self, group_jid: str):
+        for jid in self._members.pop(group_jid, {}):
+            self._discard_group_of(jid, group_jid)
+        self._banned.pop(group_jid, None)
+        self._groups.pop(group_jid, None)
+        self._stale_groups.discard(group_jid)
+
+    def _add_member(self, group_jid: str, members: dict, member: GroupMember):
+        members[member.jid] = member
+        self._groups_of.setdefault(member.jid, set()).add(group_jid)
+
+    def _remove_member(self, group_jid: str, members: dict, jid: str) -> bool:
+        if members.pop(jid, None) is None:
+            return False
+        self._discard_group_of(jid, group_jid)
+        return True
+
+    def _discard_group_of(self, jid: str, group_jid: str):
+        groups = self._groups_of.get(jid)
+        if groups is not None:
+            groups.discard(group_jid)
+            if not groups:
+                del self._groups_of[jid]
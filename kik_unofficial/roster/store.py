@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import sqlite3
+from threading import Lock
+from typing import Iterator, Union
+
+from kik_unofficial.datatypes.peers import Group, Peer, RosterUser
+from kik_unofficial.parser.xml_element import XmlElement, parse_xml
+
+SCHEMA_VERSION = 1
+
+
+class RosterStore:
+    """
+    Keeps the roster (the users and groups the account chats with) in an SQLite database,
+    along with the ts/mts page tokens of the last roster fetch, so that only the changes since then need to be fetched.
+
+    Peers are stored as the XML the server sent them in, and parsed into RosterUser and Group objects when read.
+
+    :param path: the path of the database file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, SCHEMA_VERSION):
+                raise ValueError(f"unsupported roster store version {version} in {path}")
+            self._db.execute("CREATE TABLE IF NOT EXISTS tokens (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS peers (jid TEXT PRIMARY KEY, is_group INTEGER NOT NULL, xml TEXT NOT NULL)")
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    @property
+    def timestamp(self) -> Union[str, None]:
+        """
+        The ts page token of the last complete roster fetch, or None if the roster was never fetched.
+        """
+        return self._get_token("ts")
+
+    @property
+    def mts(self) -> Union[str, None]:
+        """
+        The mts page token of the last complete roster fetch.
+        """
+        return self._get_token("mts")
+
+    def apply(self, data: XmlElement, reset: bool = False, save_tokens: bool = True):
+        """
+        Applies a page of a roster response: new or updated users and groups are saved, and removed ones are deleted.
+
+        :param data: the roster response (an iq with a jabber:iq:roster query)
+        :param reset: if True, the stored peers are deleted first (for the first page of a full fetch)
+        :param save_tokens: if True, the ts/mts page tokens of the response are saved (for the last page of a fetch)
+        """
+        query = data.find("query", recursive=False)
+        upserts = []
+        removals = []
+        for element in query.find_all(["item", "g", "remove", "remove-group"], recursive=False):
+            if element.name in ("remove", "remove-group"):
+                removals.append((element["jid"],))
+            elif "jid" in element.attrs:
+                upserts.append((element["jid"], element.name == "g", str(element)))
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                if reset:
+                    self._db.execute("DELETE FROM peers")
+                self._db.executemany("INSERT OR REPLACE INTO peers (jid, is_group, xml) VALUES (?, ?, ?)", upserts)
+                self._db.executemany("DELETE FROM peers WHERE jid = ?", removals)
+                if save_tokens:
+                    self._set_tokens(query.get("ts"), query.get("mts"))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def clear_tokens(self):
+        """
+        Forgets the page tokens, so the next fetch gets the whole roster.
+        Used when the server asks for a full refresh.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM tokens")
+
+    def clear(self):
+        """
+        Deletes the stored roster and its page tokens.
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM peers")
+            self._db.execute("DELETE FROM tokens")
+            self._db.execute("COMMIT")
+
+    def get(self, jid: str) -> Union[Peer, None]:
+        """
+        Returns a stored user or group, or None if it isn't in the roster.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT is_group, xml FROM peers WHERE jid = ?", (jid,)).fetchone()
+        return self._parse(*row) if row else None
+
+    def iter_peers(self, groups: Union[bool, None] = None, page_size: int = 500) -> Iterator[Peer]:
+        """
+        Yields the stored peers, reading them from the database a page at a time.
+
+        :param groups: True for groups only, False for users only, None for both
+        :param page_size: how many peers are read at once
+        """
+        condition = "" if groups is None else f"AND is_group = {int(groups)}"
+        last_jid = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT jid, is_group, xml FROM peers WHERE jid > ? {condition} ORDER BY jid LIMIT ?", (last_jid, page_size)
+                ).fetchall()
+            for last_jid, is_group, xml in rows:
+                yield self._parse(is_group, xml)
+            if len(rows) < page_size:
+                return
+
+    def users(self) -> list[RosterUser]:
+        return list(self.iter_peers(groups=False))
+
+    def groups(self) -> list[Group]:
+        return list(self.iter_peers(groups=True))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM peers").fetchone()[0]
+
+    def __contains__(self, jid: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM peers WHERE jid = ?", (jid,)).fetchone() is not None
+
+    @staticmethod
+    def _parse(is_group: int, xml: str) -> Peer:
+        element = parse_xml(xml)
+        return Group(element) if is_group else RosterUser(element)
+
+    def _get_token(self, name: str) -> Union[str, None]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM tokens WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_tokens(self, timestamp: Union[str, None], mts: Union[str, None]):
+        # called with self._lock held, in a transaction
+        for name, value in (("ts", timestamp), ("mts", mts)):
+            if value:
+                self._db.execute("INSERT OR REPLACE INTO tokens (name, value) VALUES (?, ?)", (name, value))
+            else:
+                self._db.execute("DELETE FROM tokens WHERE name = ?", (name,))
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import logging
+import random
+from concurrent.futures import Future
+from threading import Lock, Timer
+from typing import Callable, Union
+
+from kik_unofficial.datatypes.exceptions import KikApiException
+from kik_unofficial.datatypes.xmpp.base_elements import XMPPElement
+from kik_unofficial.datatypes.xmpp.roster import FetchRosterRequest, FetchRosterResponse
+from kik_unofficial.parser.xml_element import XmlElement
+from kik_unofficial.roster.store import RosterStore
+
+log = logging.getLogger("kik_unofficial")
+
+
+class RosterSync:
+    """
+    Keeps a RosterStore up to date with the server, or only follows the roster's page tokens, without a store.
+
+    A sync fetches the changes since the stored page tokens (or the whole roster if there are none),
+    requesting the next page for as long as the server says there's more, and saves the new tokens once the last page is in.
+    If the server asks for a full refresh, the tokens are dropped and the whole roster is fetched again after a delay.
+
+    :param store: the store to keep up to date. If None, only the page tokens are kept, in memory,
+        for callers that keep the peers of the responses themselves (such as the roster index).
+    :param send: sends a stanza to the server (KikClient._send_xmpp_element)
+    :param full_refresh_delay: the range of seconds to wait before a full refresh requested by the server
+    :param on_reset: called when the first page of a full fetch arrives, before it's applied
+        (for example, to clear an index of the roster, as the stored peers are dropped)
+    :param on_page: called with each page of the sync once it's applied to the store, for callers that keep the peers themselves
+    :param on_full_fetch_done: called once the last page of a full fetch is applied
+    :param page_timeout: the seconds to wait for the response to a page before the sync fails
+    """
+
+    def __init__(
+        self,
+        store: Union[RosterStore, None],
+        send: Callable[[XMPPElement], str],
+        full_refresh_delay: tuple[float, float] = (30, 60),
+        on_reset: Union[Callable[[], None], None] = None,
+        page_timeout: float = 60,
+        on_page: Union[Callable[[FetchRosterResponse], None], None] = None,
+        on_full_fetch_done: Union[Callable[[], None], None] = None,
+    ):
+        self.store = store
+        self.send = send
+        self.full_refresh_delay = full_refresh_delay
+        self.on_reset = on_reset
+        self.page_timeout = page_timeout
+        self.on_page = on_page
+        self.on_full_fetch_done = on_full_fetch_done
+
+        self._future = None  # type: Union[Future, None]  # the sync in progress
+        self._request_id = None  # type: Union[str, None]  # the ID of the page request being waited for
+        self._is_full = False
+        self._pages = 0
+        self._timer = None  # type: Union[Timer, None]
+        self._page_timer = None  # type: Union[Timer, None]
+        self._tokens = (None, None)  # type: tuple[Union[str, None], Union[str, None]]  # (ts, mts), without a store
+        self._lock = Lock()
+
+    def start(self) -> Future:
+        """
+        Starts a sync, unless one is already in progress.
+
+        :return: a Future of the store (None without one), resolved once the sync is complete
+        """
+        with self._lock:
+            if self._future is not None:
+                return self._future
+            self._future = Future()
+            future = self._future
+            timestamp, mts = (self.store.timestamp, self.store.mts) if self.store is not None else self._tokens
+            self._is_full = timestamp is None
+            self._pages = 0
+            request = FetchRosterRequest(is_batched=False, timestamp=timestamp, mts=mts)
+            self._wait_for_page(request.message_id)
+
+        log.info("Syncing the roster (%s)", "full" if timestamp is None else f"changes since {timestamp}")
+        self.send(request)
+        return future
+
+    def handle_response(self, response: FetchRosterResponse, data: XmlElement) -> bool:
+        """
+        Applies a roster response to the store if it's a page of the sync in progress, and requests the next page if there's one.
+
+        :return: True if the response belonged to the sync
+        """
+        if data.get("type") == "error":
+            return self.handle_error(data)
+        with self._lock:
+            if not self._take_page(response.message_id):
+                return False
+            future = self._future
+
+        if response.is_roster_full:
+            self._schedule_full_refresh()
+            return True
+
+        reset = self._is_full and self._pages == 0
+        try:
+            if self.store is not None:
+                self.store.apply(data, reset=reset, save_tokens=not response.more)
+            if reset and self.on_reset:
+                self.on_reset()
+            if self.on_page:
+                self.on_page(response)
+            if self._is_full and not response.more and self.on_full_fetch_done:
+                self.on_full_fetch_done()
+        except Exception as e:
+            self._finish(e)
+            return True
+        if self.store is None and not response.more:
+            self._tokens = (response.timestamp, response.mts)
+        self._pages += 1
+
+        if response.more:
+            request = FetchRosterRequest(is_batched=True, timestamp=response.timestamp, mts=response.mts)
+            with self._lock:
+                if self._future is not future:
+                    # cancelled meanwhile
+                    return True
+                self._wait_for_page(request.message_id)
+            self.send(request)
+        else:
+            if self.store is not None:
+                log.info("Roster synced (%s pages, %s peers)", self._pages, len(self.store))
+            else:
+                log.info("Roster synced (%s pages)", self._pages)
+            self._finish(None)
+        return True
+
+    def handle_error(self, iq_element: XmlElement) -> bool:
+        """
+        Fails the sync in progress if an error iq is the response to its page request.
+
+        :return: True if the error belonged to the sync
+        """
+        with self._lock:
+            if not self._take_page(iq_element.get("id")):
+                return False
+        error = iq_element.find("error", recursive=False)
+        condition = next((child.name for child in error.find_all(recursive=False)), None) if error else None
+        log.warning("The server failed a roster page (%s), the roster sync failed", condition or "unknown error")
+        self._finish(KikApiException(f"roster sync failed: {condition or iq_element}"))
+        return True
+
+    def cancel(self):
+        """
+        Fails the sync in progress, if any (for example, when the connection is lost before it's complete).
+        The store keeps its previous tokens, so the next sync fetches the same changes again.
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer:
+            timer.cancel()
+        self._finish(KikApiException("roster sync cancelled"))
+
+    def _schedule_full_refresh(self):
+        delay = random.uniform(*self.full_refresh_delay)
+        log.info("The server asked for a full roster refresh, fetching the whole roster in %.0f seconds", delay)
+        if self.store is not None:
+            self.store.clear_tokens()
+        self._tokens = (None, None)
+        with self._lock:
+            # the current future stays pending until the full fetch is done
+            self._timer = Timer(delay, self._start_full_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _start_full_refresh(self):
+        with self._lock:
+            if self._future is None:
+                return
+            self._timer = None
+            self._is_full = True
+            self._pages = 0
+            request = FetchRosterRequest(is_batched=False)
+            self._wait_for_page(request.message_id)
+        self.send(request)
+
+    def _wait_for_page(self, request_id: str):
+        # called with the lock held
+        self._request_id = request_id
+        if self._page_timer:
+            self._page_timer.cancel()
+        self._page_timer = Timer(self.page_timeout, self._on_page_timeout, (request_id,))
+        self._page_timer.daemon = True
+        self._page_timer.start()
+
+    def _take_page(self, request_id: Union[str, None]) -> bool:
+        # called with the lock held. Stops waiting for the page, if it's the one being waited for.
+        if self._request_id is None or request_id != self._request_id:
+            return False
+        self._request_id = None
+        if self._page_timer:
+            self._page_timer.cancel()
+            self._page_timer = None
+        return True
+
+    def _on_page_timeout(self, request_id: str):
+        with self._lock:
+            if not self._take_page(request_id):
+                return
+        log.warning("No response to a roster page in %s seconds, the roster sync failed", self.page_timeout)
+        self._finish(TimeoutError(f"no response to roster page {request_id} in {self.page_timeout} seconds"))
+
+    def _finish(self, error: Union[BaseException, None]):
+        with self._lock:
+            future, self._future = self._future, None
+            self._take_page(self._request_id)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(self.store)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from threading import RLock
+from typing import Union
+
+_VALID_KEY = re.compile(r"^[A-Za-z0-9_.-]+$")
+_SUBDIRECTORY_PREFIX = "kik-cache-"
+_ENTRY_SUFFIX = ".kcache"
+_TEMP_PREFIX = ".tmp-"
+_STALE_TEMP_SECONDS = 24 * 60 * 60
+
+
+class LRUDiskCache:
+    """
+    A directory of files whose total size is bounded.
+    When a new file doesn't fit, the least recently used files are evicted first.
+
+    Recency is persisted through the files' modification times, so the cache keeps its order across restarts.
+
+    The files are kept in a subdirectory of `directory` that belongs to the cache (kik-cache-<name>),
+    and only files with the cache's own suffix are indexed and evicted,
+    so the directory can hold other files and be shared by caches with different names.
+
+    :param directory: the directory in which the cache's subdirectory is created. Created if it doesn't exist.
+    :param max_bytes: the maximum total size of the cached files
+    :param name: the name of the cache, which names its subdirectory
+    """
+
+    def __init__(self, directory: str, max_bytes: int, name: str):
+        if max_bytes <= 0:
+            raise ValueError(f"max_bytes must be positive, got {max_bytes}")
+        if not _VALID_KEY.match(name):
+            raise ValueError(f"invalid cache name {name}")
+        self.directory = os.path.join(directory, _SUBDIRECTORY_PREFIX + name)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # type: OrderedDict[str, int]  # key -> size, least recently used first
+        self._total_bytes = 0
+        self._lock = RLock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def path(self, key: str) -> str:
+        """
+        Returns the path of the file stored under a key (whether it exists or not).
+        """
+        if not _VALID_KEY.match(key):
+            raise ValueError(f"invalid cache key {key}")
+        return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+    def get(self, key: str) -> Union[bytes, None]:
+        """
+        Returns the contents of a cached file and marks it as recently used, or None if it isn't cached.
+        """
+        path = self.path(key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self._forget(key)
+                return None
+            self._touch(key)
+            return data
+
+    def get_path(self, key: str) -> Union[str, None]:
+        """
+        Like get(), but returns the path of the cached file instead of its contents.
+        """
+        path = self.path(key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if not os.path.exists(path):
+                self._forget(key)
+                return None
+            self._touch(key)
+            return path
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Stores data under a key, replacing any previous data, and evicts old files if needed.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=_TEMP_PREFIX)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.put_file(key, temp_path)
+
+    def put_file(self, key: str, source_path: str) -> str:
+        """
+        Moves an existing file into the cache under a key, replacing any previous data, and evicts old files if needed.
+        The file should be on the same file system as the cache directory (for example, created with new_temp_file()).
+
+        :return: the path of the cached file
+        """
+        path = self.path(key)
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            os.remove(source_path)
+            raise ValueError(f"file of {size} bytes is larger than the cache ({self.max_bytes} bytes)")
+
+        with self._lock:
+            os.replace(source_path, path)
+            self._forget(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict(keep=key)
+        return path
+
+    def new_temp_file(self) -> str:
+        """
+        Creates an empty temporary file in the cache directory and returns its path.
+        Once written, the file can be added with put_file().
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=_TEMP_PREFIX)
+        os.close(fd)
+        return temp_path
+
+    def remove(self, key: str) -> None:
+        path = self.path(key)
+        with self._lock:
+            self._forget(key)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _load(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.startswith(_TEMP_PREFIX):
+                if stat.st_mtime < time.time() - _STALE_TEMP_SECONDS:
+                    # leftover of an interrupted write (recent ones may belong to another client sharing the cache)
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                continue
+            key = entry.name[: -len(_ENTRY_SUFFIX)]
+            if not entry.name.endswith(_ENTRY_SUFFIX) or not _VALID_KEY.match(key):
+                # not written by the cache
+                continue
+            files.append((stat.st_mtime, key, stat.st_size))
+
+        # an over-budget cache (e.g. after max_bytes was lowered) shrinks on the next put, not here
+        with self._lock:
+            for _, key, size in sorted(files):
+                self._entries[key] = size
+                self._total_bytes += size
+
+    def _touch(self, key: str):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self, keep: Union[str, None] = None):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self.remove(key)
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Iterable, List, Union
+
+from kik_unofficial.datatypes.xmpp import group_adminship
+from kik_unofficial.datatypes.xmpp.base_elements import XMPPElement
+
+log = logging.getLogger("kik_unofficial")
+
+
+class GroupAdminResult:
+    """
+    The result of a group administration action on one member.
+
+    :param action: the action ("add", "remove", "ban", "unban", "promote" or "demote")
+    :param group_jid: the JID of the group
+    :param peer_jid: the JID of the member
+    :param error: the reason the action failed (a KikErrorException, a TimeoutError, ...), or None if it succeeded
+    """
+
+    def __init__(self, action: str, group_jid: str, peer_jid: str, error: Union[BaseException, None] = None):
+        self.action = action
+        self.group_jid = group_jid
+        self.peer_jid = peer_jid
+        self.error = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        outcome = "ok" if self.error is None else repr(self.error)
+        return f"GroupAdminResult(action={self.action}, group_jid={self.group_jid}, peer_jid={self.peer_jid}, {outcome})"
+
+
+class GroupAdminExecutor:
+    """
+    Runs group administration actions on many members at once (for example, banning the members of a raid),
+    and returns a Future of the result for each member.
+
+    Adding members is batched, with up to max_batch_size members in each request (the result of a request applies to all of them).
+    The other actions take one request per member, and are pipelined: up to max_in_flight requests wait for their response at once,
+    and no more than max_per_second are sent per second, to stay under the rate limits of the server.
+    Actions run one after the other, in the order they were submitted.
+
+    :param send_iq: sends an iq request, waiting at most a timeout for the connection, and returns a Future of its response
+                    (KikClient._send_iq). It raises if the request can't be sent.
+    :param max_in_flight: the maximum number of requests waiting for their response at once
+    :param max_per_second: the maximum number of requests sent per second
+    :param max_batch_size: the maximum number of members added in a single request
+    :param timeout: the number of seconds to wait for the response to a request before failing it with a TimeoutError
+    """
+
+    # action -> request class taking (group_jid, peer_jid)
+    requests = {
+        "remove": group_adminship.RemoveFromGroupRequest,
+        "ban": group_adminship.BanMemberRequest,
+        "unban": group_adminship.UnbanRequest,
+        "promote": group_adminship.PromoteToAdminRequest,
+        "demote": group_adminship.DemoteAdminRequest,
+    }
+
+    def __init__(
+        self,
+        send_iq: Callable[[XMPPElement, float], Future],
+        max_in_flight: int = 8,
+        max_per_second: float = 5.0,
+        max_batch_size: int = 50,
+        timeout: float = 30.0,
+    ):
+        self.send_iq = send_iq
+        self.max_in_flight = max_in_flight
+        self.max_per_second = max_per_second
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+
+        self._last_send_time = 0.0
+        self._executor = None  # type: ThreadPoolExecutor | None
+        self._lock = Lock()
+
+    def submit(self, action: str, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        """
+        Runs an action on members of a group.
+
+        :param action: "add", "remove", "ban", "unban", "promote" or "demote"
+        :param group_jid: the JID of the group
+        :param peer_jids: the JIDs of the members
+        :return: a Future of the list of GroupAdminResult, one for each member, in order
+        """
+        if action != "add" and action not in self.requests:
+            raise ValueError(f"unknown group admin action {action}")
+        peer_jids = list(peer_jids)
+        return self._get_executor().submit(self._run, action, group_jid, peer_jids)
+
+    def add_members(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        return self.submit("add", group_jid, peer_jids)
+
+    def remove_members(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        return self.submit("remove", group_jid, peer_jids)
+
+    def ban_members(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        return self.submit("ban", group_jid, peer_jids)
+
+    def unban_members(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        return self.submit("unban", group_jid, peer_jids)
+
+    def promote_members(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        return self.submit("promote", group_jid, peer_jids)
+
+    def demote_members(self, group_jid: str, peer_jids: Iterable[str]) -> Future:
+        return self.submit("demote", group_jid, peer_jids)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="group-admin")
+            return self._executor
+
+    def _run(self, action: str, group_jid: str, peer_jids: List[str]) -> List[GroupAdminResult]:
+        if action == "add":
+            batches = [peer_jids[i : i + self.max_batch_size] for i in range(0, len(peer_jids), self.max_batch_size)]  # noqa: E203
+            requests = [(group_adminship.AddMembersRequest(group_jid, batch), batch) for batch in batches]
+        else:
+            request_class = self.requests[action]
+            requests = [(request_class(group_jid, peer_jid), [peer_jid]) for peer_jid in peer_jids]
+
+        errors = {}  # type: dict[str, Union[BaseException, None]]  # peer JID -> error
+        in_flight = {}  # type: dict[Future, tuple[XMPPElement, List[str], float]]  # response -> (request, members, deadline)
+        for request, members in requests:
+            while len(in_flight) >= self.max_in_flight:
+                self._wait_for_responses(in_flight, errors)
+            self._wait_for_rate_limit()
+            # the timeout includes waiting for the connection
+            deadline = time.monotonic() + self.timeout
+            try:
+                response = self.send_iq(request, self.timeout)
+            except Exception as e:
+                errors.update((peer_jid, e) for peer_jid in members)
+                continue
+            in_flight[response] = (request, members, deadline)
+        while in_flight:
+            self._wait_for_responses(in_flight, errors)
+
+        results = [GroupAdminResult(action, group_jid, peer_jid, errors.get(peer_jid)) for peer_jid in peer_jids]
+        failed = sum(not result.succeeded for result in results)
+        log.info("Group admin action '%s' on %s members of %s: %s succeeded, %s failed", action, len(results), group_jid, len(results) - failed, failed)
+        return results
+
+    def _wait_for_responses(self, in_flight: dict, errors: dict):
+        """
+        Waits until at least one request in flight gets its response or times out.
+        """
+        next_deadline = min(deadline for _, _, deadline in in_flight.values())
+        done, _ = wait(in_flight, timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for response, (request, members, deadline) in list(in_flight.items()):
+            if response not in done and deadline <= now and response.cancel():
+                error = TimeoutError(f"no response to {type(request).__name__} {request.message_id} in {self.timeout} seconds")
+            elif response.done():
+                # including a response that arrived as the request timed out, so it couldn't be cancelled
+                error = CancelledError(f"{type(request).__name__} {request.message_id} was cancelled") if response.cancelled() else response.exception()
+            else:
+                continue
+            del in_flight[response]
+            errors.update((peer_jid, error) for peer_jid in members)
+
+    def _wait_for_rate_limit(self):
+        if self.max_per_second:
+            delay = self._last_send_time + 1 / self.max_per_second - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self._last_send_time = time.monotonic()
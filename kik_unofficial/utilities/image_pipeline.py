@@ -0,0 +1,277 @@
+"""
+Prepares outgoing images (decoding, scaling, JPEG encoding and hashing) outside the caller's thread.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import pathlib
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Union
+
+from kik_unofficial.utilities.disk_cache import LRUDiskCache
+from kik_unofficial.utilities.parsing_utilities import ParsingUtilities, get_file_bytes
+
+log = logging.getLogger("kik_unofficial")
+
+DEFAULT_WORKERS = 0
+
+
+def default_mp_context():
+    """
+    Returns the multiprocessing context the worker processes are started with by default.
+    The client runs several threads, and forking a process with threads can deadlock it, so workers are never forked from it.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+class PreparedImageCache:
+    """
+    A content-addressed cache of prepared images, keyed by the SHA1 of the source image bytes.
+
+    Each entry stores the scaled JPEG, the preview, the hashes and, once uploaded, the content ID of the upload.
+    Sending the same image again then skips the decoding and encoding, and reuses the uploaded content when possible.
+
+    :param directory: the directory in which prepared images are stored
+    :param max_bytes: the maximum disk space used by the cache. The least recently used images are evicted first.
+    :param upload_ttl: for how many seconds an uploaded content ID is reused.
+                       Kik doesn't keep uploaded content forever, so after this the image is uploaded again.
+                       If None, uploads are never reused.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 100 * 1024 * 1024, upload_ttl: Union[int, None] = 24 * 60 * 60):
+        self.files = LRUDiskCache(directory, max_bytes, "images")
+        self.upload_ttl = upload_ttl
+
+    @staticmethod
+    def source_key(file_location: Union[str, bytes, pathlib.Path]) -> str:
+        """
+        Returns the cache key of a source image, which is the SHA1 of its bytes.
+        """
+        sha1 = hashlib.sha1()
+        if isinstance(file_location, bytes):
+            sha1.update(file_location)
+        else:
+            with open(file_location, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha1.update(block)
+        return sha1.hexdigest()
+
+    def get(self, key: str) -> Union[dict, None]:
+        """
+        Returns the prepared image stored under a key, in the format of ParsingUtilities.parse_image, or None.
+
+        If the image was uploaded recently enough, the result also contains its 'content_id'.
+        """
+        metadata = self.files.get(f"{key}.json")
+        original = self.files.get(f"{key}.jpg")
+        preview = self.files.get(f"{key}.preview.jpg")
+        if metadata is None or original is None or preview is None:
+            return None
+
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            log.warning("Ignoring corrupted cache entry for image %s", key)
+            return None
+
+        uploaded_at = metadata.pop("uploaded_at", None)
+        content_id = metadata.pop("content_id", None)
+        if content_id and (self.upload_ttl is None or uploaded_at is None or time.time() - uploaded_at > self.upload_ttl):
+            content_id = None
+
+        parsed = dict(metadata, original=original, image_bytes=preview, source_key=key)
+        if content_id:
+            parsed["content_id"] = content_id
+        return parsed
+
+    def put(self, key: str, parsed: dict) -> None:
+        """
+        Stores a prepared image (as returned by ParsingUtilities.parse_image) under a key.
+        """
+        self.files.put(f"{key}.jpg", parsed["original"])
+        self.files.put(f"{key}.preview.jpg", parsed["image_bytes"])
+        self._put_metadata(key, {name: parsed[name] for name in ("size", "SHA1", "SHA1Scaled", "blockhash", "MD5")})
+
+    def set_content_id(self, key: str, content_id: str) -> None:
+        """
+        Records that the prepared image stored under a key was uploaded with the given content ID.
+        """
+        if self.upload_ttl is None:
+            return
+        metadata = self.files.get(f"{key}.json")
+        if metadata is None:
+            return
+        metadata = json.loads(metadata)
+        metadata["content_id"] = content_id
+        metadata["uploaded_at"] = time.time()
+        self._put_metadata(key, metadata)
+
+    def _put_metadata(self, key: str, metadata: dict):
+        self.files.put(f"{key}.json", json.dumps(metadata).encode())
+
+
+def _prepare_image(file_location: Union[str, bytes, pathlib.Path], source_key: Union[str, None]) -> dict:
+    parsed = ParsingUtilities.parse_image(file_location)
+    if source_key:
+        parsed["source_key"] = source_key
+    return parsed
+
+
+class ImagePreparationPool:
+    """
+    Runs ParsingUtilities.parse_image off the caller's thread: on a background thread by default,
+    or in a pool of worker processes, so that preparing many images scales with the number of cores instead of being bound by the GIL.
+
+    Images are looked up in the cache (if any) on the background thread too, since that hashes the whole image.
+    The worker processes are only started when the first image is submitted.
+    Starting them (with forkserver or spawn) imports the __main__ module again,
+    so a script that uses them must keep its top-level code under `if __name__ == "__main__":`.
+    If the pool breaks anyway, images are prepared on the background thread from then on.
+
+    :param max_workers: the number of worker processes (DEFAULT_WORKERS, 0, by default).
+                        If 0, no worker processes are started and images are prepared on the background thread.
+    :param mp_context: the multiprocessing context used to start the worker processes.
+                       Defaults to "forkserver" where it's available, else "spawn" (see default_mp_context).
+    :param cache: an optional cache of prepared images. Images found in the cache aren't prepared again.
+    """
+
+    def __init__(self, max_workers: Union[int, None] = None, mp_context=None, cache: Union[PreparedImageCache, None] = None):
+        if max_workers is None:
+            max_workers = DEFAULT_WORKERS
+        if max_workers < 0:
+            raise ValueError(f"max_workers must be 0 or greater, got {max_workers}")
+        self.max_workers = max_workers
+        self.mp_context = mp_context if mp_context is not None else default_mp_context()
+        self.cache = cache
+        self._executor = None  # type: ProcessPoolExecutor | None
+        self._thread_executor = None  # type: ThreadPoolExecutor | None
+        self._processes_broken = False
+        self._lock = Lock()
+
+    def submit(self, file_location: Union[str, bytes, pathlib.Path, io.IOBase]) -> Future:
+        """
+        Schedules the preparation of an image.
+
+        :param file_location: The path to the image file OR its bytes OR an IOBase object
+        :return: a Future of the dict returned by ParsingUtilities.parse_image
+        """
+        if not isinstance(file_location, (str, bytes, pathlib.Path)):
+            # File objects can't be sent to another process, so read them here
+            file_location = get_file_bytes(file_location)
+
+        future = Future()
+        self._get_thread_executor().submit(self._look_up_and_prepare, file_location, future)
+        return future
+
+    def _look_up_and_prepare(self, file_location: Union[str, bytes, pathlib.Path], future: Future):
+        # runs on the background thread
+        source_key = None
+        if self.cache:
+            try:
+                source_key = self.cache.source_key(file_location)
+                parsed = self.cache.get(source_key)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if parsed:
+                future.set_result(parsed)
+                return
+
+        if self.max_workers == 0 or self._processes_broken:
+            self._prepare_in_thread(file_location, source_key, future)
+            return
+        try:
+            prepared = self._get_executor().submit(_prepare_image, file_location, source_key)
+        except BrokenProcessPool:
+            self._on_broken_pool()
+            self._prepare_in_thread(file_location, source_key, future)
+            return
+        except Exception as e:
+            # for example, the pool was shut down meanwhile
+            future.set_exception(e)
+            return
+        prepared.add_done_callback(lambda done: self._on_prepared_in_process(done, file_location, source_key, future))
+
+    def _prepare_in_thread(self, file_location: Union[str, bytes, pathlib.Path], source_key: Union[str, None], future: Future):
+        try:
+            parsed = _prepare_image(file_location, source_key)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self._store_in_cache(parsed)
+        future.set_result(parsed)
+
+    def _on_prepared_in_process(self, prepared: Future, file_location: Union[str, bytes, pathlib.Path], source_key: Union[str, None], future: Future):
+        if prepared.cancelled():
+            future.cancel()
+            return
+        if isinstance(prepared.exception(), BrokenProcessPool):
+            self._on_broken_pool()
+            try:
+                self._get_thread_executor().submit(self._prepare_in_thread, file_location, source_key, future)
+            except Exception as e:
+                future.set_exception(e)
+            return
+        if prepared.exception():
+            future.set_exception(prepared.exception())
+            return
+        parsed = prepared.result()
+        self._store_in_cache(parsed)
+        future.set_result(parsed)
+
+    def _store_in_cache(self, parsed: dict):
+        if not self.cache:
+            return
+        try:
+            self.cache.put(parsed["source_key"], parsed)
+        except (OSError, ValueError):
+            # ValueError: the image is larger than the cache
+            log.warning("Failed to store prepared image %s in the cache", parsed["source_key"], exc_info=True)
+
+    def _on_broken_pool(self):
+        with self._lock:
+            if self._processes_broken:
+                return
+            self._processes_broken = True
+            executor, self._executor = self._executor, None
+        log.warning(
+            "The image worker processes stopped abruptly, so images are prepared in a thread from now on. "
+            'When using image_workers, keep the top-level code of your script under if __name__ == "__main__":'
+        )
+        if executor:
+            executor.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the background thread and the worker processes. Images submitted afterwards start new ones.
+
+        :param wait: if True, blocks until all pending images are prepared
+        """
+        with self._lock:
+            thread_executor, self._thread_executor = self._thread_executor, None
+            executor, self._executor = self._executor, None
+        if thread_executor:
+            thread_executor.shutdown(wait=wait)
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context)
+            return self._executor
+
+    def _get_thread_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_executor is None:
+                self._thread_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-prepare")
+            return self._thread_executor
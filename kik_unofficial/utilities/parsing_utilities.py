@@ -3,7 +3,8 @@ import pathlib
 import io
 import os
 import hashlib
-import uuid
+import shutil
+import subprocess
 from typing import Union
 
 from PIL import Image
@@ -27,6 +28,63 @@ def get_file_bytes(file_location: str or bytes or pathlib.Path or io.IOBase):
     return data
 
 
+def _hash_content(file_location: Union[str, bytes, pathlib.Path, io.IOBase], chunk_size: int) -> tuple:
+    """
+    Hashes content for an upload in a single pass, reading it a block at a time.
+
+    :return: the content to upload (the path, the bytes, or the file object rewound to its start, or its bytes if it can't be rewound),
+        its size, its MD5 and the MD5 of every chunk of chunk_size bytes
+    """
+    if isinstance(file_location, (str, pathlib.Path)):
+        with open(file_location, "rb") as f:
+            return (file_location, *_hash_stream(f, chunk_size))
+    if isinstance(file_location, bytes):
+        return (file_location, *_hash_stream(io.BytesIO(file_location), chunk_size))
+    if file_location.seekable():
+        file_location.seek(0)
+        digests = _hash_stream(file_location, chunk_size)
+        file_location.seek(0)
+        return (file_location, *digests)
+    data = file_location.read()
+    return (data, *_hash_stream(io.BytesIO(data), chunk_size))
+
+
+def _hash_stream(stream, chunk_size: int) -> tuple:
+    size = 0
+    md5 = hashlib.md5()
+    chunk_md5s = []
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        size += len(chunk)
+        md5.update(chunk)
+        chunk_md5s.append(hashlib.md5(chunk).hexdigest())
+    return size, md5.hexdigest(), chunk_md5s or [md5.hexdigest()]
+
+
+def _start_process(args: list) -> subprocess.Popen:
+    return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def _finish_process(process: subprocess.Popen, timeout: float = 30) -> Union[bytes, None]:
+    """
+    Returns the output of a process, or None if it failed or didn't finish in time.
+    """
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return None
+    return output if process.returncode == 0 else None
+
+
+def _kill_process(process: subprocess.Popen):
+    """
+    Stops a process whose output isn't needed anymore, and waits for it.
+    """
+    process.kill()
+    process.communicate()
+
+
 def get_text_of_tag(element: Tag, tag: str, default: Union[str, None] = None) -> Union[str, None]:
     """
     Returns the text of a direct child, if present.
@@ -106,50 +164,129 @@ class ParsingUtilities:
     def parse_image(file_location: str or bytes or pathlib.Path or io.IOBase) -> dict:
         """
         Converts images to .jpg and compresses/upscales them so that large image files can be sent after compression.
-        """
-        preview_out = io.BytesIO()
-        image_out = io.BytesIO()
-        image_out.name = f"{str(uuid.uuid4())}.jpg"
 
-        file_location = get_file_bytes(file_location)
-        if isinstance(file_location, bytes):
+        Large JPEGs are decoded at a reduced resolution (still at least the target size),
+        and the preview is scaled from the already scaled image rather than from the source.
+        """
+        if isinstance(file_location, (str, pathlib.Path)):
+            if not os.path.exists(file_location):
+                raise Exception("The file path %s does not exist", file_location)
+        elif isinstance(file_location, bytes):
             file_location = io.BytesIO(file_location)
+        elif isinstance(file_location, io.IOBase) or hasattr(file_location, "getvalue"):
+            # Read from the start of the stream, like get_file_bytes does
+            file_location.seek(0)
+        else:
+            raise ValueError("File cannot be a type of %s", type(file_location))
+
+        with Image.open(file_location) as img:
+            width, height = img.size
+            larger_dim = max(height, width)
+            ratio = larger_dim / 1600
+            image_size = (round(width / ratio), round(height / ratio))
+            preview_ratio = larger_dim / 400
+            preview_size = (round(width / preview_ratio), round(height / preview_ratio))
+
+            # Only has an effect on JPEGs, which the decoder can scale down by 1/2, 1/4 or 1/8 for free
+            img.draft("RGB", image_size)
+            rgb_img = img.convert("RGB") if img.mode != "RGB" else img
+            # For other formats, reduce by an integer factor before resampling the rest of the way
+            image = rgb_img.resize(image_size, reducing_gap=3.0)
+            preview_image = image.resize(preview_size)
 
-        img = Image.open(file_location)
-        width, height = img.size
-        larger_dim = max(height, width)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        ratio = larger_dim / 1600
-        image = img.resize((round(width / ratio), round(height / ratio)))
-        preview_ratio = larger_dim / 400
-        preview_image = img.resize((round(width / preview_ratio), round(height / preview_ratio)))
-
+        image_out = io.BytesIO()
         image.save(image_out, format="JPEG")
-        preview_image.save(preview_out, format="JPEG")
-
-        size = image_out.tell()
         final_og = image_out.getvalue()
+        image_out.close()
+        image.close()
+
+        preview_out = io.BytesIO()
+        preview_image.save(preview_out, format="JPEG")
         final_pre = preview_out.getvalue()
+        preview_out.close()
 
-        image_bytes = get_file_bytes(final_pre)
-        sha1_og = ParsingUtilities.read_file_as_sha1(final_og)
-        sha1_scaled = ParsingUtilities.read_file_as_sha1(final_pre)
         block_scaled = blockhash(preview_image, 16)
-        md5 = hashlib.md5(final_og).hexdigest()
-        image_out.close()
-        preview_out.close()
         preview_image.close()
-        img.close()
 
         return {
-            "image_bytes": image_bytes,
-            "size": size,
+            "image_bytes": final_pre,
+            "size": len(final_og),
             "original": final_og,
-            "SHA1": sha1_og,
-            "SHA1Scaled": sha1_scaled,
+            "SHA1": hashlib.sha1(final_og).hexdigest(),
+            "SHA1Scaled": hashlib.sha1(final_pre).hexdigest(),
             "blockhash": block_scaled,
+            "MD5": hashlib.md5(final_og).hexdigest(),
+        }
+
+    @staticmethod
+    def parse_video(
+        file_location: str or bytes or pathlib.Path or io.IOBase,
+        thumbnail: str or bytes or pathlib.Path or io.IOBase = None,
+        chunk_size: int = 1024 * 1024,
+    ) -> dict:
+        """
+        Prepares a video (expected to be an MP4) for sending: hashes it for the upload and scales its preview.
+        The video itself is not read into memory: it's hashed a block at a time, and the upload streams it from the returned 'file'
+        (see content.upload_video), using the returned 'MD5' and 'chunk_md5s' of every chunk of chunk_size bytes.
+
+        If no thumbnail is given, the first frame of the video is extracted with ffmpeg. The duration is read with ffprobe.
+        Both are optional: without them, or for videos that aren't files on disk, the video is sent without a duration (and without a preview,
+        unless a thumbnail is given).
+        """
+        is_path = isinstance(file_location, (str, pathlib.Path))
+        if is_path and not os.path.exists(file_location):
+            raise Exception("The file path %s does not exist", file_location)
+
+        # ffmpeg and ffprobe run while the video is being hashed
+        ffmpeg = shutil.which("ffmpeg") if is_path and thumbnail is None else None
+        ffprobe = shutil.which("ffprobe") if is_path else None
+        thumbnail_process = duration_process = None
+        try:
+            if ffmpeg:
+                thumbnail_process = _start_process(
+                    [ffmpeg, "-v", "error", "-i", str(file_location), "-frames:v", "1", "-f", "image2pipe", "-c:v", "mjpeg", "-"]
+                )
+            if ffprobe:
+                duration_process = _start_process([ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(file_location)])
+
+            file, size, md5, chunk_md5s = _hash_content(file_location, chunk_size)
+        except BaseException:
+            for process in (thumbnail_process, duration_process):
+                if process:
+                    _kill_process(process)
+            raise
+
+        if thumbnail_process:
+            thumbnail = _finish_process(thumbnail_process)
+        duration = None
+        if duration_process:
+            output = _finish_process(duration_process)
+            try:
+                duration = round(float(output) * 1000) if output else None
+            except ValueError:
+                duration = None
+
+        preview = None
+        if thumbnail is not None:
+            if isinstance(thumbnail, bytes):
+                thumbnail = io.BytesIO(thumbnail)
+            with Image.open(thumbnail) as img:
+                img.draft("RGB", (400, 400))
+                preview_image = img.convert("RGB")
+            preview_image.thumbnail((400, 400))
+            preview_out = io.BytesIO()
+            preview_image.save(preview_out, format="JPEG")
+            preview = preview_out.getvalue()
+            preview_image.close()
+
+        return {
+            "file": file,
+            "size": size,
             "MD5": md5,
+            "chunk_size": chunk_size,
+            "chunk_md5s": chunk_md5s,
+            "duration": duration,
+            "image_bytes": preview,
         }
 
     @staticmethod
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, InvalidStateError
+from threading import Lock
+from typing import Union
+
+from kik_unofficial.datatypes.exceptions import KikErrorException
+from kik_unofficial.parser.xml_element import XmlElement
+
+
+class PendingIqs:
+    """
+    Keeps a Future for each iq request waiting for its response, by message ID.
+
+    A Future is resolved with the response when an iq with the same ID and type "result" is received,
+    or failed with a KikErrorException when its type is "error".
+    """
+
+    def __init__(self):
+        self._futures = {}  # type: dict[str, Future]
+        self._lock = Lock()
+
+    def add(self, message_id: str) -> Future:
+        """
+        Returns a Future of the response to a request. Must be called before the request is sent.
+        Cancelling the Future stops waiting for the response.
+        """
+        future = Future()
+        with self._lock:
+            self._futures[message_id] = future
+        # a cancelled request (for example, after a timeout) stops waiting for its response
+        future.add_done_callback(lambda f: f.cancelled() and self.discard(message_id))
+        return future
+
+    def resolve(self, iq_element: XmlElement) -> bool:
+        """
+        Resolves the Future of the request an iq responds to.
+
+        :return: True if a request was waiting for the iq
+        """
+        with self._lock:
+            future = self._futures.pop(iq_element.get("id"), None)
+        if future is None:
+            return False
+        try:
+            if iq_element.get("type") == "error":
+                error = iq_element.find("error", recursive=False)
+                condition = next((child.name for child in error.find_all(recursive=False)), None) if error else None
+                future.set_exception(KikErrorException(iq_element, f"iq {iq_element['id']} failed: {condition or 'unknown error'}"))
+            else:
+                future.set_result(iq_element)
+        except InvalidStateError:
+            # cancelled meanwhile (for example, the request timed out on another thread)
+            pass
+        return True
+
+    def discard(self, message_id: str) -> Union[Future, None]:
+        """
+        Stops waiting for the response to a request (for example, after a timeout).
+        """
+        with self._lock:
+            return self._futures.pop(message_id, None)
+
+    def fail_all(self, error: BaseException):
+        """
+        Fails all the pending requests (for example, when the connection is lost, since their responses won't arrive).
+        """
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                # cancelled meanwhile
+                pass
+
+    def __len__(self):
+        return len(self._futures)
@@ -1,4 +1,5 @@
 import threading
+from concurrent.futures import CancelledError, Future, InvalidStateError
 
 
 def run_in_new_thread(fn):
@@ -11,6 +12,35 @@ def run_in_new_thread(fn):
     return run
 
 
+def resolve_future(future: Future, result=None, error: BaseException = None) -> None:
+    """
+    Sets the result or the exception of a Future, unless it's already done (for example, cancelled).
+    """
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def chain_future(source: Future, target: Future) -> None:
+    """
+    Resolves a Future with the outcome of another one once it's done. A cancelled source fails the target with CancelledError.
+    """
+
+    def copy(done: Future):
+        if done.cancelled():
+            resolve_future(target, error=CancelledError())
+        elif done.exception() is not None:
+            resolve_future(target, error=done.exception())
+        else:
+            resolve_future(target, done.result())
+
+    source.add_done_callback(copy)
+
+
 """
 class RunInNewThreadDecorate(type):
     def __new__(mcls, name, bases, attrs):
@@ -1,32 +1,72 @@
 import logging
-
-from bs4 import BeautifulSoup
+from typing import Union
 
 from kik_unofficial.callbacks import KikClientCallback
 from kik_unofficial.datatypes.xmpp.account import GetMyProfileResponse, GetMutedConvosResponse
-from kik_unofficial.datatypes.xmpp import chatting
+from kik_unofficial.datatypes.xmpp import chatting, login
+from kik_unofficial.datatypes.xmpp.base_elements import XMPPResponse
 from kik_unofficial.datatypes.xmpp.errors import SignUpError, LoginError
 from kik_unofficial.datatypes.xmpp.history import HistoryResponse
 from kik_unofficial.datatypes.xmpp.login import LoginResponse
 from kik_unofficial.datatypes.xmpp.roster import FetchRosterResponse, FriendBatchResponse, QueryUserByUsernameResponse
 from kik_unofficial.datatypes.xmpp.sign_up import RegisterResponse, UsernameUniquenessResponse
 from kik_unofficial.datatypes.xmpp.xiphias import UsersResponse, UsersByAliasResponse, GroupSearchResponse
+from kik_unofficial.parser.parser import HeadOnlyStanza
+from kik_unofficial.parser.xml_element import XmlElement
+from kik_unofficial.utilities.kik_server_clock import KikServerClock
+from kik_unofficial.utilities.jid_utilities import is_group_jid
 from kik_unofficial.utilities.parsing_utilities import get_text_of_tag
+from kik_unofficial.utilities.threading_utils import run_in_new_thread
 
 log = logging.getLogger("kik_unofficial")
 
 
 class XmppHandler:
+    # The callbacks this handler calls. Stanzas are skipped before being parsed if the client isn't subscribed to any of them.
+    # Empty for handlers that have to run regardless (for example, to update the client's state).
+    events = ()  # type: tuple[str, ...]
+
     def __init__(self, callback: KikClientCallback, client):
         self.callback = callback
         self.client = client
 
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         raise NotImplementedError
 
+    def has_listeners(self) -> bool:
+        """
+        Returns False if the stanzas of this handler can be skipped, because the client isn't subscribed to any of its events.
+        """
+        return not self.events or any(map(self.client.is_subscribed, self.events))
+
+    def skip(self, data: XmlElement):
+        """
+        Called instead of handle for the stanzas that are skipped because nobody listens to them.
+        """
+        pass
+
+    def _emit(self, event: str, event_class, data: XmlElement):
+        """
+        Calls a callback with the event parsed from a stanza. The event is only parsed if the client is subscribed to it.
+        """
+        if self.client.is_subscribed(event):
+            getattr(self.callback, event)(event_class(data))
+
 
 class XMPPChatMessageHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    # app-id -> (callback method, message class)
+    content_handlers = {
+        "com.kik.cards": ("on_card_received", chatting.IncomingCardMessage),
+        "com.kik.ext.gallery": ("on_image_received", chatting.IncomingImageMessage),
+        "com.kik.ext.camera": ("on_image_received", chatting.IncomingImageMessage),
+        "com.kik.ext.gif": ("on_gif_received", chatting.IncomingGifMessage),
+        "com.kik.ext.stickers": ("on_group_sticker", chatting.IncomingGroupSticker),
+        "com.kik.ext.video-camera": ("on_video_received", chatting.IncomingVideoMessage),
+        "com.kik.ext.video-gallery": ("on_video_received", chatting.IncomingVideoMessage),
+    }
+    events = ("on_chat_message_received", "on_friend_attribution", "on_status_message_received") + tuple({event for event, _ in content_handlers.values()})
+
+    def handle(self, data: XmlElement):
         # We received a chat message.
 
         if data.find("content", recursive=False):
@@ -34,61 +74,165 @@ class XMPPChatMessageHandler(XmppHandler):
             self.handle_content(data)
         elif get_text_of_tag(data, "body"):
             # regular text message
-            self.callback.on_chat_message_received(chatting.IncomingChatMessage(data))
+            self._emit("on_chat_message_received", chatting.IncomingChatMessage, data)
         elif data.find("friend-attribution", recursive=False):
             # friend attribution
-            self.callback.on_friend_attribution(chatting.IncomingFriendAttribution(data))
+            self._emit("on_friend_attribution", chatting.IncomingFriendAttribution, data)
         elif data.find("status", recursive=False):
             # status
-            self.callback.on_status_message_received(chatting.IncomingStatusResponse(data))
-        elif data.find("xiphias-mobileremote-call", recursive=False):
-            # this is usually a Play Integrity request
-            mobile_remote_call = data.find("xiphias-mobileremote-call", recursive=False)
-            log.warning(f"[!] Received mobile-remote-call with method '{mobile_remote_call['method']}' of service '{mobile_remote_call['service']}'")
-        else:
+            self._emit("on_status_message_received", chatting.IncomingStatusResponse, data)
+        elif not self.log_mobile_remote_call(data):
             log.debug(f"[-] Received unknown chat message. contents: {str(data)}")
 
-    def handle_content(self, data: BeautifulSoup):
+    def skip(self, data: XmlElement):
+        # mobile remote calls are logged even if nobody listens to chat messages
+        self.log_mobile_remote_call(data)
+
+    @staticmethod
+    def log_mobile_remote_call(data: XmlElement) -> bool:
+        mobile_remote_call = data.find("xiphias-mobileremote-call", recursive=False)
+        if not mobile_remote_call:
+            return False
+        # this is usually a Play Integrity request
+        log.warning(f"[!] Received mobile-remote-call with method '{mobile_remote_call['method']}' of service '{mobile_remote_call['service']}'")
+        return True
+
+    def handle_content(self, data: XmlElement):
         content = data.find("content", recursive=False)
-        app_id = content["app-id"]
-        if app_id == "com.kik.cards":
-            self.callback.on_card_received(chatting.IncomingCardMessage(data))
-        elif app_id in ["com.kik.ext.gallery", "com.kik.ext.camera"]:
-            self.callback.on_image_received(chatting.IncomingImageMessage(data))
-        elif app_id == "com.kik.ext.gif":
-            self.callback.on_gif_received(chatting.IncomingGifMessage(data))
-        elif app_id == "com.kik.ext.stickers":
-            self.callback.on_group_sticker(chatting.IncomingGroupSticker(data))
-        elif app_id in ["com.kik.ext.video-camera", "com.kik.ext.video-gallery"]:
-            self.callback.on_video_received(chatting.IncomingVideoMessage(data))
+        handler = self.content_handlers.get(content.get("app-id"))
+        if handler:
+            self._emit(*handler, data)
         else:
             log.debug(f"[-] Received unknown content message. contents: {str(data)}")
 
 
 class XMPPGroupChatMessageHandler(XMPPChatMessageHandler):
-    def handle(self, data: BeautifulSoup):
+    events = (
+        "on_group_message_received",
+        "on_group_is_typing_event_received",
+        "on_group_status_received",
+        "on_group_sysmsg_received",
+    ) + tuple({event for event, _ in XMPPChatMessageHandler.content_handlers.values()})
+
+    def handle(self, data: XmlElement):
         if data.find("content", recursive=False):
             self.handle_content(data)
         elif get_text_of_tag(data, "body"):
-            self.callback.on_group_message_received(chatting.IncomingGroupChatMessage(data))
+            self._emit("on_group_message_received", chatting.IncomingGroupChatMessage, data)
         elif data.find("is-typing", recursive=False):
-            self.callback.on_group_is_typing_event_received(chatting.IncomingGroupIsTypingEvent(data))
+            self._emit("on_group_is_typing_event_received", chatting.IncomingGroupIsTypingEvent, data)
         elif data.find("status", recursive=False):
-            self.callback.on_group_status_received(chatting.IncomingGroupStatus(data))
+            self.handle_group_update("on_group_status_received", chatting.IncomingGroupStatus, data)
         elif data.find("sysmsg", recursive=False):
-            self.callback.on_group_sysmsg_received(chatting.IncomingGroupSysmsg(data))
+            self.handle_group_update("on_group_sysmsg_received", chatting.IncomingGroupSysmsg, data)
         else:
             log.debug(f"[-] Received unknown group message. contents: {str(data)}")
 
+    @staticmethod
+    def is_group_update(data: XmlElement) -> bool:
+        """
+        Returns True if a stanza is a group status or sysmsg message.
+        """
+        return (
+            data.name == "message"
+            and data.get("type") == "groupchat"
+            and not data.find("content", recursive=False)
+            and not get_text_of_tag(data, "body")
+            and not data.find("is-typing", recursive=False)
+            and bool(data.find("status", recursive=False) or data.find("sysmsg", recursive=False))
+        )
+
+    def handle_group_update(self, event: str, event_class, data: XmlElement):
+        # status and sysmsg messages list the members that joined, left or were promoted, which the roster index keeps track of
+        index = self.client.roster_index
+        if index is None:
+            self._emit(event, event_class, data)
+            return
+        # with an index, group updates are handled one at a time in the order they arrived (see KikClient._on_stanza_read),
+        # so they're applied to it in order. The callbacks are then called from a thread of their own.
+        message = event_class(data)
+        changes = index.apply_group_update(message.group) if message.group else []
+        self._call_group_update_callbacks(event, message, changes)
+
+    @run_in_new_thread
+    def _call_group_update_callbacks(self, event: str, message, changes: list):
+        if self.client.is_subscribed(event):
+            getattr(self.callback, event)(message)
+        if changes and self.client.is_subscribed("on_group_membership_changed"):
+            for change in changes:
+                self.callback.on_group_membership_changed(change)
+
+    def has_listeners(self) -> bool:
+        return self.client.roster_index is not None or super().has_listeners()
+
+
+class ReceiptHandler(XmppHandler):
+    events = ("on_group_receipts_received", "on_message_delivered", "on_message_read")
+
+    def handle(self, data: XmlElement):
+        receipt = data.find("receipt", recursive=False)
+        if not receipt:
+            log.warning(f"Received unknown XMPP element type: {data}")
+            return
+        g = data.find("g", recursive=False)
+        if g and is_group_jid(g.get("jid", "")):
+            self._emit("on_group_receipts_received", chatting.IncomingGroupReceiptsEvent, data)
+        elif receipt["type"] == "delivered":
+            self._emit("on_message_delivered", chatting.IncomingMessageDeliveredEvent, data)
+        elif receipt["type"] == "read":
+            self._emit("on_message_read", chatting.IncomingMessageReadEvent, data)
+
+
+class IsTypingHandler(XmppHandler):
+    events = ("on_is_typing_event_received",)
+
+    def handle(self, data: XmlElement):
+        self._emit("on_is_typing_event_received", chatting.IncomingIsTypingEvent, data)
+
+
+class ErrorMessageHandler(XmppHandler):
+    events = ("on_error_message_received",)
+
+    def handle(self, data: XmlElement):
+        self._emit("on_error_message_received", chatting.IncomingErrorMessage, data)
+
+
+class StcHandler(XmppHandler):
+    events = ("on_captcha_received", "on_temp_ban_received")
+
+    def handle(self, data: XmlElement):
+        stc_type = data.stp["type"]
+        if stc_type == "ca":
+            self._emit("on_captcha_received", login.CaptchaElement, data)
+        elif stc_type == "bn":
+            self._emit("on_temp_ban_received", login.TempBanElement, data)
+        else:
+            log.warning(f"Unknown stc element type: {stc_type}")
+
+
+class PongHandler(XmppHandler):
+    events = ("on_pong",)
+
+    def handle(self, data: XmlElement):
+        # pongs recognized by the parser are timestamped as soon as they're read
+        received_time = getattr(data, "received_time", None) or KikServerClock.get_system_time()
+        latency = received_time - self.client._last_ping_sent_time
+        self.callback.on_pong(chatting.KikPongResponse(latency))
+
+
+class IgnoreHandler(XmppHandler):
+    def handle(self, data: XmlElement):
+        pass
+
 
 class HistoryHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         if data.find("query", recursive=False).find("history", recursive=False) is not None:
             self.callback.on_message_history_response(HistoryResponse(data))
 
 
 class UserProfileHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         # this will ignore results for other requests
         # like email change that also use the kik:iq:user-profile namespace
         if data.find("query", recursive=False).find("username", recursive=False):
@@ -96,7 +240,7 @@ class UserProfileHandler(XmppHandler):
 
 
 class MutedConvosHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         convo_elements = data.find("query", recursive=False).find_all("convo", recursive=False)
         if convo_elements and len(convo_elements) > 0:
             convos = []
@@ -110,12 +254,12 @@ class MutedConvosHandler(XmppHandler):
 
 
 class CheckUsernameUniqueResponseHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         self.callback.on_username_uniqueness_received(UsernameUniquenessResponse(data))
 
 
 class RegisterOrLoginResponseHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         message_type = data["type"]
 
         if message_type == "error":
@@ -149,12 +293,29 @@ class RegisterOrLoginResponseHandler(XmppHandler):
 
 
 class RosterResponseHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
-        self.callback.on_roster_received(FetchRosterResponse(data))
+    def handle(self, data: XmlElement):
+        # with on_roster_peer, peers are passed on one at a time instead of being collected in the response
+        response = FetchRosterResponse(data, stream=self.client.is_subscribed("on_roster_peer"))
+        index = self.client.roster_index
+        if self.client.roster_sync:
+            self.client.roster_sync.handle_response(response, data)
+        elif self.client._index_sync and self.client._index_sync.handle_response(response, data):
+            # a page fetched to refresh out of date groups, which the sync applies to the index only
+            return
+        if response.is_streamed:
+            for peer in response.iter_peers():
+                if index is not None:
+                    index.add_peers((peer,))
+                self.callback.on_roster_peer(peer)
+            if index is not None:
+                index.remove_peers(response.removed_users + response.removed_groups)
+        elif index is not None:
+            index.apply_roster(response)
+        self.callback.on_roster_received(response)
 
 
 class PeersInfoResponseHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         query = data.find("query", recursive=False)
         xmlns = query["xmlns"]
         if xmlns == "kik:iq:friend" and query.find("item", recursive=False):
@@ -167,13 +328,15 @@ class PeersInfoResponseHandler(XmppHandler):
         # add this user to the list of known users if it wasn't encountered before
         for peer_info in peers_info.users:
             self.client._known_users_information.add(peer_info)
+        if self.client.roster_index is not None:
+            self.client.roster_index.add_users(peers_info.users)
         self.client._new_user_added_event.set()
 
         self.callback.on_peer_info_received(peers_info)
 
 
 class XiphiasHandler(XmppHandler):
-    def handle(self, data: BeautifulSoup):
+    def handle(self, data: XmlElement):
         method = data.query["method"]
         if method == "GetUsers":
             self.callback.on_xiphias_get_users_response(UsersResponse(data))
@@ -184,3 +347,136 @@ class XiphiasHandler(XmppHandler):
         else:
             # TODO handle other methods when they are added to the client
             pass
+
+
+class StanzaRouter:
+    """
+    Dispatches incoming stanzas to their handlers, looked up in a table by (stanza name, type, xmlns, app-id).
+
+    - type is the type attribute of the stanza (such as "chat", "groupchat" or "result")
+    - xmlns is the namespace of the query of an iq, or the namespace of any other stanza
+    - app-id is the app ID of the content of a message
+
+    type, xmlns and app_id may be left as None to match any value. When several handlers match a stanza,
+    the most specific one is used: a matching app-id wins over a matching xmlns, which wins over a matching type.
+    A handler is any object with a handle(element) method, usually an XmppHandler. It is reused for every stanza.
+    """
+
+    # the fields used by a key, (type, xmlns, app_id), from the most specific to the least specific
+    _ALL_MASKS = sorted(((t, x, a) for t in (True, False) for x in (True, False) for a in (True, False)), key=lambda m: (m[2], m[1], m[0]), reverse=True)
+
+    def __init__(self):
+        self._handlers = {}  # type: dict[tuple, object]
+        self._masks = []  # type: list[tuple[bool, bool, bool]]  # the masks with at least one handler, in _ALL_MASKS order
+        self._uses_app_id = False  # message contents are only looked for when a handler is registered by app-id
+        self.raw_element_mode = None  # type: str | None  # how the responses parsed by the handlers keep their stanza (see XMPPResponse)
+
+    @classmethod
+    def with_default_handlers(cls, callback: KikClientCallback, client) -> "StanzaRouter":
+        """
+        Creates a router with a handler for every stanza the client understands.
+        """
+        router = cls()
+        chat = XMPPChatMessageHandler(callback, client)
+        peers_info = PeersInfoResponseHandler(callback, client)
+        ignore = IgnoreHandler(callback, client)
+
+        router.register(chat, "message", "chat")
+        router.register(XMPPGroupChatMessageHandler(callback, client), "message", "groupchat")
+        router.register(ReceiptHandler(callback, client), "message", "receipt")
+        router.register(IsTypingHandler(callback, client), "message", "is-typing")
+        router.register(ErrorMessageHandler(callback, client), "message", "error")
+        router.register(StcHandler(callback, client), "stc")
+        router.register(PongHandler(callback, client), "pong")
+        router.register(ignore, "ack")
+
+        router.register(CheckUsernameUniqueResponseHandler(callback, client), "iq", xmlns="kik:iq:check-unique")
+        router.register(RegisterOrLoginResponseHandler(callback, client), "iq", xmlns="jabber:iq:register")
+        router.register(RosterResponseHandler(callback, client), "iq", xmlns="jabber:iq:roster")
+        router.register(peers_info, "iq", xmlns="kik:iq:friend")
+        router.register(peers_info, "iq", xmlns="kik:iq:friend:batch")
+        router.register(XiphiasHandler(callback, client), "iq", xmlns="kik:iq:xiphias:bridge")
+        router.register(client.authenticator, "iq", xmlns="kik:auth:cert")
+        router.register(HistoryHandler(callback, client), "iq", xmlns="kik:iq:QoS")
+        router.register(UserProfileHandler(callback, client), "iq", xmlns="kik:iq:user-profile")
+        router.register(MutedConvosHandler(callback, client), "iq", xmlns="kik:iq:convos")
+        # iq responses without a query (such as the results of group admin requests) aren't handled
+        router.register(ignore, "iq")
+        return router
+
+    def register(self, handler, name: str, type: Union[str, None] = None, xmlns: Union[str, None] = None, app_id: Union[str, None] = None):
+        """
+        Registers the handler of a kind of stanza, replacing the handler previously registered for the same key.
+
+        :param handler: an object with a handle(element) method, such as an XmppHandler
+        :param name: the name of the stanza element, such as "message" or "iq"
+        :param type: the type attribute of the stanza, or None for any type
+        :param xmlns: the namespace of the stanza (of its query for an iq), or None for any namespace
+        :param app_id: the app ID of the content of a message, or None for any app ID
+        :return: the previously registered handler, or None
+        """
+        mask = (type is not None, xmlns is not None, app_id is not None)
+        if mask not in self._masks:
+            self._masks = [m for m in self._ALL_MASKS if m in self._masks or m == mask]
+            self._uses_app_id = any(m[2] for m in self._masks)
+        key = (name, type, xmlns, app_id)
+        previous = self._handlers.get(key)
+        self._handlers[key] = handler
+        return previous
+
+    def get_handler(self, element: XmlElement):
+        """
+        Returns the handler of a stanza, or None if no handler matches it.
+        """
+        name = element.name
+        stanza_type = element.get("type")
+        xmlns = element.get("xmlns")
+        app_id = None
+        if name == "iq":
+            query = element.find("query", recursive=False)
+            xmlns = query.get("xmlns") if query else None
+        elif name == "message" and self._uses_app_id and not isinstance(element, HeadOnlyStanza):
+            content = element.find("content", recursive=False)
+            app_id = content.get("app-id") if content else None
+
+        handlers = self._handlers
+        for use_type, use_xmlns, use_app_id in self._masks:
+            if (use_type and stanza_type is None) or (use_xmlns and xmlns is None) or (use_app_id and app_id is None):
+                continue
+            handler = handlers.get((name, stanza_type if use_type else None, xmlns if use_xmlns else None, app_id if use_app_id else None))
+            if handler is not None:
+                return handler
+        return None
+
+    def dispatch(self, element: XmlElement) -> bool:
+        """
+        Handles a stanza with its handler.
+        Only the name and attributes of the stanza are looked at if its handler has no subscribed events (see XmppHandler.events).
+
+        :return: True if a handler was found for the stanza
+        """
+        handler = self.get_handler(element)
+        if handler is None:
+            return False
+        if self._is_skipped(handler):
+            handler.skip(element)
+        else:
+            with XMPPResponse.use_raw_element_mode(self.raw_element_mode):
+                handler.handle(element)
+        return True
+
+    def is_skipped(self, element) -> bool:
+        """
+        Returns True if a stanza has a handler that would drop it, because it's ignored or nobody listens to its events.
+        Only looks at the name and attributes of the stanza, so it works with a HeadOnlyStanza too.
+        """
+        handler = self.get_handler(element)
+        return handler is not None and self._is_skipped(handler)
+
+    @staticmethod
+    def _is_skipped(handler) -> bool:
+        if isinstance(handler, IgnoreHandler):
+            return True
+        # nobody listens to what this stanza would turn into, don't parse it
+        has_listeners = getattr(handler, "has_listeners", None)
+        return has_listeners is not None and not has_listeners()
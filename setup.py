@@ -53,7 +53,7 @@ setup(
         "beautifulsoup4~=4.12.2",
         "colorama",
     ],
-    extras_require={"dev": [], "test": []},
+    extras_require={"dev": [], "test": [], "speedups": ["numpy"]},
     package_data={"kik_unofficial": []},
     entry_points={"console_scripts": ["kikapi=kik_unofficial.cmdline:execute"]},
 )